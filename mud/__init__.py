@@ -2,9 +2,12 @@ from .notation      import Note, Duration, Rest, Pitch, Time
 from .event         import Event
 from .span          import Span
 from .piece         import Piece
-from .timeslice     import SlicedEvent, TimeSlice
+from .timeslice     import SlicedEvent, TimeSlice, SliceHierarchy, SliceMask
 from .corpus        import Corpus, DataCorpus
+from .stream        import ShuffledStream, FileFormatter, PieceWindows
 from .settings      import settings
 
 from . import fmt
 from . import piece_filter
+from . import piano_roll
+from . import fingerprint
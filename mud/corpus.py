@@ -5,15 +5,22 @@ Module containing the Corpus class, which provides methods for loading an entire
 from __future__ import annotations
 
 from glob import iglob
+from concurrent.futures import ProcessPoolExecutor
+import os
 import random
 import pickle
+import tempfile
 import music21 as mu
-from typing import Optional, Iterable, Tuple, Callable
+import numpy as np
+from typing import Optional, Iterable, Tuple, Callable, List
 
 from .piece import Piece
 from .fmt import EventDataBuilder
-from .fmt.piece_data import PieceData
+from .fmt.storage import BitPackedMatrix, DictionaryEncodedMatrix
+from .fmt.piece_data import BarData, PieceData, PackedPieceData, estimate_bar_sizes, split_bar_ranges, \
+                            bar_range_pieces, format_packed_piece
 from . import piece_filter
+from .fingerprint import fingerprint
 
 class AbstractCorpus(object):
     # Common code for save/loading of corpuses.
@@ -157,12 +164,53 @@ class Corpus(AbstractCorpus):
             self,
             formatter:        EventDataBuilder,
             slice_resolution: float,
-            discard_rests:    Optional[bool] = False) -> DataCorpus:
+            discard_rests:    Optional[bool] = False,
+            bit_packed:       Optional[bool] = False,
+            packed:           Optional[bool] = False,
+            cache_dir:        Optional[str] = None,
+            workers:          Optional[int] = None,
+            bar_dictionary:   Optional[bool] = False,
+            dictionary_encoded: Optional[bool] = False) -> DataCorpus:
         '''
         Return a DataCorpus object containing the pieces in this Corpus formatted according to the
         given formatter object.
+        If `cache_dir` is provided, the DataCorpus is cached there under the fingerprints of this
+        corpus, the formatter and the other arguments, and later calls with matching fingerprints
+        load it instead of formatting the pieces again.
+        `workers` is the number of processes to format pieces with, `bar_dictionary` formats
+        each distinct bar once, and `dictionary_encoded` stores each distinct vector once (see
+        DataCorpus).
         '''
-        return DataCorpus(self, formatter, slice_resolution, discard_rests)
+        args = (slice_resolution, discard_rests, bit_packed, packed)
+        options = dict(bar_dictionary=bar_dictionary, dictionary_encoded=dictionary_encoded)
+        if cache_dir is None:
+            return DataCorpus(self, formatter, *args, workers=workers, **options)
+
+        key = fingerprint(DataCorpus.__qualname__, self.fingerprint(), formatter.fingerprint(),
+                          args, options)
+        path = os.path.join(cache_dir, f'{key}.datacorpus')
+        if os.path.exists(path):
+            return DataCorpus.from_file(path)
+        data_corpus = DataCorpus(self, formatter, *args, workers=workers, **options)
+        # Write to a temporary file first, so concurrent or interrupted runs never leave a partial
+        # cache entry behind.
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            data_corpus.save(temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return data_corpus
+
+    def fingerprint(self) -> str:
+        '''
+        A stable hex digest of the content of the pieces in this corpus, in order
+        (see `mud.Piece.fingerprint`).
+        '''
+        return fingerprint(tuple(piece.fingerprint() for piece in self._pieces))
 
     def filter(self, *filters: Callable[Piece, bool]):
         '''
@@ -185,15 +233,91 @@ class DataCorpus(AbstractCorpus):
     '''
     A DataCorpus contains only ""data"" of a collection of pieces, intended for use as inputs and
     targets for a machine learning model. See the `mud.fmt.PieceData` class for more info.
+    With `bit_packed`, event vectors are stored packed 8 columns per byte (see
+    `mud.fmt.PieceData.pack_bits`), which requires a formatter with only binary features.
+    With `packed`, each piece is stored as a `mud.fmt.PackedPieceData` (flat arrays with offsets)
+    instead of a tree of objects.
+    With `workers` > 1, pieces are formatted in a pool of that many processes. Workers send back
+    packed arrays rather than object trees, and pieces are kept in the corpus order. Work is
+    balanced by the estimated number of events of each piece: long pieces are split into ranges
+    of bars that are formatted concurrently, and the largest tasks are scheduled first.
+    With `bar_dictionary`, each distinct bar (see `mud.Span.content_key`) in the corpus is
+    formatted once, into `bar_dictionary`, and pieces hold references to those shared BarData
+    (`bar_ids[i]` holds the dictionary index of each bar of piece i). This can't be combined with
+    `packed`.
+    With `dictionary_encoded`, the distinct event vectors of the whole corpus are stored once, in a
+    shared table, and each event stores a 16 or 32-bit id into it (see
+    `mud.fmt.storage.DictionaryEncodedMatrix`). Vectors are gathered from the table on access.
+    With `bit_packed` as well, the table itself is bit-packed.
     '''
     def __init__(
             self,
             corpus:           Corpus,
             formatter:        EventDataBuilder,
             slice_resolution: float,
-            discard_rests:    bool = False):
-        self._data = [PieceData(p, formatter, slice_resolution, discard_rests)
-                      for p in corpus.pieces]
+            discard_rests:    bool = False,
+            bit_packed:       bool = False,
+            packed:           bool = False,
+            workers:          Optional[int] = None,
+            bar_dictionary:   bool = False,
+            dictionary_encoded: bool = False):
+        self._bar_dictionary = None
+        self._bar_ids = None
+        if bar_dictionary:
+            if packed:
+                raise ValueError('A DataCorpus with a bar dictionary can\'t be packed')
+            self._format_bar_dictionary(corpus, formatter, slice_resolution, discard_rests,
+                                        bit_packed, workers, dictionary_encoded)
+            return
+        if workers is not None and workers > 1:
+            self._data = _format_in_pool(corpus.pieces, formatter, slice_resolution,
+                                         discard_rests,
+                                         bit_packed and packed and not dictionary_encoded,
+                                         workers)
+            if not packed:
+                self._data = [piece_data.unpack(formatter) for piece_data in self._data]
+        else:
+            piece_data_type = PackedPieceData if packed else PieceData
+            self._data = [piece_data_type(p, formatter, slice_resolution, discard_rests)
+                          for p in corpus.pieces]
+        if dictionary_encoded:
+            self._data = _dictionary_encode(self._data, bit_packed)
+        elif bit_packed:
+            self._data = [piece_data.pack_bits() for piece_data in self._data]
+
+    def _format_bar_dictionary(self, corpus, formatter, slice_resolution, discard_rests,
+                               bit_packed, workers, dictionary_encoded):
+        unique_bars = {}
+        self._bar_ids = [np.array([unique_bars.setdefault(bar, len(unique_bars))
+                                   for bar in piece.bars()], dtype='int64')
+                         for piece in corpus.pieces]
+        dictionary = PieceData(Piece.from_spans(*unique_bars), formatter, slice_resolution,
+                               discard_rests, workers)
+        if dictionary_encoded:
+            dictionary = _dictionary_encode([dictionary], bit_packed)[0]
+        elif bit_packed:
+            dictionary = dictionary.pack_bits()
+        self._bar_dictionary = dictionary.bars
+        self._data = [PieceData.from_bars((self._bar_dictionary[i] for i in bar_ids),
+                                          dictionary.output_library())
+                      for bar_ids in self._bar_ids]
+
+    @property
+    def bar_dictionary(self) -> Optional[List[BarData]]:
+        ''' The distinct formatted bars of the corpus, or None without a bar dictionary. '''
+        return self._bar_dictionary
+
+    @property
+    def bar_ids(self) -> Optional[List[np.ndarray]]:
+        ''' The bar dictionary index of each bar of each piece, or None without a dictionary. '''
+        return self._bar_ids
+
+    @classmethod
+    def from_file(cls, fname: str) -> DataCorpus:
+        ''' Load a DataCorpus saved with `save`. '''
+        data_corpus = cls.__new__(cls)
+        data_corpus.load(fname)
+        return data_corpus
 
     def size(self) -> int:
         return len(self._data)
@@ -208,4 +332,47 @@ class DataCorpus(AbstractCorpus):
     def __len__(self) -> int:
         return len(self._data)
 
+def _dictionary_encode(pieces_data, bit_packed):
+    ''' Dictionary encode the vectors of several PieceData/PackedPieceData with a shared table. '''
+    encoded = DictionaryEncodedMatrix.encode_many(
+        [piece_data.vector_matrix() for piece_data in pieces_data])
+    if bit_packed and len(encoded) > 0:
+        table = BitPackedMatrix.from_dense(encoded[0].table)
+        encoded = [DictionaryEncodedMatrix(table, matrix.ids) for matrix in encoded]
+    return [piece_data.with_vector_storage(matrix)
+            for piece_data, matrix in zip(pieces_data, encoded)]
+
+# Pieces are split so that there are about this many tasks per worker, which lets the pool
+# balance the work without splitting typical pieces.
+_tasks_per_worker = 4
+
+def _format_in_pool(pieces, formatter, slice_resolution, discard_rests, bit_packed, workers):
+    '''
+    Format pieces as PackedPieceData in a process pool (see DataCorpus). Pieces with more than
+    their share of the estimated events are split into ranges of bars, tasks are submitted from
+    the largest to the smallest, and the parts of each piece are concatenated in order.
+    '''
+    bar_sizes = [estimate_bar_sizes(piece, slice_resolution) for piece in pieces]
+    target_size = sum(sizes.sum() for sizes in bar_sizes) / (workers * _tasks_per_worker)
+    tasks = []
+    for piece_index, (piece, sizes) in enumerate(zip(pieces, bar_sizes)):
+        num_parts = max(1, int(sizes.sum() // max(target_size, 1)))
+        if num_parts == 1:
+            tasks.append((sizes.sum(), piece_index, 0, piece))
+            continue
+        ranges = split_bar_ranges(sizes, num_parts)
+        for part, ((start, stop), part_piece) in enumerate(zip(ranges,
+                                                               bar_range_pieces(piece, ranges))):
+            tasks.append((sizes[start:stop].sum(), piece_index, part, part_piece))
+    tasks.sort(key=lambda task: -task[0])
 
+    parts = [{} for _ in pieces]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [(piece_index, part, executor.submit(format_packed_piece, part_piece, formatter,
+                                                       slice_resolution, discard_rests,
+                                                       bit_packed))
+                   for _, piece_index, part, part_piece in tasks]
+        for piece_index, part, future in futures:
+            parts[piece_index][part] = future.result()
+    return [PackedPieceData.concatenate(piece_parts[i] for i in range(len(piece_parts)))
+            for piece_parts in parts]
@@ -0,0 +1,88 @@
+'''
+Stable fingerprints (content hashes) of configuration objects and data, e.g. for caching formatted
+data on disk. Unlike the builtin `hash`, fingerprints are the same across processes and sessions.
+'''
+
+import enum
+import hashlib
+import types
+import numpy as np
+
+def fingerprint(*objects):
+    '''
+    Return a hex digest identifying the content of the given objects.
+    Supported objects are None, bools, numbers, strings, numpy arrays, enums, (nested) tuples,
+    lists, sets and dicts of these, and other objects by their class and attributes (see
+    `vars`). Attributes named in an object's `_fingerprint_exclude` (e.g. lazily built caches)
+    are ignored.
+    Functions are identified by their name and bytecode, including constants, default arguments
+    and the contents of closure cells, so different lambdas or closures made by the same factory
+    get different fingerprints. Bound methods also include the object they are bound to.
+    Bytecode changes between Python versions, so fingerprints of functions do too.
+    '''
+    hasher = hashlib.sha256()
+    for obj in objects:
+        _update(hasher, obj)
+    return hasher.hexdigest()
+
+def _update(hasher, obj):
+    def write(*parts):
+        for part in parts:
+            hasher.update(part if isinstance(part, bytes) else str(part).encode())
+            hasher.update(b'\0')
+
+    if obj is None or isinstance(obj, (bool, int, float, str, bytes)):
+        write(type(obj).__name__, repr(obj))
+    elif isinstance(obj, np.generic):
+        _update(hasher, obj.item())
+    elif isinstance(obj, np.ndarray):
+        write('ndarray', obj.dtype.str, obj.shape, np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (np.dtype, enum.Enum)):
+        write(type(obj).__name__, str(obj))
+    elif isinstance(obj, (tuple, list)):
+        write(type(obj).__name__, len(obj))
+        for item in obj:
+            _update(hasher, item)
+    elif isinstance(obj, (set, frozenset)):
+        write('set', len(obj))
+        for item_fingerprint in sorted(fingerprint(item) for item in obj):
+            write(item_fingerprint)
+    elif isinstance(obj, dict):
+        write('dict', len(obj))
+        for key, value in sorted((fingerprint(k), fingerprint(v)) for k, v in obj.items()):
+            write(key, value)
+    elif isinstance(obj, types.MethodType):
+        write('method')
+        _update(hasher, obj.__func__)
+        _update(hasher, obj.__self__)
+    elif isinstance(obj, types.FunctionType):
+        write('function', obj.__module__, obj.__qualname__)
+        _update(hasher, obj.__code__)
+        _update(hasher, obj.__defaults__)
+        _update(hasher, obj.__kwdefaults__)
+        cells = obj.__closure__ or ()
+        write('closure', len(cells))
+        for cell in cells:
+            try:
+                contents = cell.cell_contents
+            except ValueError:
+                write('empty cell')
+                continue
+            # A nested function that calls itself holds itself in a closure cell.
+            if contents is obj:
+                write('self')
+            else:
+                _update(hasher, contents)
+    elif isinstance(obj, types.CodeType):
+        write('code', obj.co_code, obj.co_names, obj.co_varnames)
+        _update(hasher, obj.co_consts)
+    elif isinstance(obj, types.BuiltinFunctionType):
+        write('builtin', obj.__module__, obj.__qualname__)
+        if obj.__self__ is not None and not isinstance(obj.__self__, types.ModuleType):
+            _update(hasher, obj.__self__)
+    else:
+        cls = type(obj)
+        write('object', cls.__module__, cls.__qualname__)
+        exclude = getattr(obj, '_fingerprint_exclude', ())
+        state = vars(obj) if hasattr(obj, '__dict__') else {}
+        _update(hasher, {name: value for name, value in state.items() if name not in exclude})
@@ -1,6 +1,12 @@
 from .data import EventDataBuilder
-from .piece_data import EventData, TimeSliceData, BarData, PieceData
-from .binary_vector import binvec
+from .piece_data import EventData, TimeSliceData, BarData, RunLengthBarData, PieceData, \
+                         MultiResolutionPieceData, PackedEventData, PackedPieceData, \
+                         PackedBarData, PackedTimeSliceData
+from .binary_vector import binvec, binmat
+from .storage import BitPackedMatrix, DictionaryEncodedMatrix
+from .batching import Batch, BucketBatchSampler, WindowSampler, pad_sequences
+from .dataset import CorpusArrays, PieceDataset, IterablePieceDataset, collate
+from .prefetch import Prefetcher
 
 from . import label
 from . import feature
\ No newline at end of file
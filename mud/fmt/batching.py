@@ -0,0 +1,337 @@
+'''
+Batching of formatted pieces for training: pieces are grouped into buckets of similar length and
+padded into dense arrays with masks, to keep the amount of padding (and wasted compute) low.
+'''
+
+import numpy as np
+from .data import OutputLibrary, _numpy_to_output_library_format
+from .piece_data import PackedPieceData
+from .storage import row_range
+from .label import NO_LABEL
+
+granularities = ('event', 'timeslice', 'bar')
+
+def check_granularity(granularity):
+    if granularity not in granularities:
+        raise ValueError(f'Unknown granularity `{granularity}`, must be one of {granularities}')
+
+def as_packed(piece_data):
+    ''' Return a PieceData or PackedPieceData as a PackedPieceData. '''
+    if isinstance(piece_data, PackedPieceData):
+        return piece_data
+    return PackedPieceData.from_piece_data(piece_data)
+
+def element_offsets(packed, granularity):
+    '''
+    The event offsets of the elements of a PackedPieceData at a granularity: element i holds the
+    events [offsets[i], offsets[i + 1]).
+    '''
+    check_granularity(granularity)
+    if granularity == 'event':
+        return np.arange(packed.num_events() + 1, dtype='int64')
+    if granularity == 'timeslice':
+        return packed.slice_offsets
+    return packed.slice_offsets[packed.bar_offsets]
+
+class Batch(object):
+    '''
+    A batch of padded sequences:
+        - `vectors`: (batch x length x dim) event vectors at 'event' granularity, or
+          (batch x length x events x dim) at 'timeslice' and 'bar' granularity, where the events
+          of each timeslice or bar are padded as well,
+        - `labels`: the matching integer labels, with a trailing labeller axis instead of `dim`
+          and padding marked by mud.fmt.label.NO_LABEL,
+        - `mask`: a boolean array, True at the events (not the padding), shaped like `vectors`
+          without its last axis,
+        - `lengths`: the number of elements (events, timeslices or bars) of each sequence,
+        - `indices`: the index of each sequence in the batched data,
+        - `starts`: for windows (see WindowSampler.batch), the element each window starts at in
+          its piece, and None otherwise.
+    '''
+    def __init__(self, vectors, labels, mask, lengths, indices, starts=None):
+        self.vectors = vectors
+        self.labels = labels
+        self.mask = mask
+        self.lengths = lengths
+        self.indices = indices
+        self.starts = starts
+
+    def _arrays(self):
+        arrays = (self.vectors, self.labels, self.mask, self.lengths, self.indices)
+        return arrays if self.starts is None else arrays + (self.starts,)
+
+    def efficiency(self):
+        ''' The fraction of the padded batch taken up by events. '''
+        size = int(np.prod(self.mask.shape))
+        return float(self.mask.sum()) / size if size > 0 else 1.0
+
+    def to_torch(self, pin_memory=False):
+        ''' Return the batch with its arrays converted to torch tensors with torch.from_numpy. '''
+        return Batch(*[_numpy_to_output_library_format(array, OutputLibrary.TORCH, pin_memory)
+                       for array in self._arrays()])
+
+    def pin_memory(self):
+        ''' Pin the memory of a batch of tensors (called by torch's DataLoader). '''
+        return Batch(*[tensor.pin_memory() for tensor in self._arrays()])
+
+    def __len__(self):
+        return len(self.indices)
+
+def pad_sequences(sequences, granularity='event', indices=None):
+    '''
+    Pad sequences into a Batch. Each sequence is a `(vectors, labels, offsets)` tuple, where
+    `vectors` and `labels` are event arrays (e.g. of a whole piece) and `offsets` the event offsets
+    of the sequence's elements into them (see element_offsets), so a sequence can be any range of
+    elements of a piece. At 'event' granularity the offsets of every event must be given.
+    Events are copied into the batch with one vectorized assignment per sequence.
+    '''
+    check_granularity(granularity)
+    sequences = list(sequences)
+    if indices is None:
+        indices = np.arange(len(sequences))
+    dims = [vectors.shape[1] for vectors, _, _ in sequences if len(vectors) > 0]
+    dim = dims[0] if len(dims) > 0 else 0
+    num_labels = max([labels.shape[1] for _, labels, _ in sequences], default=0)
+    dtype = np.result_type(*[vectors.dtype for vectors, _, _ in sequences]) \
+        if len(sequences) > 0 else np.dtype('float64')
+    nested = granularity != 'event'
+    lengths = np.array([len(offsets) - 1 for _, _, offsets in sequences], dtype='int64')
+    shape = (len(sequences), max(lengths, default=0))
+    if nested:
+        element_sizes = [np.diff(offsets) for _, _, offsets in sequences]
+        shape += (max([sizes.max(initial=0) for sizes in element_sizes], default=0),)
+
+    vectors = np.zeros(shape + (dim,), dtype=dtype)
+    labels = np.full(shape + (num_labels,), NO_LABEL, dtype='int64')
+    mask = np.zeros(shape, dtype='bool')
+    for b, (sequence_vectors, sequence_labels, offsets) in enumerate(sequences):
+        if lengths[b] == 0:
+            continue
+        rows = slice(offsets[0], offsets[-1])
+        if nested:
+            sizes = element_sizes[b]
+            elements = np.repeat(np.arange(len(sizes)), sizes)
+            positions = np.arange(len(elements)) - np.repeat(offsets[:-1] - offsets[0], sizes)
+            where = (b, elements, positions)
+        else:
+            where = (b, slice(0, lengths[b]))
+        vectors[where] = sequence_vectors[rows]
+        labels[where] = sequence_labels[rows]
+        mask[where] = True
+    return Batch(vectors, labels, mask, lengths, np.asarray(indices))
+
+class BucketBatchSampler(object):
+    '''
+    Iterate over padded Batches (see Batch) of the pieces of a DataCorpus, or of a list of
+    PieceData/PackedPieceData. Each piece is a sequence of events, timeslices or bars (see
+    `granularity`).
+    To keep padding low, the (shuffled) pieces are split into buckets of `batches_per_bucket`
+    batches, each bucket is sorted by length and cut into batches, and the order of the batches
+    is shuffled. Larger buckets give less padding but less random batches.
+    The batches of an epoch only depend on `seed` and the epoch (see set_epoch), so iteration is
+    reproducible; with `shuffle` False, pieces are bucketed in order and batches are not shuffled.
+    '''
+    def __init__(self, data, batch_size, granularity='event', batches_per_bucket=16,
+                 shuffle=True, seed=None):
+        check_granularity(granularity)
+        if batch_size < 1 or batches_per_bucket < 1:
+            raise ValueError('batch_size and batches_per_bucket must be at least 1')
+        self.batch_size = batch_size
+        self.granularity = granularity
+        self.batches_per_bucket = batches_per_bucket
+        self.shuffle = shuffle
+        self.seed = seed if seed is not None else int(np.random.SeedSequence().entropy % 2**32)
+        self.epoch = 0
+        self._pieces = [as_packed(piece_data) for piece_data in data]
+        self._offsets = [element_offsets(packed, granularity) for packed in self._pieces]
+        self._lengths = np.array([len(offsets) - 1 for offsets in self._offsets], dtype='int64')
+        # The padded size of a piece along each axis but the first.
+        self._widths = np.array([np.diff(offsets).max(initial=0) for offsets in self._offsets],
+                                dtype='int64')
+
+    def set_epoch(self, epoch):
+        ''' Set the epoch, which (with the seed) determines the batches of the next iteration. '''
+        self.epoch = epoch
+
+    def lengths(self):
+        ''' The number of elements (events, timeslices or bars) of each piece. '''
+        return self._lengths
+
+    def batches(self, epoch=None):
+        ''' Return the piece indices of each batch of an epoch (by default, the current one). '''
+        rng = np.random.default_rng((self.seed, self.epoch if epoch is None else epoch))
+        order = rng.permutation(len(self._pieces)) if self.shuffle \
+            else np.arange(len(self._pieces))
+        bucket_size = self.batch_size * self.batches_per_bucket
+        batches = []
+        for start in range(0, len(order), bucket_size):
+            bucket = order[start:start + bucket_size]
+            bucket = bucket[np.argsort(self._lengths[bucket], kind='stable')]
+            batches.extend(bucket[i:i + self.batch_size]
+                           for i in range(0, len(bucket), self.batch_size))
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    def padding_stats(self, epoch=None):
+        '''
+        Return padding statistics for the batches of an epoch, as a dict of:
+            - 'events': the number of events,
+            - 'padded': the number of event positions in the padded batches,
+            - 'efficiency': events / padded, the fraction of compute not spent on padding,
+            - 'min_efficiency': the efficiency of the worst batch.
+        '''
+        num_events = np.array([packed.num_events() for packed in self._pieces], dtype='int64')
+        events, padded, efficiencies = 0, 0, []
+        for batch in self.batches(epoch):
+            batch_padded = len(batch) * self._lengths[batch].max(initial=0)
+            if self.granularity != 'event':
+                batch_padded *= self._widths[batch].max(initial=0)
+            batch_events = num_events[batch].sum()
+            events += batch_events
+            padded += batch_padded
+            efficiencies.append(batch_events / batch_padded if batch_padded > 0 else 1.0)
+        return {'events': int(events),
+                'padded': int(padded),
+                'efficiency': events / padded if padded > 0 else 1.0,
+                'min_efficiency': min(efficiencies, default=1.0)}
+
+    def batch(self, indices):
+        ''' Return the Batch of the pieces with the given indices. '''
+        return pad_sequences([(self._pieces[i].vector_matrix(), self._pieces[i].labels,
+                               self._offsets[i])
+                              for i in indices],
+                             self.granularity, indices)
+
+    def __iter__(self):
+        for indices in self.batches():
+            yield self.batch(indices)
+
+    def __len__(self):
+        bucket_size = self.batch_size * self.batches_per_bucket
+        full_buckets, remainder = divmod(len(self._pieces), bucket_size)
+        return full_buckets * self.batches_per_bucket + -(-remainder // self.batch_size)
+
+class WindowSampler(object):
+    '''
+    Sample fixed-length windows of `length` elements (events, timeslices or bars, see
+    `granularity`) from the pieces of a DataCorpus, or of a list of PieceData/PackedPieceData.
+    Pieces are kept packed: a window is a `(piece, start)` pair, and window() returns views of
+    the piece's arrays, so events are only copied into the final padded Batch.
+    Windows start at every `stride`-th candidate element, where candidates are every element or,
+    with `align` set to 'timeslice' or 'bar', the first element of each timeslice or bar (which
+    must not be finer than `granularity`). Only complete windows are used, except that a piece
+    shorter than `length` gives a single window from its start (padded in batches).
+    Random windows are drawn uniformly from all windows with `weight_by_length`, so longer pieces
+    are sampled more, or from a uniformly drawn piece otherwise. They only depend on `seed` and
+    the epoch (see set_epoch).
+    '''
+    def __init__(self, data, length, granularity='timeslice', stride=1, align=None,
+                 weight_by_length=True, seed=None):
+        check_granularity(granularity)
+        if align is not None:
+            check_granularity(align)
+            if granularities.index(align) < granularities.index(granularity):
+                raise ValueError(f'can\'t align {granularity} windows to {align} boundaries')
+        if length < 1 or stride < 1:
+            raise ValueError('length and stride must be at least 1')
+        self.length = length
+        self.granularity = granularity
+        self.stride = stride
+        self.align = align
+        self.weight_by_length = weight_by_length
+        self.seed = seed if seed is not None else int(np.random.SeedSequence().entropy % 2**32)
+        self.epoch = 0
+        self._pieces = [as_packed(piece_data) for piece_data in data]
+        self._offsets = [element_offsets(packed, granularity) for packed in self._pieces]
+        # The candidate starts of every piece, concatenated (CSR style).
+        starts = [self._window_starts(packed, offsets)
+                  for packed, offsets in zip(self._pieces, self._offsets)]
+        self._num_windows = np.array([len(s) for s in starts], dtype='int64')
+        self._start_offsets = np.concatenate([[0], np.cumsum(self._num_windows)]).astype('int64')
+        self._starts = np.concatenate(starts + [np.zeros(0, dtype='int64')]).astype('int64')
+
+    def _window_starts(self, packed, offsets):
+        num_elements = len(offsets) - 1
+        if self.align is None or self.align == self.granularity:
+            candidates = np.arange(num_elements)
+        elif self.granularity == 'timeslice':
+            candidates = packed.bar_offsets[:-1]
+        elif self.align == 'timeslice':
+            candidates = packed.slice_offsets[:-1]
+        else:
+            candidates = packed.slice_offsets[packed.bar_offsets[:-1]]
+        # Empty timeslices or bars share their first element with the next one.
+        candidates = np.unique(candidates)
+        if num_elements < self.length:
+            candidates = candidates[:1] if num_elements > 0 else candidates
+        else:
+            candidates = candidates[candidates + self.length <= num_elements]
+        return candidates[::self.stride]
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def num_windows(self, piece=None):
+        ''' The number of windows of a piece, or of every piece. '''
+        return int(self._num_windows.sum() if piece is None else self._num_windows[piece])
+
+    def window_starts(self, piece):
+        ''' The start elements of the windows of a piece. '''
+        return self._starts[self._start_offsets[piece]:self._start_offsets[piece + 1]]
+
+    def windows(self):
+        ''' Return every window as `(pieces, starts)` arrays, in order. '''
+        return np.repeat(np.arange(len(self._pieces)), self._num_windows), self._starts
+
+    def sample(self, num_windows, rng=None):
+        '''
+        Draw `num_windows` random windows (with replacement) using the numpy Generator `rng`,
+        returned as `(pieces, starts)` arrays.
+        '''
+        if self.num_windows() == 0:
+            raise ValueError('there are no windows to sample from')
+        if rng is None:
+            rng = np.random.default_rng()
+        if self.weight_by_length:
+            windows = rng.integers(self.num_windows(), size=num_windows)
+            pieces = np.searchsorted(self._start_offsets, windows, side='right') - 1
+        else:
+            pieces = rng.choice(np.flatnonzero(self._num_windows), size=num_windows)
+            windows = self._start_offsets[pieces] + \
+                (rng.random(num_windows) * self._num_windows[pieces]).astype('int64')
+        return pieces, self._starts[windows]
+
+    def window(self, piece, start):
+        '''
+        Return the window of a piece starting at element `start` as a `(vectors, labels,
+        offsets)` tuple, where `vectors` and `labels` are views of the window's rows of the
+        piece's arrays (see mud.fmt.storage.row_range) and `offsets` the event offsets of its
+        elements (see element_offsets).
+        '''
+        packed, offsets = self._pieces[piece], self._offsets[piece]
+        offsets = offsets[start:start + self.length + 1]
+        first, last = offsets[0], offsets[-1]
+        return (row_range(packed.vectors, first, last), packed.labels[first:last],
+                offsets - first)
+
+    def batch(self, pieces, starts):
+        '''
+        Return the padded Batch of the given windows; `indices` holds their pieces and `starts`
+        their starts.
+        '''
+        batch = pad_sequences([self.window(piece, start) for piece, start in zip(pieces, starts)],
+                              self.granularity, pieces)
+        batch.starts = np.asarray(starts, dtype='int64')
+        return batch
+
+    def batches(self, batch_size, num_batches=None):
+        '''
+        Iterate over Batches of random windows for the current epoch: `num_batches` batches, or
+        by default as many as are needed to draw `num_windows()` windows.
+        '''
+        if num_batches is None:
+            num_batches = -(-self.num_windows() // batch_size)
+        rng = np.random.default_rng((self.seed, self.epoch))
+        for _ in range(num_batches):
+            yield self.batch(*self.sample(batch_size, rng))
@@ -1,11 +1,31 @@
 import numpy as np
 
-def binvec(length, *indices):
+def binvec(length, *indices, out=None, dtype='float'):
     '''
     build a binary vector with the given length, filled with zeros except
     for the values at the indices provided, which are 1.
+    if `out` is provided, the vector is written into it instead of a new array, otherwise a new
+    array of the given dtype is returned.
     '''
-    v = np.zeros(length, dtype='float')
-    for i in indices:
-        v[i] = 1.0
-    return v
\ No newline at end of file
+    v = np.zeros(length, dtype=dtype) if out is None else out
+    if out is not None:
+        v[...] = 0
+    if len(indices) > 0:
+        v[np.asarray(indices, dtype='int').reshape(-1)] = 1
+    return v
+
+def binmat(length, indices, out=None, dtype='float'):
+    '''
+    build a binary matrix with one row per entry of indices and `length` columns,
+    filled with zeros except for a 1 in each row at the given index.
+    rows with a negative index are left as all zeros.
+    if `out` is provided, the matrix is written into it instead of a new array, otherwise a new
+    array of the given dtype is returned.
+    '''
+    indices = np.asarray(indices, dtype='int')
+    m = np.zeros((len(indices), length), dtype=dtype) if out is None else out
+    if out is not None:
+        m[...] = 0
+    rows = np.flatnonzero(indices >= 0)
+    m[rows, indices[rows]] = 1
+    return m
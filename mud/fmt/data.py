@@ -5,7 +5,11 @@ Utilities for building feature vectors from notes.
 import numpy as np
 import enum
 from . import feature
+from .event_arrays import EventArrays
+from .label import NO_LABEL
 from ..event import Event
+from ..piece import Piece
+from ..fingerprint import fingerprint
 
 class OutputLibrary(enum.Enum):
     NUMPY = 1
@@ -16,15 +20,36 @@ str_to_lib = {
     'torch': OutputLibrary.TORCH,
 }
 
-def _numpy_to_output_library_format(nparray, output_library):
-    if output_library is OutputLibrary.NUMPY:
-        return nparray
-    if output_library is OutputLibrary.TORCH:
+_torch = None
+
+def _import_torch():
+    ''' Import torch on first use only, so it remains an optional dependency. '''
+    global _torch
+    if _torch is None:
         try:
             import torch
-            return torch.Tensor(nparray)
         except (ImportError, ModuleNotFoundError):
             raise ValueError('Using output library pytorch, which is could not be imported')
+        _torch = torch
+    return _torch
+
+def _numpy_to_output_library_format(nparray, output_library, pin_memory=False):
+    '''
+    Convert a numpy array to the output library's format. Torch tensors share memory with the
+    (contiguous) array where possible and keep its dtype, except that unsigned types other than
+    uint8 are widened to a signed type, which torch supports fully.
+    If `pin_memory` is set, torch tensors are copied into page-locked memory, for faster
+    transfers to an accelerator.
+    '''
+    if output_library is OutputLibrary.NUMPY:
+        return nparray
+    if output_library is OutputLibrary.TORCH:
+        torch = _import_torch()
+        nparray = np.ascontiguousarray(nparray)
+        if nparray.dtype.kind == 'u' and nparray.dtype != np.uint8:
+            nparray = nparray.astype('int32' if nparray.dtype.itemsize < 4 else 'int64')
+        tensor = torch.from_numpy(nparray)
+        return tensor.pin_memory() if pin_memory else tensor
     else:
         raise ValueError('Cannot convert output vector to unsupported format {}'.format(output_library))
 
@@ -38,21 +63,89 @@ class DataBuilder(object):
 class EventDataBuilder(DataBuilder):
     '''
     Class that builds vectors and labels from Events.
+    Vectors are built with the given numpy `dtype` (e.g. 'float32', 'float16', 'uint8' or
+    'bool'). By default, it is float64 with numpy, which is exact for every feature, and float32
+    with torch, the type of torch's floating point tensors and models. Smaller types trade
+    precision of continuous features (e.g. NoteOctaveContinuous) for memory.
+    Batches built by make_matrix/make_index_matrix are converted to the output library in one
+    step; with `pin_memory`, torch batches are allocated in page-locked memory.
     '''
-    def __init__(self, features, labels, library=OutputLibrary.NUMPY):
+    def __init__(self, features, labels, library=OutputLibrary.NUMPY, dtype=None,
+                 pin_memory=False):
         self._features = features
+        self._output_library = str_to_lib[library] if isinstance(library, str) else library
+        if dtype is None:
+            dtype = 'float32' if self._output_library is OutputLibrary.TORCH else 'float64'
+        self._dtype = np.dtype(dtype)
+        self._pin_memory = pin_memory
         self._labels = labels
         self._vec_len = sum(f.dim() for f in features)
-        self._output_library = str_to_lib[library] if isinstance(library, str) else library
+        # The columns of the output vector that each feature writes to.
+        self._columns = []
+        start = 0
+        for f in features:
+            self._columns.append(slice(start, start + f.dim()))
+            start += f.dim()
+        self._tables = None
+        self._category_tables = None
+        self._label_indices = None
+
+    def compile(self):
+        '''
+        Precompute lookup tables for every tabulable feature (see Feature.lookup_table), so that
+        formatting an event with them is a table lookup by key rather than building a subvector.
+        Features that can't be tabulated (e.g. BooleanFlag, or user-defined features) are still
+        formatted as usual. Returns this EventDataBuilder.
+        '''
+        self._tables = [f.lookup_table() if f.tabulable else None for f in self._features]
+        return self
+
+    def is_compiled(self):
+        return self._tables is not None
+
+    def _feature_tables(self):
+        if self._tables is None:
+            return [None for _ in self._features]
+        return self._tables
+
+    @staticmethod
+    def _check_table_keys(f, valid, keys):
+        if not np.all(valid[keys]):
+            raise ValueError(f'Event can\'t be formatted by feature {type(f).__name__}')
 
     def dim(self):
         return self._vec_len
 
-    def _make_numpy_subvectors(self, event, **kwargs):
-        return [feature.make_subvector(event, **kwargs) for feature in self._features]
+    def dtype(self):
+        return self._dtype
+
+    def output_library(self):
+        return self._output_library
+
+    def fingerprint(self):
+        '''
+        A stable hex digest of the builder's configuration: the classes and parameters of its
+        features and labels, its output library and its dtype. Builders with the same fingerprint
+        format events identically (see mud.fingerprint).
+        '''
+        return fingerprint(self.__class__.__qualname__, tuple(self._features),
+                           tuple(self._labels), self._output_library, self._dtype)
+
+    def feature_columns(self):
+        ''' The slice of the output vector produced by each feature, in feature order. '''
+        return list(self._columns)
 
     def _make_numpy_vector(self, event, **kwargs):
-        return np.concatenate(self._make_numpy_subvectors(event, **kwargs))
+        vector = np.zeros(self._vec_len, dtype=self._dtype)
+        for f, columns, table in zip(self._features, self._columns, self._feature_tables()):
+            if table is not None:
+                key = f.table_key(event)
+                self._check_table_keys(f, table[1], key)
+                vector[columns] = table[0][key]
+                continue
+            out = vector[columns]
+            feature._write_output(f.make_subvector(event, out=out, **kwargs), out)
+        return vector
 
     def _assert_is_event(self, event):
         if not isinstance(event, Event):
@@ -67,15 +160,277 @@ class EventDataBuilder(DataBuilder):
         self._assert_is_event(event)
         return tuple(l.get_event_label(event, **kwargs) for l in self._labels)
 
+    def _event_arrays(self, events):
+        if isinstance(events, EventArrays):
+            return events
+        return EventArrays(events)
+
+    def make_matrix(self, events, library=None, **kwargs):
+        '''
+        Build the vectors of many events at once, as an (N x dim) matrix whose rows are the
+        vectors make_vector would produce for each event.
+        `events` is a sequence of Events, or an EventArrays built from them (which can be shared
+        with make_label_matrix). Extra keyword arguments are passed to every feature, and may be
+        single values or one value per event.
+        '''
+        arrays = self._event_arrays(events)
+        matrix = np.zeros((len(arrays), self._vec_len), dtype=self._dtype)
+        for f, columns, table in zip(self._features, self._columns, self._feature_tables()):
+            if table is not None:
+                keys = f.table_keys(arrays)
+                self._check_table_keys(f, table[1], keys)
+                matrix[:, columns] = table[0][keys]
+                continue
+            out = matrix[:, columns]
+            feature._write_output(f.make_submatrix(arrays, out=out, **kwargs), out)
+        return self.to_output_library(matrix, library)
+
+    def make_label_matrix(self, events, **kwargs):
+        '''
+        Build the labels of many events at once, as an (N x num_labellers) integer array whose
+        rows match make_labels for each event. Missing labels (None) are marked with
+        mud.fmt.label.NO_LABEL.
+        '''
+        arrays = self._event_arrays(events)
+        labels = np.zeros((len(arrays), len(self._labels)), dtype='int')
+        for i, column in enumerate(self.make_label_arrays(arrays, **kwargs)):
+            labels[:, i] = column
+        return labels
+
+    def make_label_arrays(self, events, **kwargs):
+        '''
+        Build the labels of many events at once, as a tuple with one integer array per labeller
+        (e.g. the targets of each output of a model for a whole piece). Missing labels are marked
+        with mud.fmt.label.NO_LABEL.
+        '''
+        arrays = self._event_arrays(events)
+        return tuple(l.get_event_labels(arrays, **kwargs) for l in self._labels)
+
+    def _index_layout(self):
+        '''
+        Split the features into categorical features (the tabulable ones, see
+        Feature.lookup_table) and dense features. For each categorical feature, map every table
+        key to a category index: 1-dimensional features use their value (0 or 1), and one-hot
+        features use the position of their 1, with all-zero subvectors (e.g. the pitch of a rest)
+        getting an extra category after the others.
+        '''
+        if self._category_tables is None:
+            tables = self._feature_tables()
+            self._category_tables = []
+            self._dense_columns = []
+            dense_start = 0
+            for f, table in zip(self._features, tables):
+                if table is None and f.tabulable:
+                    table = f.lookup_table()
+                if table is None:
+                    self._category_tables.append(None)
+                    self._dense_columns.append(slice(dense_start, dense_start + f.dim()))
+                    dense_start += f.dim()
+                    continue
+                values, valid = table
+                if f.dim() == 1:
+                    categories, vocab_size = (values[:, 0] != 0).astype('int'), 2
+                else:
+                    is_zero = ~values.any(axis=1)
+                    categories = np.where(is_zero, f.dim(), values.argmax(axis=1))
+                    vocab_size = f.dim() + (1 if np.any(is_zero & valid) else 0)
+                categories[~valid] = -1
+                self._category_tables.append((categories, vocab_size))
+                self._dense_columns.append(None)
+            self._dense_dim = dense_start
+        return self._category_tables
+
+    def vocab_sizes(self):
+        '''
+        The number of category indices of each categorical feature, in the order of the
+        columns produced by make_index_matrix (e.g. to size embedding layers).
+        '''
+        return tuple(table[1] for table in self._index_layout() if table is not None)
+
+    def dense_dim(self):
+        ''' The number of dense (non-categorical) columns produced by make_index_matrix. '''
+        self._index_layout()
+        return self._dense_dim
+
+    def index_dtype(self):
+        ''' The smallest integer dtype that can hold every category index. '''
+        largest = max(self.vocab_sizes(), default=0)
+        for dtype in ('uint8', 'uint16', 'uint32'):
+            if largest <= np.iinfo(dtype).max + 1:
+                return np.dtype(dtype)
+        return np.dtype('int64')
+
+    def make_index_matrix(self, events, library=None, **kwargs):
+        '''
+        Format many events without one-hot encoding, for models that embed categorical features.
+        Returns `(indices, dense)`: an (N x num_categorical) array with the category index of
+        every categorical feature (see vocab_sizes), and an (N x dense_dim) array of the builder's
+        dtype with the subvectors of the remaining (continuous or custom) features, e.g.
+        NoteOctaveContinuous.
+        '''
+        arrays = self._event_arrays(events)
+        category_tables = self._index_layout()
+        indices = np.zeros((len(arrays), len(self.vocab_sizes())), dtype=self.index_dtype())
+        dense = np.zeros((len(arrays), self._dense_dim), dtype=self._dtype)
+        column = 0
+        for f, table, columns in zip(self._features, category_tables, self._dense_columns):
+            if table is not None:
+                categories = table[0][f.table_keys(arrays)]
+                if np.any(categories < 0):
+                    raise ValueError(f'Event can\'t be formatted by feature {type(f).__name__}')
+                indices[:, column] = categories
+                column += 1
+                continue
+            out = dense[:, columns]
+            feature._write_output(f.make_submatrix(arrays, out=out, **kwargs), out)
+        return self.to_output_library(indices, library), self.to_output_library(dense, library)
+
+    def make_index_vector(self, event, library=None, **kwargs):
+        ''' Format a single event like make_index_matrix, returning `(indices, dense)`. '''
+        self._assert_is_event(event)
+        indices, dense = self.make_index_matrix([event], library=OutputLibrary.NUMPY, **kwargs)
+        return self.to_output_library(indices[0], library), self.to_output_library(dense[0], library)
+
+    def to_output_library(self, array, library=None, pin_memory=None):
+        '''
+        Convert a batch (e.g. a PieceData.vector_matrix() or a make_label_matrix result) to the
+        output library, without copying where possible. `library` and `pin_memory` default to the
+        builder's settings.
+        '''
+        if library is None:
+            library = self._output_library
+        elif isinstance(library, str):
+            library = str_to_lib[library]
+        return _numpy_to_output_library_format(
+            array,
+            library,
+            self._pin_memory if pin_memory is None else pin_memory)
+
+    @staticmethod
+    def labels_to_tuple(label_row):
+        ''' Convert a row of a label matrix to the tuple make_labels would produce. '''
+        return tuple(None if l == NO_LABEL else l for l in label_row.tolist())
+
+    def _label_index(self, label_identifier, required=True):
+        '''
+        The position of the labeller with the given identifier, or None if there is none and it is
+        not `required`. The identifiers are indexed on first use.
+        '''
+        if self._label_indices is None:
+            self._label_indices = {}
+            for i, l in enumerate(self._labels):
+                self._label_indices.setdefault(l.identifier, []).append(i)
+        indices = self._label_indices.get(label_identifier, [])
+        if len(indices) == 0:
+            if not required:
+                return None
+            raise ValueError(f'Labeller \'{label_identifier}\' not found in EventDataBuilder')
+        if len(indices) > 1:
+            raise ValueError(f'Ambiguous label identifier; multiple labellers ({len(indices)}) found for \'{label_identifier}\'')
+        return indices[0]
+
     def label_value(self, label_identifier, label):
         '''
         Get the value of a label given a particular identifier for a labeller (see `mud.fmt.label`)
         Will throw if there are multiple labellers with the same identifier.
         '''
-        labeller = [l for l in self._labels if l.identifier == label_identifier]
-        if len(labeller) == 0:
-            raise ValueError(f'Labeller \'{label_identifier}\' not found in EventDataBuilder')
-        if len(labeller) > 1:
-            raise ValueError(f'Ambiguous label identifier; multiple labellers ({len(labeller)}) found for \'{label_identifier}\'')
-        labeller = labeller[0]
-        return labeller.get_value_of(label)
\ No newline at end of file
+        return self._labels[self._label_index(label_identifier)].get_value_of(label)
+
+    def label_values(self, label_identifier, labels):
+        '''
+        Get the numeric values of an array of labels at once (see Labels.get_values_of), given the
+        identifier of their labeller.
+        '''
+        return self._labels[self._label_index(label_identifier)].get_values_of(labels)
+
+    def labels_from_outputs(self, outputs, sample=False, temperature=1.0, rng=None):
+        '''
+        Convert model outputs for N events into one integer label array per labeller.
+        `outputs` is either an (N x num_labellers) integer label matrix (as from
+        make_label_matrix), or a sequence with one entry per labeller that is either an (N,) array
+        of labels or an (N x num_labels) array of logits. Logits are converted by argmax, or with
+        `sample` by sampling from softmax(logits / temperature) using the numpy Generator `rng`.
+        '''
+        if isinstance(outputs, np.ndarray) and outputs.ndim == 2 and outputs.dtype.kind in 'iu':
+            outputs = outputs.T
+        if len(outputs) != len(self._labels):
+            raise ValueError(f'Expected outputs for {len(self._labels)} labellers, '
+                             f'got {len(outputs)}')
+        if sample and rng is None:
+            rng = np.random.default_rng()
+        labels = []
+        for l, output in zip(self._labels, outputs):
+            output = np.asarray(output)
+            if output.ndim == 1:
+                labels.append(output.astype('int'))
+            elif output.ndim == 2 and output.shape[1] == l.num_labels:
+                if sample:
+                    # Gumbel-max: the argmax of perturbed logits is a sample from the softmax.
+                    output = output / temperature + rng.gumbel(size=output.shape)
+                labels.append(np.argmax(output, axis=1))
+            else:
+                raise ValueError(f'Output of shape {output.shape} does not match labeller '
+                                 f'{type(l).__name__} with {l.num_labels} labels')
+        return tuple(labels)
+
+    def _decode_midi_pitches(self, labels):
+        '''
+        The MIDI pitch of each event from its labels (-1 for events without a pitch), using a
+        PitchLabels labeller or RelativePitchLabels and OctaveLabels labellers.
+        '''
+        pitch = self._label_index('Pitch', required=False)
+        if pitch is not None:
+            return self._labels[pitch].get_values_of(labels[pitch])
+        relative_pitch = self._label_index('RelativePitch', required=False)
+        octave = self._label_index('Octave', required=False)
+        if relative_pitch is None or octave is None:
+            raise ValueError('Decoding a piece requires Pitch labels, or RelativePitch and Octave '
+                             'labels')
+        relative_pitches = self._labels[relative_pitch].get_values_of(labels[relative_pitch])
+        octaves = self._labels[octave].get_values_of(labels[octave])
+        # Missing octaves decode to -1, which is also a real octave, so check the labels instead.
+        has_pitch = (relative_pitches >= 0) & (np.asarray(labels[octave]) != NO_LABEL)
+        return np.where(has_pitch, relative_pitches + (octaves + 1) * 12, -1)
+
+    def decode_piece(self, outputs, slice_indices, slice_resolution, bar_length, num_slices=None,
+                     sample=False, temperature=1.0, rng=None):
+        '''
+        Rebuild a Piece from the labels (or logits, see labels_from_outputs) of the events of a
+        sequence of timeslices, e.g. those sampled from a model.
+        `slice_indices` gives the timeslice of each event, counted from the start of the piece
+        (for a PackedPieceData, `np.repeat(np.arange(n), np.diff(slice_offsets))`). Timeslices
+        are `slice_resolution` beats long, and are grouped into bars of `bar_length` beats.
+        An event continues the note of the same pitch in the previous timeslice if the
+        ContinuingPreviousEvent label of the event and the ContinuesNextEvent label of the
+        previous event (where the builder has those labellers) both say so; otherwise it starts a
+        new note. Events without a pitch, or with an IsNote label of 0, are treated as rests.
+        '''
+        labels = self.labels_from_outputs(outputs, sample, temperature, rng)
+        slice_indices = np.asarray(slice_indices, dtype='int')
+        if num_slices is None:
+            num_slices = slice_indices.max() + 1 if len(slice_indices) > 0 else 0
+        midi_pitches = self._decode_midi_pitches(labels)
+        is_note = (midi_pitches >= 0) & (midi_pitches < 128)
+        is_note_index = self._label_index('IsNote', required=False)
+        if is_note_index is not None:
+            is_note &= labels[is_note_index] == 1
+        slices, pitches = slice_indices[is_note], midi_pitches[is_note]
+
+        # Ties are allowed by default, and ruled out by whichever continuation labels exist.
+        continuing = np.ones(len(slices), dtype='bool')
+        continuing_previous = self._label_index('ContinuingPreviousEvent', required=False)
+        if continuing_previous is not None:
+            continuing &= labels[continuing_previous][is_note] == 1
+        continues_next = self._label_index('ContinuesNextEvent', required=False)
+        if continues_next is not None:
+            ties_forward = np.zeros((num_slices + 1, 128), dtype='bool')
+            ties_forward[slices + 1, pitches] = labels[continues_next][is_note] == 1
+            continuing &= ties_forward[slices, pitches]
+        if continuing_previous is None and continues_next is None:
+            continuing[:] = False
+
+        roll = np.zeros((num_slices, 128, 2), dtype='uint8')
+        roll[slices, pitches, 0] = ~continuing
+        roll[slices, pitches, 1] = 1
+        return Piece.from_piano_roll(roll, slice_resolution, bar_length,
+                                     channels=('onset', 'sustain'))
\ No newline at end of file
@@ -0,0 +1,201 @@
+'''
+Datasets over formatted corpora for torch's DataLoader.
+The formatted pieces are held in a few flat arrays (see CorpusArrays), which can be saved and
+memory-mapped, so DataLoader workers share them instead of each holding a copy of a tree of Python
+objects. Items are numpy arrays, which `collate` pads into a Batch of tensors.
+torch remains optional: without it, the datasets can still be indexed and iterated directly.
+'''
+
+import os
+import pickle
+import numpy as np
+from .batching import as_packed, check_granularity, element_offsets, pad_sequences
+from .piece_data import PackedPieceData, _offsets
+from .storage import BitPackedMatrix, DictionaryEncodedMatrix, row_range
+
+try:
+    from torch.utils.data import Dataset as _Dataset, IterableDataset as _IterableDataset, \
+                                 get_worker_info
+except (ImportError, ModuleNotFoundError):
+    _Dataset = _IterableDataset = object
+    def get_worker_info():
+        return None
+
+class CorpusArrays(object):
+    '''
+    The formatted pieces of a corpus concatenated into the flat arrays of one PackedPieceData
+    (`data`), and `piece_bars`: piece i holds the bars [piece_bars[i], piece_bars[i + 1]).
+    piece(i) returns a PackedPieceData whose arrays are views of these.
+    Vectors stay bit-packed if every piece is bit-packed, or dictionary encoded if every piece
+    shares a table (see DataCorpus), and are dense otherwise.
+    With `save` and `load`, the arrays are stored as .npy files in a directory and memory-mapped
+    (copy-on-write, so the files are never modified). Memory-mapped arrays are pickled as their
+    path and mapped again when unpickled, e.g. in a DataLoader worker.
+    '''
+    def __init__(self, data, piece_bars):
+        self.data = data
+        self.piece_bars = np.asarray(piece_bars, dtype='int64')
+        self.path = None
+
+    @classmethod
+    def from_data(cls, data):
+        ''' Concatenate the pieces of a DataCorpus, or of a list of PieceData/PackedPieceData. '''
+        pieces = [as_packed(piece_data) for piece_data in data]
+        if len(pieces) == 0:
+            raise ValueError('can\'t build CorpusArrays without any pieces')
+        return cls(PackedPieceData.concatenate(pieces),
+                   _offsets([piece.num_bars() for piece in pieces]))
+
+    def save(self, path):
+        ''' Save the arrays as .npy files in the directory `path`, which is created if needed. '''
+        os.makedirs(path, exist_ok=True)
+        vectors = self.data.vectors
+        arrays = {'labels': self.data.labels,
+                  'slice_offsets': self.data.slice_offsets,
+                  'bar_offsets': self.data.bar_offsets,
+                  'piece_bars': self.piece_bars}
+        if isinstance(vectors, BitPackedMatrix):
+            storage = ('bit_packed', vectors.num_columns, vectors.dtype.str)
+            arrays['vectors'] = vectors.packed
+        elif isinstance(vectors, DictionaryEncodedMatrix):
+            storage = ('dictionary',)
+            arrays['vectors'] = vectors.ids
+            arrays['table'] = vectors.table if isinstance(vectors.table, np.ndarray) \
+                else vectors.table.to_dense()
+        else:
+            storage = ('dense',)
+            arrays['vectors'] = vectors
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), np.asarray(array))
+        with open(os.path.join(path, 'storage.pkl'), 'wb') as f:
+            pickle.dump(storage, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        ''' Load arrays saved with `save`, memory-mapping them unless `mmap` is False. '''
+        mmap_mode = 'c' if mmap else None
+        load = lambda name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+        with open(os.path.join(path, 'storage.pkl'), 'rb') as f:
+            storage = pickle.load(f)
+        vectors = load('vectors')
+        if storage[0] == 'bit_packed':
+            vectors = BitPackedMatrix(vectors, storage[1], storage[2])
+        elif storage[0] == 'dictionary':
+            vectors = DictionaryEncodedMatrix(load('table'), vectors)
+        arrays = cls(PackedPieceData.from_arrays(vectors, load('labels'), load('slice_offsets'),
+                                                 load('bar_offsets')),
+                     load('piece_bars'))
+        if mmap:
+            arrays.path = path
+        return arrays
+
+    def piece(self, index):
+        ''' Return piece `index` as a PackedPieceData of views of the arrays. '''
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('piece index out of range')
+        first_bar, last_bar = self.piece_bars[index], self.piece_bars[index + 1]
+        first_slice, last_slice = self.data.bar_offsets[first_bar], self.data.bar_offsets[last_bar]
+        start, end = self.data.slice_offsets[first_slice], self.data.slice_offsets[last_slice]
+        return PackedPieceData.from_arrays(
+            row_range(self.data.vectors, start, end),
+            self.data.labels[start:end],
+            self.data.slice_offsets[first_slice:last_slice + 1] - start,
+            self.data.bar_offsets[first_bar:last_bar + 1] - first_slice)
+
+    def __getstate__(self):
+        if self.path is not None:
+            return {'path': self.path}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if 'data' not in state:
+            state = self.load(state['path']).__dict__
+        self.__dict__.update(state)
+
+    def __getitem__(self, index):
+        return self.piece(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.piece(i)
+
+    def __len__(self):
+        return len(self.piece_bars) - 1
+
+def _as_corpus_arrays(data):
+    return data if isinstance(data, CorpusArrays) else CorpusArrays.from_data(data)
+
+def collate(items, granularity='event', pin_memory=False):
+    '''
+    Pad dataset items (see PieceDataset) into a Batch of torch tensors, converted with
+    torch.from_numpy (see Batch.to_torch).
+    '''
+    return pad_sequences([item[1:] for item in items], granularity,
+                         [item[0] for item in items]).to_torch(pin_memory)
+
+class PieceDataset(_Dataset):
+    '''
+    A map-style dataset of the pieces of a DataCorpus, a list of PieceData/PackedPieceData or a
+    CorpusArrays. Item i is a tuple `(i, vectors, labels, offsets)` of numpy arrays, where
+    `offsets` are the event offsets of the piece's elements at `granularity` (see
+    mud.fmt.batching.element_offsets). Use `dataset.collate` as the DataLoader's collate_fn.
+    '''
+    def __init__(self, data, granularity='event'):
+        check_granularity(granularity)
+        self.arrays = _as_corpus_arrays(data)
+        self.granularity = granularity
+
+    def collate(self, items):
+        return collate(items, self.granularity)
+
+    def __getitem__(self, index):
+        piece = self.arrays.piece(index)
+        return (index, piece.vector_matrix(), piece.labels,
+                element_offsets(piece, self.granularity))
+
+    def __len__(self):
+        return len(self.arrays)
+
+class IterablePieceDataset(_IterableDataset):
+    '''
+    An iterable-style dataset of the pieces of a DataCorpus, a list of PieceData/PackedPieceData
+    or a CorpusArrays, producing the same items as PieceDataset.
+    In a DataLoader with several workers, each worker iterates over a disjoint shard of the
+    pieces (see torch.utils.data.get_worker_info). With `shuffle`, the pieces are shuffled before
+    sharding, in an order determined by `seed` and the epoch (see set_epoch), which is the same
+    in every worker.
+    '''
+    def __init__(self, data, granularity='event', shuffle=False, seed=0):
+        check_granularity(granularity)
+        self.arrays = _as_corpus_arrays(data)
+        self.granularity = granularity
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def collate(self, items):
+        return collate(items, self.granularity)
+
+    def shard(self, worker_id=0, num_workers=1):
+        ''' The indices of the pieces iterated over by one of `num_workers` workers. '''
+        order = np.arange(len(self.arrays))
+        if self.shuffle:
+            order = np.random.default_rng((self.seed, self.epoch)).permutation(order)
+        return order[worker_id::num_workers]
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        shard = self.shard() if worker_info is None \
+            else self.shard(worker_info.id, worker_info.num_workers)
+        for index in shard:
+            piece = self.arrays.piece(index)
+            yield (int(index), piece.vector_matrix(), piece.labels,
+                   element_offsets(piece, self.granularity))
+
+    def __len__(self):
+        return len(self.arrays)
@@ -0,0 +1,53 @@
+'''
+The attributes of a sequence of Events gathered into parallel arrays, so features and labels can
+be computed for many events at once (see EventDataBuilder.make_matrix).
+'''
+
+import numpy as np
+from ..event import Event
+
+class EventArrays(object):
+    '''
+    Parallel arrays describing a sequence of events:
+        - `is_note`, `is_rest`: event kind flags.
+        - `has_pitch`: whether the event has a pitch with octave information.
+        - `relative_pitch`: relative pitch (0-11), -1 if the event has no pitch.
+        - `octave`: octave number, only meaningful where `has_pitch` is set.
+        - `midi_pitch`: MIDI pitch, -1 if the event has no pitch.
+        - `time`, `duration`: start time (relative to the containing span) and duration in beats.
+        - `continuing_previous`, `continues_next`: the continuation flags of sliced events.
+    The original events are kept in `events` for features without a vectorized implementation.
+    '''
+    def __init__(self, events):
+        self.events = list(events)
+        n = len(self.events)
+        self.is_note = np.zeros(n, dtype='bool')
+        self.is_rest = np.zeros(n, dtype='bool')
+        self.has_pitch = np.zeros(n, dtype='bool')
+        self.relative_pitch = np.full(n, -1, dtype='int')
+        self.octave = np.zeros(n, dtype='int')
+        self.time = np.zeros(n, dtype='float')
+        self.duration = np.zeros(n, dtype='float')
+        self.continuing_previous = np.zeros(n, dtype='bool')
+        self.continues_next = np.zeros(n, dtype='bool')
+        for i, event in enumerate(self.events):
+            if not isinstance(event, Event):
+                raise ValueError('EventArrays can only be built from Events')
+            self.is_note[i] = event.is_note()
+            self.is_rest[i] = event.is_rest()
+            self.time[i] = event.time().in_beats()
+            self.duration[i] = event.duration().in_beats()
+            self.continuing_previous[i] = not event.is_note_start()
+            self.continues_next[i] = not event.is_note_end()
+            pitch = event.pitch()
+            if pitch is not None:
+                self.relative_pitch[i] = pitch.relative_pitch()
+                if pitch.octave() is not None:
+                    self.has_pitch[i] = True
+                    self.octave[i] = pitch.octave()
+        self.midi_pitch = np.where(self.has_pitch,
+                                   self.relative_pitch + (self.octave + 1) * 12,
+                                   -1)
+
+    def __len__(self):
+        return len(self.events)
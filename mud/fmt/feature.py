@@ -4,8 +4,9 @@ Each class takes an Event and generates a subvector, which are then concatenated
 '''
 
 import numpy as np
-from .binary_vector import binvec
+from .binary_vector import binvec, binmat
 from . import label
+from ..notation import Pitch
 import math
 
 def _pascal_case_to_snake_case(string):
@@ -15,14 +16,94 @@ def _pascal_case_to_snake_case(string):
             res.append('_')
         res.append(c.tolower())
         return ''.join(res)
-        
+
+def _write_output(result, out):
+    '''
+    Features may ignore the `out` argument (e.g. user-defined features) and return a new array
+    instead; copy the result into `out` if so.
+    '''
+    if result is not out:
+        if result is None:
+            raise ValueError('feature did not produce a subvector')
+        out[...] = result
+    return out
+
+def _flag_subvector(flag, out=None):
+    v = np.zeros(1) if out is None else out
+    v[0] = 1.0 if flag else 0.0
+    return v
+
+def _flag_submatrix(flags, out=None):
+    m = np.zeros((len(flags), 1)) if out is None else out
+    m[:, 0] = flags
+    return m
+
 class Feature(object):
+    '''
+    Features produce a subvector of dimension dim() for each event.
+    Both make_subvector and make_submatrix accept an optional `out` array: if provided, the
+    result is written into it (and it is returned) rather than allocating a new array. This lets
+    EventDataBuilder write every feature directly into its slice of the final vector or matrix.
+    '''
     def dim(self):
         raise NotImplementedError
 
-    def make_subvector(self, event, **kwargs):
+    def make_subvector(self, event, out=None, **kwargs):
+        raise NotImplementedError
+
+    def make_submatrix(self, arrays, out=None, **kwargs):
+        '''
+        Build the subvectors of many events at once, as an (N x dim) array.
+        `arrays` is a mud.fmt.event_arrays.EventArrays. Features without a vectorized
+        implementation fall back to calling make_subvector for each event.
+        '''
+        if out is None:
+            out = np.zeros((len(arrays), self.dim()))
+        for i, event in enumerate(arrays.events):
+            row = out[i]
+            _write_output(self.make_subvector(event, out=row, **kwargs), row)
+        return out
+
+    # Features whose subvector is a pure function of a small discrete key can be tabulated:
+    # EventDataBuilder.compile() builds a table with the subvector of every key, and formats
+    # events by looking up their keys in it. These features set `tabulable = True` and implement
+    # num_table_keys, table_key, table_keys and subvector_of_key.
+    tabulable = False
+
+    def num_table_keys(self):
+        ''' The number of distinct keys. '''
+        raise NotImplementedError
+
+    def table_key(self, event):
+        ''' The key (an integer in [0, num_table_keys)) of an event. '''
         raise NotImplementedError
 
+    def table_keys(self, arrays):
+        ''' The keys of many events, given as an EventArrays. '''
+        raise NotImplementedError
+
+    def subvector_of_key(self, key):
+        ''' The subvector of events with a given key. Raises ValueError for invalid keys. '''
+        raise NotImplementedError
+
+    def lookup_table(self):
+        '''
+        Enumerate the key space of a tabulable feature.
+        Returns `(table, valid)`: a (num_keys x dim) array holding the subvector of each key, and
+        a boolean array marking the keys that have a subvector (formatting an event with an
+        invalid key raises ValueError, as make_subvector would).
+        '''
+        if not self.tabulable:
+            raise ValueError(f'Feature {type(self).__name__} can\'t be tabulated')
+        table = np.zeros((self.num_table_keys(), self.dim()))
+        valid = np.ones(self.num_table_keys(), dtype='bool')
+        for key in range(self.num_table_keys()):
+            try:
+                _write_output(self.subvector_of_key(key), table[key])
+            except ValueError:
+                valid[key] = False
+        return table, valid
+
     @property
     def identifier(self):
         try:
@@ -48,11 +129,25 @@ class IsNote(EventFeature):
     def dim(self):
         return 1
 
-    def make_subvector(self, event, **kwargs):
-        if event.is_note():
-            return np.ones(1)
-        else:
-            return np.zeros(1)
+    def make_subvector(self, event, out=None, **kwargs):
+        return _flag_subvector(event.is_note(), out)
+
+    def make_submatrix(self, arrays, out=None, **kwargs):
+        return _flag_submatrix(arrays.is_note, out)
+
+    tabulable = True
+
+    def num_table_keys(self):
+        return 2
+
+    def table_key(self, event):
+        return int(event.is_note())
+
+    def table_keys(self, arrays):
+        return arrays.is_note.astype('int')
+
+    def subvector_of_key(self, key):
+        return _flag_subvector(key)
 
 class IsRest(EventFeature):
     def __init__(self):
@@ -61,11 +156,25 @@ class IsRest(EventFeature):
     def dim(self):
         return 1
 
-    def make_subvector(self, event, **kwargs):
-        if event.is_rest():
-            return np.ones(1)
-        else:
-            return np.zeros(1)
+    def make_subvector(self, event, out=None, **kwargs):
+        return _flag_subvector(event.is_rest(), out)
+
+    def make_submatrix(self, arrays, out=None, **kwargs):
+        return _flag_submatrix(arrays.is_rest, out)
+
+    tabulable = True
+
+    def num_table_keys(self):
+        return 2
+
+    def table_key(self, event):
+        return int(event.is_rest())
+
+    def table_keys(self, arrays):
+        return arrays.is_rest.astype('int')
+
+    def subvector_of_key(self, key):
+        return _flag_subvector(key)
 
 class NotePitch(EventFeature):
     def __init__(self, pitch_labels):
@@ -82,12 +191,46 @@ class NotePitch(EventFeature):
     def dim(self):
         return self._dim
 
-    def make_subvector(self, event, **kwargs):
+    def make_subvector(self, event, out=None, **kwargs):
         p = event.pitch()
         if p is None:
-            return np.zeros(self._dim)
+            return binvec(self._dim, out=out)
         label = self._pitch_labels.get_label_of(p)
-        return binvec(self._dim, label)
+        return binvec(self._dim, label, out=out)
+
+    # Keys are MIDI pitches, followed by events without a pitch, pitches without an octave and
+    # pitches outside the MIDI range (which have no key of their own, so they are invalid).
+    tabulable = True
+    _no_pitch_key = 128
+    _no_octave_key = 129
+    _out_of_range_key = 130
+
+    def num_table_keys(self):
+        return 131
+
+    def table_key(self, event):
+        p = event.pitch()
+        if p is None:
+            return self._no_pitch_key
+        if p.octave() is None:
+            return self._no_octave_key
+        midi = p.midi_pitch()
+        return midi if 0 <= midi <= 127 else self._out_of_range_key
+
+    def table_keys(self, arrays):
+        keys = np.where(arrays.relative_pitch < 0, self._no_pitch_key, self._no_octave_key)
+        midi = np.where((arrays.midi_pitch < 0) | (arrays.midi_pitch > 127),
+                        self._out_of_range_key, arrays.midi_pitch)
+        return np.where(arrays.has_pitch, midi, keys)
+
+    def subvector_of_key(self, key):
+        if key == self._no_pitch_key:
+            return binvec(self._dim)
+        if key == self._no_octave_key:
+            raise ValueError('pitches without an octave do not have a label')
+        if key == self._out_of_range_key:
+            raise ValueError('pitches outside the MIDI range do not have a table key')
+        return binvec(self._dim, self._pitch_labels.get_label_of(Pitch.from_midi_pitch(key)))
 
 class NoteRelativePitch(EventFeature):
     '''
@@ -114,13 +257,32 @@ class NoteRelativePitch(EventFeature):
     def dim(self):
         return self._dim
 
-    def make_subvector(self, event, **kwargs):
+    def make_subvector(self, event, out=None, **kwargs):
         try:
             rp = event.pitch().relative_pitch()
         except AttributeError:
-            return np.zeros(self._dim)
+            return binvec(self._dim, out=out)
         label = self._pitch_labels.get_label_of(rp)
-        return binvec(self._dim, label)
+        return binvec(self._dim, label, out=out)
+
+    # Keys are relative pitches, followed by events without a pitch.
+    tabulable = True
+    _no_pitch_key = 12
+
+    def num_table_keys(self):
+        return 13
+
+    def table_key(self, event):
+        p = event.pitch()
+        return self._no_pitch_key if p is None else p.relative_pitch()
+
+    def table_keys(self, arrays):
+        return np.where(arrays.relative_pitch < 0, self._no_pitch_key, arrays.relative_pitch)
+
+    def subvector_of_key(self, key):
+        if key == self._no_pitch_key:
+            return binvec(self._dim)
+        return binvec(self._dim, self._pitch_labels.get_label_of(key))
 
 class NoteOctave(EventFeature):
     '''
@@ -138,19 +300,52 @@ class NoteOctave(EventFeature):
 
     def _label_of_octave(self, octave):
         if octave < self._octave_range[0]:
-            if self._saturate: return self._octave_range[0]
+            if self._saturate: return 0
             raise ValueError('octave out of range')
         if octave > self._octave_range[1]:
-            if self._saturate: return self._octave_range[1]
+            if self._saturate: return self.dim() - 1
             raise ValueError('octave out of range')
         return octave - self._octave_range[0]
 
-    def make_subvector(self, event, **kwargs):
+    def make_subvector(self, event, out=None, **kwargs):
         p = event.pitch()
         if p is None:
-            return np.zeros(self.dim())
+            return binvec(self.dim(), out=out)
         label = self._label_of_octave(p.octave())
-        return binvec(self.dim(), (label,))
+        return binvec(self.dim(), (label,), out=out)
+
+    def make_submatrix(self, arrays, out=None, **kwargs):
+        labels = arrays.octave - self._octave_range[0]
+        out_of_range = arrays.has_pitch & ((labels < 0) | (labels >= self.dim()))
+        if np.any(out_of_range) and not self._saturate:
+            raise ValueError('octave out of range')
+        labels = np.where(arrays.has_pitch, np.clip(labels, 0, self.dim() - 1), -1)
+        return binmat(self.dim(), labels, out=out)
+
+    # Keys are octaves from one below to one above the octave range (octaves further out are
+    # treated the same), followed by events without a pitch.
+    tabulable = True
+
+    def num_table_keys(self):
+        return self.dim() + 3
+
+    def _key_of_octave(self, octave):
+        return np.clip(octave, self._octave_range[0] - 1, self._octave_range[1] + 1) \
+            - (self._octave_range[0] - 1)
+
+    def table_key(self, event):
+        p = event.pitch()
+        if p is None:
+            return self.dim() + 2
+        return int(self._key_of_octave(p.octave()))
+
+    def table_keys(self, arrays):
+        return np.where(arrays.has_pitch, self._key_of_octave(arrays.octave), self.dim() + 2)
+
+    def subvector_of_key(self, key):
+        if key == self.dim() + 2:
+            return binvec(self.dim())
+        return binvec(self.dim(), self._label_of_octave(key + self._octave_range[0] - 1))
 
 class NoteOctaveContinuous(EventFeature):
     '''
@@ -165,14 +360,23 @@ class NoteOctaveContinuous(EventFeature):
     def dim(self):
         return 1
 
-    def make_subvector(self, event, **kwargs):
+    def make_subvector(self, event, out=None, **kwargs):
         try:
             octave = event.pitch().octave()
         except AttributeError:
             if (self._rest_octave_value is None):
                 return None
             octave = self._rest_octave_value
-        return np.full((1,), float(octave), dtype='float')
+        v = np.zeros(1) if out is None else out
+        v[0] = float(octave)
+        return v
+
+    def make_submatrix(self, arrays, out=None, **kwargs):
+        if self._rest_octave_value is None and not np.all(arrays.has_pitch):
+            raise ValueError('NoteOctaveContinuous has no value for events without a pitch')
+        m = np.zeros((len(arrays), 1)) if out is None else out
+        m[:, 0] = np.where(arrays.has_pitch, arrays.octave, self._rest_octave_value)
+        return m
 
 class ContinuingPreviousEvent(EventFeature):
     '''
@@ -185,13 +389,31 @@ class ContinuingPreviousEvent(EventFeature):
     def dim(self):
         return 1
 
-    def make_subvector(self, event, **kwargs):
+    def make_subvector(self, event, out=None, **kwargs):
         try:
-            if not event.is_note_start():
-                return np.ones(1)
+            return _flag_subvector(not event.is_note_start(), out)
         except AttributeError:
-            pass
-        return np.zeros(1)
+            return _flag_subvector(False, out)
+
+    def make_submatrix(self, arrays, out=None, **kwargs):
+        return _flag_submatrix(arrays.continuing_previous, out)
+
+    tabulable = True
+
+    def num_table_keys(self):
+        return 2
+
+    def table_key(self, event):
+        try:
+            return int(not event.is_note_start())
+        except AttributeError:
+            return 0
+
+    def table_keys(self, arrays):
+        return arrays.continuing_previous.astype('int')
+
+    def subvector_of_key(self, key):
+        return _flag_subvector(key)
 
 class ContinuesNextEvent(EventFeature):
     '''
@@ -204,13 +426,31 @@ class ContinuesNextEvent(EventFeature):
     def dim(self):
         return 1
 
-    def make_subvector(self, event, **kwargs):
+    def make_subvector(self, event, out=None, **kwargs):
+        try:
+            return _flag_subvector(not event.is_note_end(), out)
+        except AttributeError:
+            return _flag_subvector(False, out)
+
+    def make_submatrix(self, arrays, out=None, **kwargs):
+        return _flag_submatrix(arrays.continues_next, out)
+
+    tabulable = True
+
+    def num_table_keys(self):
+        return 2
+
+    def table_key(self, event):
         try:
-            if not event.is_note_end():
-                return np.ones(1)
+            return int(not event.is_note_end())
         except AttributeError:
-            pass
-        return np.zeros(1)
+            return 0
+
+    def table_keys(self, arrays):
+        return arrays.continues_next.astype('int')
+
+    def subvector_of_key(self, key):
+        return _flag_subvector(key)
 
 class SpanPosition(EventFeature):
     '''
@@ -225,11 +465,34 @@ class SpanPosition(EventFeature):
     def dim(self):
         return self._num_steps
 
-    def make_subvector(self, event, **kwargs):
+    def make_subvector(self, event, out=None, **kwargs):
         pos_label = int(round(event.time().in_beats() / self._resolution))
         if pos_label >= self._num_steps:
             raise ValueError
-        return binvec(self.dim(), (pos_label,))
+        return binvec(self.dim(), (pos_label,), out=out)
+
+    def make_submatrix(self, arrays, out=None, **kwargs):
+        pos_labels = np.rint(arrays.time / self._resolution).astype('int')
+        if np.any(pos_labels >= self._num_steps):
+            raise ValueError
+        return binmat(self.dim(), pos_labels, out=out)
+
+    # Keys are positions, followed by any position past the end of the span.
+    tabulable = True
+
+    def num_table_keys(self):
+        return self._num_steps + 1
+
+    def table_key(self, event):
+        return min(int(round(event.time().in_beats() / self._resolution)), self._num_steps)
+
+    def table_keys(self, arrays):
+        return np.clip(np.rint(arrays.time / self._resolution).astype('int'), 0, self._num_steps)
+
+    def subvector_of_key(self, key):
+        if key >= self._num_steps:
+            raise ValueError
+        return binvec(self.dim(), key)
 
 class NoteLength(EventFeature):
     '''
@@ -244,13 +507,39 @@ class NoteLength(EventFeature):
     def dim(self):
         return self._num_steps
 
-    def make_subvector(self, event, **kwargs):
+    def make_subvector(self, event, out=None, **kwargs):
         len_label = int(round(event.duration().in_beats() / self._resolution))
         if len_label >= self._num_steps:
             if not self._saturate:
                 raise ValueError
             len_label = self._num_steps - 1
-        return binvec(self.dim(), (len_label,))
+        return binvec(self.dim(), (len_label,), out=out)
+
+    def make_submatrix(self, arrays, out=None, **kwargs):
+        len_labels = np.rint(arrays.duration / self._resolution).astype('int')
+        if np.any(len_labels >= self._num_steps) and not self._saturate:
+            raise ValueError
+        return binmat(self.dim(), np.minimum(len_labels, self._num_steps - 1), out=out)
+
+    # Keys are lengths, followed by any length of at least max_length.
+    tabulable = True
+
+    def num_table_keys(self):
+        return self._num_steps + 1
+
+    def table_key(self, event):
+        return min(int(round(event.duration().in_beats() / self._resolution)), self._num_steps)
+
+    def table_keys(self, arrays):
+        return np.clip(np.rint(arrays.duration / self._resolution).astype('int'),
+                       0, self._num_steps)
+
+    def subvector_of_key(self, key):
+        if key >= self._num_steps:
+            if not self._saturate:
+                raise ValueError
+            key = self._num_steps - 1
+        return binvec(self.dim(), key)
 
 class BooleanFlag(EventFeature):
     '''
@@ -263,10 +552,17 @@ class BooleanFlag(EventFeature):
     def dim(self):
         return 1
 
-    def make_subvector(self, event, **kwargs):
-        if self.flag_name in kwargs and kwargs[self.flag_name]:
-            return np.ones(1)
-        return np.zeros(1)
+    def make_subvector(self, event, out=None, **kwargs):
+        return _flag_subvector(self.flag_name in kwargs and kwargs[self.flag_name], out)
+
+    def make_submatrix(self, arrays, out=None, **kwargs):
+        '''
+        The flag may be given as a single value for every event, or as one value per event.
+        '''
+        flags = np.zeros(len(arrays), dtype='bool')
+        if self.flag_name in kwargs:
+            flags[:] = np.asarray(kwargs[self.flag_name], dtype='bool')
+        return _flag_submatrix(flags, out)
 
 # Helper functions
 def StartOfSequence():
@@ -1,4 +1,8 @@
 from ..notation import Pitch
+import numpy as np
+
+# Marks events without a label (e.g. rests for pitch labels) in integer label arrays.
+NO_LABEL = -1
 
 _relative_pitches_all = [
     'C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G', 'Ab', 'A', 'Bb', 'B'
@@ -18,11 +22,23 @@ def _make_pitch_labels(octave_range, rpitches='all'):
     return labels, next_label
 
 class Labels(object):
+    # Lazily built caches, which don't change the labeller's configuration.
+    _fingerprint_exclude = ('_value_table',)
+
     @property
     def num_labels(self):
         raise NotImplementedError
     def get_event_label(self, event, **kwargs):
         raise NotImplementedError
+    def get_event_labels(self, arrays, **kwargs):
+        '''
+        Get the labels of many events at once, as an integer array with NO_LABEL for events
+        without a label. `arrays` is a mud.fmt.event_arrays.EventArrays. Labellers without a
+        vectorized implementation fall back to calling get_event_label for each event.
+        '''
+        labels = (self.get_event_label(event, **kwargs) for event in arrays.events)
+        return np.fromiter((NO_LABEL if l is None else l for l in labels),
+                           dtype='int', count=len(arrays))
     @property
     def identifier(self):
         ''' returns a unique string identifier that can
@@ -33,6 +49,27 @@ class Labels(object):
             return None
     def get_label_of(self, label):
         raise NotImplementedError
+    def value_table(self):
+        '''
+        The numeric value of every label, as an array indexed by label, used to decode many labels
+        at once (see get_values_of). Labellers without numeric values return None.
+        '''
+        return None
+    def get_values_of(self, labels):
+        '''
+        Get the numeric values of an array of labels at once (see value_table). Missing labels
+        (NO_LABEL, or labels without a value) decode to -1 for integer values and NaN otherwise.
+        '''
+        try:
+            table = self._value_table
+        except AttributeError:
+            table = self._value_table = self.value_table()
+        if table is None:
+            raise ValueError(f'Labeller {type(self).__name__} has no numeric values')
+        labels = np.asarray(labels, dtype='int')
+        missing = -1 if table.dtype.kind in 'iu' else np.nan
+        valid = (labels >= 0) & (labels < len(table))
+        return np.where(valid, table[np.where(valid, labels, 0)], missing)
 
 class PitchLabels(Labels):
     def __init__(self, octave_range, include_rest=False, rpitches='all'):
@@ -43,6 +80,11 @@ class PitchLabels(Labels):
             self._values_to_labels[None] = self._num_labels
             self._num_labels += 1
         self._labels_to_values = {value: key for key, value in self._values_to_labels.items()}
+        # The label of each MIDI pitch, NO_LABEL for pitches without one.
+        self._midi_labels = np.full(128, NO_LABEL, dtype='int')
+        for pitch, label in self._values_to_labels.items():
+            if pitch is not None and 0 <= pitch.midi_pitch() < 128:
+                self._midi_labels[pitch.midi_pitch()] = label
 
     @property
     def num_labels(self):
@@ -51,6 +93,23 @@ class PitchLabels(Labels):
     def get_event_label(self, event, **kwargs):
         return self.get_label_of(event.pitch())
 
+    def get_event_labels(self, arrays, **kwargs):
+        if np.any((arrays.relative_pitch >= 0) & ~arrays.has_pitch):
+            raise ValueError('Pitches without octave information do not have a valid label')
+        midi = arrays.midi_pitch[arrays.has_pitch]
+        out_of_range = (midi < 0) | (midi >= len(self._midi_labels))
+        if np.any(out_of_range):
+            raise ValueError(f'Pitch with MIDI value {midi[out_of_range][0]} does not have a '
+                             f'valid label')
+        labels = np.full(len(arrays), NO_LABEL, dtype='int')
+        labels[arrays.has_pitch] = self._midi_labels[midi]
+        if np.any(labels[arrays.has_pitch] == NO_LABEL):
+            unlabelled = midi[self._midi_labels[midi] == NO_LABEL][0]
+            raise ValueError(f'Pitch with MIDI value {unlabelled} does not have a valid label')
+        if self._include_rest:
+            labels[arrays.relative_pitch < 0] = self._values_to_labels[None]
+        return labels
+
     def get_label_of(self, pitch):
         if pitch is None and not self._include_rest:
             return None
@@ -66,6 +125,14 @@ class PitchLabels(Labels):
         except KeyError:
             raise ValueError("Label {} does is not associated with a pitch", int(label))
 
+    def value_table(self):
+        ''' The MIDI pitch of each label, -1 for the rest label. '''
+        table = np.full(self._num_labels, -1, dtype='int')
+        for label, pitch in self._labels_to_values.items():
+            if pitch is not None:
+                table[label] = pitch.midi_pitch()
+        return table
+
 class RelativePitchLabels(Labels):
     def __init__(self, include_rest=False, rpitches='all'):
         '''
@@ -82,6 +149,11 @@ class RelativePitchLabels(Labels):
             self._labels_to_values[self._num_labels] = None
             self._num_labels += 1
         self._values_to_labels = {pitch: label for label, pitch in self._labels_to_values.items()}
+        # The label of each relative pitch, NO_LABEL for relative pitches without one.
+        self._relative_pitch_labels = np.full(12, NO_LABEL, dtype='int')
+        for label, pitch in self._labels_to_values.items():
+            if pitch is not None:
+                self._relative_pitch_labels[pitch.relative_pitch()] = label
 
     @property
     def num_labels(self):
@@ -90,6 +162,18 @@ class RelativePitchLabels(Labels):
     def get_event_label(self, event, **kwargs):
         return self.get_label_of(event.pitch())
 
+    def get_event_labels(self, arrays, **kwargs):
+        has_pitch = arrays.relative_pitch >= 0
+        labels = np.full(len(arrays), NO_LABEL, dtype='int')
+        relative_pitches = arrays.relative_pitch[has_pitch]
+        labels[has_pitch] = self._relative_pitch_labels[relative_pitches]
+        if np.any(labels[has_pitch] == NO_LABEL):
+            unlabelled = relative_pitches[labels[has_pitch] == NO_LABEL][0]
+            raise ValueError("Pitch {} does not have a label".format(Pitch(int(unlabelled))))
+        if self._include_rest:
+            labels[~has_pitch] = self._values_to_labels[None]
+        return labels
+
     def get_label_of(self, pitch):
         if pitch is None and not self._include_rest:
             return None
@@ -105,6 +189,14 @@ class RelativePitchLabels(Labels):
         except KeyError:
             raise ValueError("Label {} does is not associated with a pitch".format(int(label)))
 
+    def value_table(self):
+        ''' The relative pitch (0-11) of each label, -1 for the rest label. '''
+        table = np.full(self._num_labels, -1, dtype='int')
+        for label, pitch in self._labels_to_values.items():
+            if pitch is not None:
+                table[label] = pitch.relative_pitch()
+        return table
+
 class OctaveLabels(Labels):
     def __init__(self, octave_range, saturate=False):
         self._identifier = 'Octave'
@@ -120,14 +212,26 @@ class OctaveLabels(Labels):
         p = event.pitch()
         if p is None:
             return None
+        if p.octave() is None:
+            raise ValueError('Pitches without octave information do not have an octave label')
         return self.get_octave_label(p.octave())
 
+    def get_event_labels(self, arrays, **kwargs):
+        if np.any((arrays.relative_pitch >= 0) & ~arrays.has_pitch):
+            raise ValueError('Pitches without octave information do not have an octave label')
+        labels = arrays.octave - min(self._octave_range)
+        if self._saturate:
+            labels = np.clip(labels, 0, self._num_octaves - 1)
+        labels[(labels < 0) | (labels >= self._num_octaves)] = NO_LABEL
+        labels[~arrays.has_pitch] = NO_LABEL
+        return labels
+
     def get_octave_label(self, octave):
         if octave < min(self._octave_range):
-            if self._saturate: return min(self._octave_range)
+            if self._saturate: return 0
             return None
         if octave > max(self._octave_range):
-            if self._saturate: return max(self._octave_range)
+            if self._saturate: return self._num_octaves - 1
             return None
         return octave - min(self._octave_range)
 
@@ -136,6 +240,9 @@ class OctaveLabels(Labels):
             return None
         return label + min(self._octave_range)
 
+    def value_table(self):
+        return np.arange(self._num_octaves) + min(self._octave_range)
+
 class IsNote(Labels):
     def __init__(self):
         self._identifier = 'IsNote'
@@ -147,6 +254,12 @@ class IsNote(Labels):
     def get_event_label(self, event, **kwargs):
         return int(event.is_note())
 
+    def get_event_labels(self, arrays, **kwargs):
+        return arrays.is_note.astype('int')
+
+    def value_table(self):
+        return np.arange(2)
+
 class IsRest(Labels):
     def __init__(self):
         self._identifier = 'IsRest'
@@ -158,6 +271,12 @@ class IsRest(Labels):
     def get_event_label(self, event, **kwargs):
         return int(event.is_rest())
 
+    def get_event_labels(self, arrays, **kwargs):
+        return arrays.is_rest.astype('int')
+
+    def value_table(self):
+        return np.arange(2)
+
 class ContinuingPreviousEventLabel(Labels):
     def __init__(self):
         self._identifier = 'ContinuingPreviousEvent'
@@ -174,6 +293,12 @@ class ContinuingPreviousEventLabel(Labels):
             pass
         return 0
 
+    def get_event_labels(self, arrays, **kwargs):
+        return arrays.continuing_previous.astype('int')
+
+    def value_table(self):
+        return np.arange(2)
+
 class ContinuesNextEventLabel(Labels):
     def __init__(self):
         self._identifier = 'ContinuesNextEvent'
@@ -190,6 +315,12 @@ class ContinuesNextEventLabel(Labels):
             pass
         return 0
 
+    def get_event_labels(self, arrays, **kwargs):
+        return arrays.continues_next.astype('int')
+
+    def value_table(self):
+        return np.arange(2)
+
 class SpanPosition(Labels):
     '''
     Labels the position of an event within a span.
@@ -208,12 +339,21 @@ class SpanPosition(Labels):
         if pos_label >= self._num_steps:
             raise ValueError
         return pos_label
+
+    def get_event_labels(self, arrays, **kwargs):
+        pos_labels = np.rint(arrays.time / self._resolution).astype('int')
+        if np.any(pos_labels >= self._num_steps):
+            raise ValueError
+        return pos_labels
     
     def get_value_of(self, label):
         if label < 0 or label >= self._num_steps:
             return None
         return self._resolution * label
 
+    def value_table(self):
+        return self._resolution * np.arange(self._num_steps)
+
 class NoteLength(Labels):
     '''
     Labels the position of an event within a span.
@@ -235,12 +375,21 @@ class NoteLength(Labels):
                 raise ValueError
             len_label = self._num_steps - 1
         return len_label
+
+    def get_event_labels(self, arrays, **kwargs):
+        len_labels = np.rint(arrays.duration / self._resolution).astype('int')
+        if np.any(len_labels >= self._num_steps) and not self._saturate:
+            raise ValueError
+        return np.minimum(len_labels, self._num_steps - 1)
     
     def get_value_of(self, label):
         if label < 0 or label >= self._num_steps:
             return None
         return self._resolution * label
 
+    def value_table(self):
+        return self._resolution * np.arange(self._num_steps)
+
 class BooleanFlag(Labels):
     '''
     Flags with a label of 1 if flag_name=True, otherwise 0
@@ -258,6 +407,18 @@ class BooleanFlag(Labels):
             return 1
         return 0
 
+    def get_event_labels(self, arrays, **kwargs):
+        '''
+        The flag may be given as a single value for every event, or as one value per event.
+        '''
+        flags = np.zeros(len(arrays), dtype='int')
+        if self.flag_name in kwargs:
+            flags[:] = np.asarray(kwargs[self.flag_name], dtype='bool')
+        return flags
+
+    def value_table(self):
+        return np.arange(2)
+
 # Helper functions
 def StartOfSequence():
     return BooleanFlag('sos')
@@ -1,48 +1,662 @@
 from ..piece import Piece
+from .event_arrays import EventArrays
+from .data import EventDataBuilder, OutputLibrary, _numpy_to_output_library_format
+from .storage import BitPackedMatrix, DictionaryEncodedMatrix
+from .label import NO_LABEL
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import functools
+import numpy as np
 
 class EventData(object):
     def __init__(self, event, formatter):
         self.vec = formatter.make_vector(event)
         self.labels = formatter.make_labels(event)
 
+    @classmethod
+    def from_arrays(cls, vec, labels):
+        ''' Build an EventData from an already formatted vector and label tuple. '''
+        event_data = cls.__new__(cls)
+        event_data.vec = vec
+        event_data.labels = labels
+        return event_data
+
+    def __eq__(self, other):
+        if not isinstance(other, EventData):
+            return False
+        return (self.labels == other.labels
+                and np.array_equal(np.asarray(self.vec), np.asarray(other.vec)))
+
+class PackedEventData(EventData):
+    '''
+    An EventData whose vector is row `row` of a shared storage matrix (see mud.fmt.storage, e.g. a
+    BitPackedMatrix), unpacked and converted to the output library `library` when accessed, so it
+    has the same type as an unpacked EventData's.
+    '''
+    _library = OutputLibrary.NUMPY
+
+    def __init__(self, storage, row, labels, library=OutputLibrary.NUMPY):
+        self._storage = storage
+        self._row = row
+        self.labels = labels
+        self._library = library
+
+    @property
+    def vec(self):
+        return _numpy_to_output_library_format(self._storage[self._row], self._library)
+
+def _format_events(events, formatter):
+    '''
+    Format a list of events in a single batch (see EventDataBuilder.make_matrix), returning an
+    EventData for each. The vectors of the returned EventData are rows of one shared matrix.
+    '''
+    if len(events) == 0:
+        return []
+    arrays = EventArrays(events)
+    vectors = formatter.make_matrix(arrays)
+    labels = formatter.make_label_matrix(arrays)
+    return [EventData.from_arrays(vec, formatter.labels_to_tuple(l))
+            for vec, l in zip(vectors, labels)]
+
+def _slice_events(timeslice, discard_rests):
+    sliced_events = list(timeslice.sliced_events())
+    if discard_rests and all(event.is_rest() for event in sliced_events):
+        return []
+    return sliced_events
+
+def _format_slices(slices_events, formatter):
+    '''
+    Format the events of several timeslices (a list of event lists) in a single batch, returning
+    a TimeSliceData for each.
+    '''
+    event_data = _format_events([e for events in slices_events for e in events], formatter)
+    timeslices = []
+    start = 0
+    for events in slices_events:
+        timeslices.append(TimeSliceData.from_event_data(event_data[start:start + len(events)]))
+        start += len(events)
+    return timeslices
+
 class TimeSliceData(object):
     def __init__(self, timeslice, formatter, discard_rests=False):
-        sliced_events = list(timeslice.sliced_events())
-        is_rest = (discard_rests and all(event.is_rest() for event in sliced_events))
-        if is_rest and discard_rests:
-            self.events = []
-        else:
-            self.events = [EventData(e, formatter) for e in sliced_events]
+        self.events = _format_events(_slice_events(timeslice, discard_rests), formatter)
+
+    @classmethod
+    def from_event_data(cls, events):
+        ''' Build a TimeSliceData directly from a list of EventData. '''
+        ts_data = cls.__new__(cls)
+        ts_data.events = list(events)
+        return ts_data
 
     def __iter__(self):
         return self.events.__iter__()
 
+    def __eq__(self, other):
+        if not isinstance(other, TimeSliceData):
+            return False
+        return self.events == other.events
+
 class BarData(object):
     def __init__(self, bar, formatter, slice_resolution, discard_rests=False):
-        self.timeslices = [TimeSliceData(ts, formatter, discard_rests)
-                           for ts in bar.generate_slices(slice_resolution)]
+        self.timeslices = _format_slices([_slice_events(ts, discard_rests)
+                                          for ts in bar.generate_slices(slice_resolution)],
+                                         formatter)
+
+    @classmethod
+    def from_timeslices(cls, timeslices):
+        ''' Build a BarData directly from a list of already formatted TimeSliceData. '''
+        bar_data = cls.__new__(cls)
+        bar_data.timeslices = list(timeslices)
+        return bar_data
+
+    def run_length_encode(self):
+        ''' Return a RunLengthBarData holding the same timeslices. '''
+        return RunLengthBarData(self)
 
     def __iter__(self):
         return self.timeslices.__iter__()
 
+    def __len__(self):
+        return len(self.timeslices)
+
+class RunLengthBarData(object):
+    '''
+    A BarData stored as runs of identical consecutive timeslices: `timeslices` holds the content
+    of each run and `counts` holds how many times it repeats.
+    At fine slice resolutions, held notes produce many identical slices (only the first and last
+    slice of a note differ in their continuation flags), so this is usually much smaller.
+    Iterating over (or indexing) a RunLengthBarData expands the runs, so it can be used anywhere
+    a BarData is iterated.
+    '''
+    def __init__(self, bar_data):
+        self.timeslices = []
+        self.counts = []
+        for ts in bar_data:
+            if len(self.timeslices) > 0 and ts == self.timeslices[-1]:
+                self.counts[-1] += 1
+            else:
+                self.timeslices.append(ts)
+                self.counts.append(1)
+        # Cumulative end index of each run, used for indexing into the expanded bar.
+        self._run_ends = list(np.cumsum(self.counts, dtype=int))
+
+    def expand(self):
+        ''' Return the equivalent (uncompressed) BarData. '''
+        return BarData.from_timeslices(self)
+
+    def __iter__(self):
+        for ts, count in zip(self.timeslices, self.counts):
+            for _ in range(count):
+                yield ts
+
+    def __len__(self):
+        return self._run_ends[-1] if len(self._run_ends) > 0 else 0
+
+    def __getitem__(self, key):
+        if key < 0:
+            key += len(self)
+        if key < 0 or key >= len(self):
+            raise IndexError('timeslice index out of range')
+        return self.timeslices[bisect_right(self._run_ends, key)]
+
 class PieceData(object):
     '''
     Structured like a mud.Piece, but contains formatted data for the events in a piece
     (i.e. vectors/matrices and labels).
     Designed purely for iterating over the vectors/labels during training;
     anything more complicated than that should be done to a mud.Piece.
+    With `workers` > 1, ranges of bars are formatted concurrently (see PackedPieceData).
+    Event vectors are in the formatter's output library, including when they are stored (see
+    with_vector_storage).
     '''
-    def __init__(self, piece, formatter, slice_resolution, discard_rests=False):
+    _library = OutputLibrary.NUMPY
+
+    def __init__(self, piece, formatter, slice_resolution, discard_rests=False, workers=None):
         if isinstance(piece, self.__class__):
             raise NotImplementedError('Can\'t copy PieceData yet')
         elif not isinstance(piece, Piece):
             raise ValueError('PieceData is constructed from a Piece')
-        
+        if workers is not None and workers > 1:
+            packed = PackedPieceData(piece, formatter, slice_resolution, discard_rests, workers)
+            self.bars = packed.unpack(formatter).bars
+            self._storage = None
+            self._library = formatter.output_library()
+            return
+
+        # Format every event in the piece in one batch, then split it back up into bars.
+        bar_slices = [[_slice_events(ts, discard_rests)
+                       for ts in bar.generate_slices(slice_resolution)]
+                      for bar in piece.bars()]
+        timeslices = _format_slices([events for slices in bar_slices for events in slices],
+                                    formatter)
         self.bars = []
+        start = 0
+        for slices in bar_slices:
+            self.bars.append(BarData.from_timeslices(timeslices[start:start + len(slices)]))
+            start += len(slices)
+        self._storage = None
+        self._library = formatter.output_library()
+
+    @classmethod
+    def from_bars(cls, bars, library=OutputLibrary.NUMPY):
+        '''
+        Build a PieceData directly from a list of already formatted bars, whose vectors are in
+        the output library `library`.
+        '''
+        piece_data = cls.__new__(cls)
+        piece_data.bars = list(bars)
+        piece_data._storage = None
+        piece_data._library = library
+        return piece_data
+
+    def output_library(self):
+        return self._library
+
+    def _stored_events(self):
+        ''' The stored EventData, in order (the runs of run-length encoded bars appear once). '''
+        return [event for bar in self.bars for ts in bar.timeslices for event in ts.events]
+
+    def with_vector_storage(self, storage):
+        '''
+        Return a PieceData whose event vectors are the rows of `storage` (see mud.fmt.storage),
+        which must hold the stored vectors (see vector_matrix) in order. Event vectors are
+        gathered from it and converted to this PieceData's output library when accessed (see
+        PackedEventData).
+        '''
+        events = self._stored_events()
+        if len(storage) != len(events):
+            raise ValueError(f'storage has {len(storage)} rows for {len(events)} events')
+        rows = iter(range(len(events)))
+
+        def store_bar(bar):
+            stored_bar = copy.copy(bar)
+            stored_bar.timeslices = [
+                TimeSliceData.from_event_data(
+                    PackedEventData(storage, next(rows), event.labels, self._library)
+                    for event in ts.events)
+                for ts in bar.timeslices]
+            return stored_bar
+
+        piece_data = self.__class__.from_bars((store_bar(bar) for bar in self.bars),
+                                              self._library)
+        piece_data._storage = storage
+        return piece_data
+
+    def pack_bits(self):
+        '''
+        Return a PieceData storing every event vector as a row of one BitPackedMatrix, which
+        needs 1 bit per column instead of the formatter's dtype. Event vectors are unpacked when
+        accessed, and vector_matrix() unpacks every vector at once. The vectors must be binary,
+        so formatters with continuous features (e.g. NoteOctaveContinuous) can't be packed.
+        '''
+        return self.with_vector_storage(BitPackedMatrix.from_dense(self.vector_matrix()))
+
+    def dictionary_encode(self):
+        '''
+        Return a PieceData storing its event vectors in a DictionaryEncodedMatrix: a table of the
+        distinct vectors and an id per event. See DataCorpus to share one table between pieces.
+        '''
+        return self.with_vector_storage(DictionaryEncodedMatrix.from_dense(self.vector_matrix()))
+
+    def _with_storage_like(self, piece_data):
+        ''' Store the vectors of `piece_data` the same way as this PieceData\'s. '''
+        if isinstance(self._storage, BitPackedMatrix):
+            return piece_data.pack_bits()
+        if isinstance(self._storage, DictionaryEncodedMatrix):
+            return piece_data.dictionary_encode()
+        return piece_data
+
+    def is_bit_packed(self):
+        return isinstance(self._storage, BitPackedMatrix)
+
+    def is_dictionary_encoded(self):
+        return isinstance(self._storage, DictionaryEncodedMatrix)
+
+    def pack(self):
+        ''' Return the equivalent PackedPieceData. '''
+        return PackedPieceData.from_piece_data(self)
+
+    def vector_matrix(self):
+        '''
+        Return the vectors of the stored events (see run_length_encode) as one
+        (num_events x dim) matrix, in order. Bit-packed or dictionary encoded vectors are
+        unpacked in a single batch.
+        '''
+        if self._storage is not None:
+            return self._storage.to_dense()
+        events = self._stored_events()
+        if len(events) == 0:
+            return np.zeros((0, 0))
+        return np.stack([np.asarray(event.vec) for event in events])
+
+    def run_length_encode(self):
+        '''
+        Return a PieceData with every bar stored as a RunLengthBarData.
+        Iteration over the result is unchanged; see RunLengthBarData.
+        '''
+        return self._with_storage_like(self.__class__.from_bars(
+            (bar if isinstance(bar, RunLengthBarData) else RunLengthBarData(bar)
+             for bar in self.bars), self._library))
+
+    def expand(self):
+        ''' Return a PieceData with any run-length encoded bars expanded. '''
+        return self._with_storage_like(self.__class__.from_bars(
+            (bar.expand() if isinstance(bar, RunLengthBarData) else bar
+             for bar in self.bars), self._library))
+
+    def __iter__(self):
+        return self.bars.__iter__()
+
+class MultiResolutionPieceData(object):
+    '''
+    Formatted data for a piece sliced at several resolutions at once.
+    `levels[i]` is a PieceData sliced at `resolutions[i]`, ordered from the coarsest to the finest
+    resolution. The slices of each bar are built for every resolution in a single pass over the
+    bar's events (see Span.generate_slices), and the timeslices of neighbouring levels are
+    aligned so that `children`/`parent` lookups between them are O(1).
+    Like in the SliceHierarchy of each bar, timeslices are addressed by their index within their
+    bar, so both lookups take a `(level, bar, index)` and return indices within the same bar.
+    '''
+    def __init__(self, piece, formatter, slice_resolutions, discard_rests=False):
+        if not isinstance(piece, Piece):
+            raise ValueError('MultiResolutionPieceData is constructed from a Piece')
+        if len(slice_resolutions) == 0:
+            raise ValueError('must provide at least one slice resolution')
+
+        self.resolutions = tuple(sorted(slice_resolutions, reverse=True))
+        level_bars = [[] for _ in self.resolutions]
         for bar in piece.bars():
-            fmt_bar = BarData(bar, formatter, slice_resolution, discard_rests)
-            self.bars.append(fmt_bar)
+            hierarchy = bar.generate_slices(self.resolutions)
+            for level, slices in enumerate(hierarchy):
+                level_bars[level].append(BarData.from_timeslices(_format_slices(
+                    [_slice_events(ts, discard_rests) for ts in slices], formatter)))
+        self._ratios = [int(round(coarse / fine))
+                        for coarse, fine in zip(self.resolutions[:-1], self.resolutions[1:])]
+        self.levels = [PieceData.from_bars(bars, formatter.output_library())
+                       for bars in level_bars]
+
+    def level(self, slice_resolution):
+        ''' Return the PieceData for a given slice resolution. '''
+        return self.levels[self.resolutions.index(slice_resolution)]
+
+    def children(self, level, bar, index):
+        '''
+        Return the (start, end) range of the timeslices at `level + 1` in bar `bar` that make up
+        timeslice `index` at `level`.
+        '''
+        if level < 0 or level >= len(self.levels) - 1:
+            raise ValueError(f'level {level} has no finer level')
+        ratio = self._ratios[level]
+        num_fine = len(self.levels[level + 1].bars[bar])
+        return (min(index * ratio, num_fine), min((index + 1) * ratio, num_fine))
+
+    def parent(self, level, bar, index):
+        '''
+        Return the index of the timeslice at `level - 1` in bar `bar` containing timeslice
+        `index` at `level`.
+        '''
+        if level <= 0 or level >= len(self.levels):
+            raise ValueError(f'level {level} has no coarser level')
+        if index < 0 or index >= len(self.levels[level].bars[bar]):
+            raise IndexError(f'bar {bar} has no timeslice {index} at level {level}')
+        return index // self._ratios[level - 1]
+
+    def __iter__(self):
+        return self.levels.__iter__()
+
+    def __len__(self):
+        return len(self.levels)
+
+class PackedTimeSliceData(object):
+    '''
+    A view of one timeslice of a PackedPieceData: `vectors` and `labels` are the rows of its
+    events. Iterating produces an EventData per event, like a TimeSliceData.
+    '''
+    def __init__(self, vectors, labels):
+        self.vectors = vectors
+        self.labels = labels
+
+    @property
+    def events(self):
+        return [EventData.from_arrays(vec, EventDataBuilder.labels_to_tuple(l))
+                for vec, l in zip(self.vectors, self.labels)]
+
+    def __iter__(self):
+        return self.events.__iter__()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __eq__(self, other):
+        if not isinstance(other, (TimeSliceData, PackedTimeSliceData)):
+            return False
+        return self.events == list(other.events)
+
+class PackedBarData(object):
+    '''
+    A view of one bar of a PackedPieceData: `vectors` and `labels` are the rows of every event in
+    the bar, and `slice_offsets` the (bar-relative) boundaries of its timeslices.
+    '''
+    def __init__(self, vectors, labels, slice_offsets):
+        self.vectors = vectors
+        self.labels = labels
+        self.slice_offsets = slice_offsets
+
+    def timeslice(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('timeslice index out of range')
+        start, end = self.slice_offsets[index], self.slice_offsets[index + 1]
+        return PackedTimeSliceData(self.vectors[start:end], self.labels[start:end])
+
+    @property
+    def timeslices(self):
+        return [self.timeslice(i) for i in range(len(self))]
+
+    def __getitem__(self, index):
+        return self.timeslice(index)
+
+    def __iter__(self):
+        return self.timeslices.__iter__()
+
+    def __len__(self):
+        return len(self.slice_offsets) - 1
+
+class PackedPieceData(object):
+    '''
+    Formatted data for a piece stored as flat arrays rather than a tree of objects:
+        - `vectors`: the (num_events x dim) vectors of every event, in order,
+        - `labels`: the (num_events x num_labellers) integer labels of every event, with missing
+          labels marked by mud.fmt.label.NO_LABEL,
+        - `slice_offsets`: timeslice j holds the events [slice_offsets[j], slice_offsets[j + 1]),
+        - `bar_offsets`: bar i holds the timeslices [bar_offsets[i], bar_offsets[i + 1]).
+    bar(i) and timeslice(j) return views of these arrays without copying, and iterating gives
+    bars, timeslices and EventData like a PieceData.
+    `vectors` may also be a storage matrix (see pack_bits and dictionary_encode), in which case
+    views unpack their rows when accessed. Arrays are stored with numpy, whatever the formatter's
+    output library; see EventDataBuilder.to_output_library (or unpack) to convert them.
+    With `workers` > 1, the piece is split into that many ranges of bars with a similar
+    estimated number of events (see estimate_bar_sizes), which are formatted in a pool of
+    processes and concatenated.
+    '''
+    def __init__(self, piece, formatter, slice_resolution, discard_rests=False, workers=None):
+        if not isinstance(piece, Piece):
+            raise ValueError('PackedPieceData is constructed from a Piece')
+        if workers is not None and workers > 1:
+            ranges = split_bar_ranges(estimate_bar_sizes(piece, slice_resolution), workers)
+            format_part = functools.partial(format_packed_piece,
+                                            formatter=formatter,
+                                            slice_resolution=slice_resolution,
+                                            discard_rests=discard_rests)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                parts = list(executor.map(format_part, bar_range_pieces(piece, ranges)))
+            self.__dict__.update(self.concatenate(parts).__dict__)
+            return
+        bar_slices = [[_slice_events(ts, discard_rests)
+                       for ts in bar.generate_slices(slice_resolution)]
+                      for bar in piece.bars()]
+        slices = [events for bar in bar_slices for events in bar]
+        arrays = EventArrays([event for events in slices for event in events])
+        self.vectors = formatter.make_matrix(arrays, library=OutputLibrary.NUMPY)
+        self.labels = formatter.make_label_matrix(arrays)
+        self.slice_offsets = _offsets([len(events) for events in slices])
+        self.bar_offsets = _offsets([len(bar) for bar in bar_slices])
+
+    @classmethod
+    def from_arrays(cls, vectors, labels, slice_offsets, bar_offsets):
+        ''' Build a PackedPieceData directly from its arrays. '''
+        piece_data = cls.__new__(cls)
+        piece_data.vectors = vectors
+        piece_data.labels = labels
+        piece_data.slice_offsets = np.asarray(slice_offsets, dtype='int64')
+        piece_data.bar_offsets = np.asarray(bar_offsets, dtype='int64')
+        return piece_data
+
+    @classmethod
+    def from_piece_data(cls, piece_data):
+        '''
+        Pack a PieceData (run-length encoded bars are expanded). Labels are converted back from
+        tuples, so this is slower than formatting the piece directly. A PieceData has no record of
+        its vector and label widths, so the arrays of a piece without events are (0 x 0).
+        '''
+        bars = [list(bar) for bar in piece_data]
+        slices = [ts for bar in bars for ts in bar]
+        events = [event for ts in slices for event in ts.events]
+        if len(events) > 0:
+            vectors = np.stack([np.asarray(event.vec) for event in events])
+            labels = np.array([[NO_LABEL if l is None else l for l in event.labels]
+                               for event in events], dtype='int').reshape(len(events), -1)
+        else:
+            vectors, labels = np.zeros((0, 0)), np.zeros((0, 0), dtype='int')
+        return cls.from_arrays(vectors, labels,
+                               _offsets([len(ts.events) for ts in slices]),
+                               _offsets([len(bar) for bar in bars]))
+
+    @classmethod
+    def concatenate(cls, parts):
+        '''
+        Join PackedPieceData holding consecutive ranges of bars of a piece (or several pieces) into
+        one. The result is bit-packed if every part is, dictionary encoded if every part is encoded
+        with the same table, and dense otherwise. Parts without events only add their (empty) bars
+        and timeslices, as their arrays may not have the width of the others (see from_piece_data).
+        '''
+        parts = list(parts)
+        if len(parts) == 0:
+            raise ValueError('must provide at least one PackedPieceData to concatenate')
+        filled = [part for part in parts if part.num_events() > 0] or parts[:1]
+        if all(part.is_bit_packed() for part in filled):
+            vectors = BitPackedMatrix(np.concatenate([part.vectors.packed for part in filled]),
+                                      filled[0].vectors.num_columns, filled[0].vectors.dtype)
+        elif all(part.is_dictionary_encoded() and part.vectors.table is filled[0].vectors.table
+                 for part in filled):
+            vectors = DictionaryEncodedMatrix(filled[0].vectors.table,
+                                              np.concatenate([part.vectors.ids for part in filled]))
+        else:
+            vectors = np.concatenate([part.vector_matrix() for part in filled])
+        event_starts = np.cumsum([0] + [part.num_events() for part in parts])
+        slice_starts = np.cumsum([0] + [part.num_timeslices() for part in parts])
+        return cls.from_arrays(
+            vectors,
+            np.concatenate([part.labels for part in filled]),
+            np.concatenate([[0]] + [part.slice_offsets[1:] + start
+                                    for part, start in zip(parts, event_starts)]),
+            np.concatenate([[0]] + [part.bar_offsets[1:] + start
+                                    for part, start in zip(parts, slice_starts)]))
+
+    def unpack(self, formatter=None):
+        '''
+        Return the equivalent PieceData. If `formatter` is given, the vectors are first converted
+        to its output library (see EventDataBuilder.to_output_library), in one batch.
+        '''
+        vectors = self.vector_matrix()
+        if formatter is not None:
+            vectors = formatter.to_output_library(vectors)
+        event_data = [EventData.from_arrays(vec, EventDataBuilder.labels_to_tuple(l))
+                      for vec, l in zip(vectors, self.labels)]
+        timeslices = [TimeSliceData.from_event_data(event_data[start:end])
+                      for start, end in zip(self.slice_offsets[:-1], self.slice_offsets[1:])]
+        return PieceData.from_bars(
+            (BarData.from_timeslices(timeslices[start:end])
+             for start, end in zip(self.bar_offsets[:-1], self.bar_offsets[1:])),
+            OutputLibrary.NUMPY if formatter is None else formatter.output_library())
+
+    def with_vector_storage(self, storage):
+        '''
+        Return a PackedPieceData with its vectors stored in `storage` (see mud.fmt.storage), which
+        must hold the same rows.
+        '''
+        if len(storage) != self.num_events():
+            raise ValueError(f'storage has {len(storage)} rows for {self.num_events()} events')
+        return self.from_arrays(storage, self.labels, self.slice_offsets, self.bar_offsets)
+
+    def pack_bits(self):
+        ''' Return a PackedPieceData with its vectors stored in a BitPackedMatrix. '''
+        if self.is_bit_packed():
+            return self
+        return self.with_vector_storage(BitPackedMatrix.from_dense(self.vector_matrix()))
+
+    def dictionary_encode(self):
+        ''' Return a PackedPieceData with its vectors stored in a DictionaryEncodedMatrix. '''
+        return self.with_vector_storage(DictionaryEncodedMatrix.from_dense(self.vector_matrix()))
+
+    def is_bit_packed(self):
+        return isinstance(self.vectors, BitPackedMatrix)
+
+    def is_dictionary_encoded(self):
+        return isinstance(self.vectors, DictionaryEncodedMatrix)
+
+    def num_bars(self):
+        return len(self.bar_offsets) - 1
+
+    def num_timeslices(self):
+        return len(self.slice_offsets) - 1
+
+    def num_events(self):
+        return len(self.labels)
+
+    def bar(self, index):
+        ''' Return a PackedBarData view of bar `index`. '''
+        if index < 0:
+            index += self.num_bars()
+        if index < 0 or index >= self.num_bars():
+            raise IndexError('bar index out of range')
+        first_slice, last_slice = self.bar_offsets[index], self.bar_offsets[index + 1]
+        slice_offsets = self.slice_offsets[first_slice:last_slice + 1]
+        start, end = slice_offsets[0], slice_offsets[-1]
+        return PackedBarData(self.vectors[start:end], self.labels[start:end],
+                             slice_offsets - start)
+
+    def timeslice(self, index):
+        ''' Return a PackedTimeSliceData view of timeslice `index` (counted over the piece). '''
+        if index < 0:
+            index += self.num_timeslices()
+        if index < 0 or index >= self.num_timeslices():
+            raise IndexError('timeslice index out of range')
+        start, end = self.slice_offsets[index], self.slice_offsets[index + 1]
+        return PackedTimeSliceData(self.vectors[start:end], self.labels[start:end])
+
+    @property
+    def bars(self):
+        return [self.bar(i) for i in range(self.num_bars())]
+
+    def vector_matrix(self):
+        ''' Return the vectors of every event as one dense (num_events x dim) matrix. '''
+        if not isinstance(self.vectors, np.ndarray):
+            return self.vectors.to_dense()
+        return self.vectors
+
+    def __getitem__(self, index):
+        return self.bar(index)
 
     def __iter__(self):
         return self.bars.__iter__()
 
+    def __len__(self):
+        return self.num_bars()
+
+def _offsets(lengths):
+    ''' CSR-style offsets of consecutive groups with the given lengths. '''
+    offsets = np.zeros(len(lengths) + 1, dtype='int64')
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+def estimate_bar_sizes(piece, slice_resolution):
+    '''
+    Estimate the number of formatted events in each bar of a piece (the number of timeslices each
+    of its events overlaps), without slicing it. Used to balance formatting work.
+    '''
+    sizes = np.ones(len(piece.bars()))
+    for i, bar in enumerate(piece.bars()):
+        starts = np.fromiter((e.time().in_beats() for e in bar), dtype='float', count=len(bar))
+        ends = starts + np.fromiter((e.duration().in_beats() for e in bar),
+                                    dtype='float', count=len(bar))
+        num_slices = (np.ceil(ends / slice_resolution - 1e-9)
+                      - np.floor(starts / slice_resolution + 1e-9))
+        sizes[i] += np.maximum(num_slices, 1).sum()
+    return sizes
+
+def split_bar_ranges(bar_sizes, num_ranges):
+    '''
+    Split bars with the given sizes into at most `num_ranges` contiguous, non-empty
+    `(start, stop)` ranges with similar total sizes.
+    '''
+    if len(bar_sizes) == 0:
+        return [(0, 0)]
+    ends = np.cumsum(bar_sizes)
+    targets = ends[-1] * np.arange(1, num_ranges) / num_ranges
+    bounds = np.unique(np.concatenate(([0], np.searchsorted(ends, targets) + 1, [len(ends)])))
+    bounds = bounds[bounds <= len(ends)]
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+def bar_range_pieces(piece, ranges):
+    ''' Make a Piece from each `(start, stop)` range of bars of a piece. '''
+    bars = piece.bars()
+    return [Piece.from_spans(*bars[start:stop]) for start, stop in ranges]
+
+def format_packed_piece(piece, formatter, slice_resolution, discard_rests=False,
+                        bit_packed=False):
+    ''' Format a piece as a PackedPieceData, e.g. in a worker process. '''
+    piece_data = PackedPieceData(piece, formatter, slice_resolution, discard_rests)
+    return piece_data.pack_bits() if bit_packed else piece_data
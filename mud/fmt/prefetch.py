@@ -0,0 +1,129 @@
+'''
+Prefetching of batches in the background, so preparing the next batches (formatting, gathering,
+padding) overlaps with training on the current one.
+'''
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+_ITEM, _END, _ERROR = range(3)
+
+# The function applied by a Prefetcher's worker processes, set once per process (see
+# _set_worker_function) rather than pickled with every task.
+_worker_function = None
+
+def _set_worker_function(function):
+    global _worker_function
+    _worker_function = function
+
+def _call_worker_function(item):
+    return _worker_function(item)
+
+class Prefetcher(object):
+    '''
+    Iterate over the items of `source` (any iterable, e.g. a DataCorpus, a BucketBatchSampler or
+    WindowSampler.batches()) while up to `buffer_size` of the next items are prepared in the
+    background.
+    Without `function`, the source is iterated in a background thread. With `function`, the
+    source should produce cheap tasks (e.g. the piece indices of BucketBatchSampler.batches())
+    and `function` is applied to them by `workers` threads, or processes with `processes` (in
+    which case the function and tasks must be picklable). Items are produced in the order of the
+    source either way.
+    An exception raised by the source or by `function` is raised again by the iteration. Breaking
+    out of the iteration, or calling close(), stops the background work.
+    '''
+    def __init__(self, source, function=None, buffer_size=None, workers=1, processes=False):
+        if workers < 1:
+            raise ValueError('Prefetcher needs at least one worker')
+        if buffer_size is None:
+            buffer_size = 2 * workers
+        if buffer_size < 1:
+            raise ValueError('Prefetcher buffer_size must be at least 1')
+        self.source = source
+        self.function = function
+        self.buffer_size = buffer_size
+        self.workers = workers
+        self.processes = processes
+        self._iterator = None
+
+    def _make_executor(self):
+        if self.function is None:
+            return None
+        if self.processes:
+            return ProcessPoolExecutor(max_workers=self.workers,
+                                       initializer=_set_worker_function,
+                                       initargs=(self.function,))
+        return ThreadPoolExecutor(max_workers=self.workers)
+
+    def _submit(self, executor, item):
+        if self.processes:
+            return executor.submit(_call_worker_function, item)
+        return executor.submit(self.function, item)
+
+    @staticmethod
+    def _put(buffer, stop, entry):
+        ''' Put an entry in the buffer unless stopped first; returns whether it was put. '''
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, buffer, stop, executor):
+        try:
+            for item in self.source:
+                if executor is not None:
+                    item = self._submit(executor, item)
+                if not self._put(buffer, stop, (_ITEM, item)):
+                    return
+            self._put(buffer, stop, (_END, None))
+        except BaseException as e:
+            self._put(buffer, stop, (_ERROR, e))
+
+    def _iterate(self):
+        buffer = queue.Queue(maxsize=self.buffer_size)
+        stop = threading.Event()
+        executor = self._make_executor()
+        producer = threading.Thread(target=self._produce, args=(buffer, stop, executor),
+                                    daemon=True)
+        producer.start()
+        try:
+            while True:
+                kind, value = buffer.get()
+                if kind == _END:
+                    return
+                if kind == _ERROR:
+                    raise value
+                yield value if executor is None else value.result()
+        finally:
+            stop.set()
+            while True:
+                try:
+                    kind, value = buffer.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == _ITEM and executor is not None:
+                    value.cancel()
+            producer.join()
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def close(self):
+        ''' Stop any background work of the current iteration. '''
+        if self._iterator is not None:
+            self._iterator.close()
+            self._iterator = None
+
+    def __iter__(self):
+        self.close()
+        self._iterator = self._iterate()
+        return self._iterator
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,134 @@
+'''
+Compact storage for formatted data matrices.
+Stored matrices are indexed by row like a numpy array (`matrix[i]`, `matrix[start:stop]` or
+`matrix[indices]`), and unpack only the rows that are accessed. They also provide `shape`,
+`nbytes`, `to_dense()` and `len`.
+'''
+
+import numpy as np
+
+def row_range(matrix, start, stop):
+    ''' A view of the rows [start, stop) of an array or stored matrix, without unpacking them. '''
+    if isinstance(matrix, BitPackedMatrix):
+        return BitPackedMatrix(matrix.packed[start:stop], matrix.num_columns, matrix.dtype)
+    if isinstance(matrix, DictionaryEncodedMatrix):
+        return DictionaryEncodedMatrix(matrix.table, matrix.ids[start:stop])
+    return matrix[start:stop]
+
+class BitPackedMatrix(object):
+    '''
+    A binary (0/1) matrix stored with 8 columns per byte (see numpy.packbits).
+    Feature vectors built from one-hot and flag features are binary, so this stores them in
+    1/64th of the memory of a float64 matrix. Rows are unpacked to `dtype` on access.
+    '''
+    def __init__(self, packed, num_columns, dtype='float64'):
+        '''
+        Args:
+            `packed`: a (num_rows x ceil(num_columns / 8)) uint8 array of packed rows.
+            `num_columns`: the number of columns of the unpacked matrix.
+            `dtype`: the dtype of unpacked rows.
+        '''
+        self.packed = packed
+        self.num_columns = num_columns
+        self.dtype = np.dtype(dtype)
+
+    @classmethod
+    def from_dense(cls, matrix, dtype=None):
+        ''' Pack a 2D binary matrix. Unpacked rows have the matrix's dtype unless given. '''
+        matrix = np.asarray(matrix)
+        if matrix.ndim != 2:
+            raise ValueError(f'can only bit-pack 2D matrices, not shape {matrix.shape}')
+        if not np.all((matrix == 0) | (matrix == 1)):
+            raise ValueError('can only bit-pack binary (0/1) matrices')
+        return cls(np.packbits(matrix.astype('bool'), axis=1),
+                   matrix.shape[1],
+                   matrix.dtype if dtype is None else dtype)
+
+    @property
+    def shape(self):
+        return (len(self.packed), self.num_columns)
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    def to_dense(self):
+        return self[:]
+
+    def __getitem__(self, rows):
+        return np.unpackbits(self.packed[rows], axis=-1,
+                             count=self.num_columns).astype(self.dtype)
+
+    def __len__(self):
+        return len(self.packed)
+
+class DictionaryEncodedMatrix(object):
+    '''
+    A matrix stored as a table of its distinct rows and the table index (id) of each row.
+    Formatted vectors only take a few distinct values (features are discrete), so the ids
+    usually take far less memory than the vectors, and the table can be shared between many
+    matrices (see encode_many). Rows are gathered from the table on access.
+    '''
+    def __init__(self, table, ids):
+        '''
+        Args:
+            `table`: a (num_distinct_rows x num_columns) array (or other row-indexable matrix,
+                e.g. a BitPackedMatrix) of the distinct rows.
+            `ids`: the table index of each row of the matrix.
+        '''
+        self.table = table
+        self.ids = ids
+
+    @staticmethod
+    def id_dtype(table_size):
+        ''' The smallest unsigned dtype (of at least 16 bits) for ids into a table of this size. '''
+        return np.dtype('uint16' if table_size <= np.iinfo('uint16').max + 1 else 'uint32')
+
+    @classmethod
+    def from_dense(cls, matrix):
+        return cls.encode_many([matrix])[0]
+
+    @classmethod
+    def encode_many(cls, matrices):
+        '''
+        Encode several 2D matrices with the same number of columns using one shared table of the
+        distinct rows of all of them. Empty matrices may have any number of columns.
+        '''
+        matrices = [np.asarray(matrix) for matrix in matrices]
+        for matrix in matrices:
+            if matrix.ndim != 2:
+                raise ValueError(f'can only encode 2D matrices, not shape {matrix.shape}')
+        non_empty = [matrix for matrix in matrices if len(matrix) > 0]
+        if len(non_empty) == 0:
+            dtype = matrices[0].dtype if len(matrices) > 0 else np.dtype('float64')
+            table = np.zeros((0, 0), dtype=dtype)
+            return [cls(table, np.zeros(0, dtype=cls.id_dtype(0))) for _ in matrices]
+        table, inverse = np.unique(np.concatenate(non_empty), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1).astype(cls.id_dtype(len(table)))
+        encoded, start = [], 0
+        for matrix in matrices:
+            encoded.append(cls(table, inverse[start:start + len(matrix)]))
+            start += len(matrix)
+        return encoded
+
+    @property
+    def shape(self):
+        return (len(self.ids), self.table.shape[1])
+
+    @property
+    def dtype(self):
+        return self.table.dtype
+
+    @property
+    def nbytes(self):
+        ''' The size of the ids; the table is not included, as it is usually shared. '''
+        return self.ids.nbytes
+
+    def to_dense(self):
+        return self[:]
+
+    def __getitem__(self, rows):
+        return self.table[self.ids[rows]]
+
+    def __len__(self):
+        return len(self.ids)
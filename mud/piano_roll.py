@@ -0,0 +1,239 @@
+'''
+Piano roll conversion: a piano roll is a (time step x pitch x channel) array marking which
+pitches are sounding at each time step.
+The supported channels are:
+    - 'onset': 1 at the time step a note starts,
+    - 'sustain': 1 at every time step a note is sounding (including its onset).
+'''
+
+import math
+import numpy as np
+
+channel_names = ('onset', 'sustain')
+
+def check_channels(channels):
+    if len(channels) == 0:
+        raise ValueError('piano roll must have at least one channel')
+    for channel in channels:
+        if channel not in channel_names:
+            raise ValueError(f'Unknown piano roll channel `{channel}`, '
+                             f'must be one of {channel_names}')
+
+def num_steps_in(length, resolution):
+    ''' The number of time steps of a given resolution needed to cover `length` beats. '''
+    return int(math.ceil(length / resolution - 1e-9))
+
+def note_steps(starts, ends, midi_pitches, resolution, pitch_range, step_offsets=0):
+    '''
+    Convert note start/end times (in beats) into piano roll indices.
+    Rests (MIDI pitch -1) and notes outside of `pitch_range` are dropped.
+    `step_offsets` is added to the time steps of every note (either a scalar or one per note).
+    Returns `(start_steps, end_steps, pitch_indices)`; each note sounds for the steps
+    [start_step, end_step).
+    '''
+    low, high = pitch_range
+    start_steps = np.rint(starts / resolution).astype('int') + step_offsets
+    end_steps = np.rint(ends / resolution).astype('int') + step_offsets
+    end_steps = np.maximum(end_steps, start_steps + 1)
+    keep = (midi_pitches >= low) & (midi_pitches < high) & (midi_pitches >= 0)
+    return start_steps[keep], end_steps[keep], midi_pitches[keep] - low
+
+def fill_piano_roll(roll, start_steps, end_steps, pitch_indices, channels):
+    '''
+    Fill a preallocated (steps x pitches x channels) piano roll with notes, in a single
+    vectorized pass over the note indices (see `note_steps`). Notes are clipped to the roll, and
+    notes starting before it have no onset.
+    '''
+    num_steps, num_pitches, _ = roll.shape
+    in_roll = (start_steps < num_steps) & (end_steps > 0)
+    has_onset = start_steps[in_roll] >= 0
+    start_steps = np.clip(start_steps[in_roll], 0, num_steps)
+    end_steps = np.clip(end_steps[in_roll], 0, num_steps)
+    pitch_indices = pitch_indices[in_roll]
+    for c, channel in enumerate(channels):
+        if channel == 'onset':
+            roll[start_steps[has_onset], pitch_indices[has_onset], c] = 1
+        elif channel == 'sustain':
+            # Mark note starts and ends, then a cumulative sum over time gives the number of
+            # notes sounding at each step.
+            changes = np.zeros((num_steps + 1, num_pitches), dtype='int32')
+            np.add.at(changes, (start_steps, pitch_indices), 1)
+            np.add.at(changes, (end_steps, pitch_indices), -1)
+            roll[:, :, c] = np.cumsum(changes, axis=0)[:-1] > 0
+    return roll
+
+def make_piano_roll(num_steps, start_steps, end_steps, pitch_indices, pitch_range, channels, dtype):
+    ''' Allocate a piano roll and fill it with the given notes. '''
+    check_channels(channels)
+    roll = np.zeros((num_steps, pitch_range[1] - pitch_range[0], len(channels)), dtype=dtype)
+    return fill_piano_roll(roll, start_steps, end_steps, pitch_indices, channels)
+
+def find_notes(roll, channels=('onset', 'sustain'), threshold=0.5):
+    '''
+    Find the notes in a dense piano roll with vectorized onset detection.
+    A note is a run of consecutive steps where the sustain channel is above `threshold`. If the
+    roll has an onset channel, an onset within a run starts a new note (a repeated note).
+    Rolls without a sustain channel produce single-step notes at every onset.
+    `roll` may also be a 2D (steps x pitches) array, which is treated as a sustain channel.
+    Returns `(start_steps, end_steps, pitch_indices)`, sorted by start step then pitch; each note
+    sounds for the steps [start_step, end_step).
+    '''
+    if roll.ndim == 2:
+        roll, channels = roll[:, :, np.newaxis], ('sustain',)
+    check_channels(channels)
+    if roll.ndim != 3 or roll.shape[2] != len(channels):
+        raise ValueError(f'piano roll of shape {roll.shape} does not match channels {channels}')
+    num_steps, num_pitches, _ = roll.shape
+
+    onsets = None
+    if 'onset' in channels:
+        onsets = roll[:, :, channels.index('onset')] > threshold
+    if 'sustain' in channels:
+        active = roll[:, :, channels.index('sustain')] > threshold
+        previous = np.zeros_like(active)
+        previous[1:] = active[:-1]
+        starts = active & ~previous
+        if onsets is not None:
+            starts |= active & onsets
+        # A note ends at the first following step that is inactive or starts another note.
+        stops = ~active | starts
+    else:
+        starts = onsets
+        stops = np.ones_like(onsets)
+
+    # Lay the roll out pitch-major with a sentinel stop at the end of every pitch, so the end of
+    # each note can be found with one binary search over all stop positions.
+    padded_starts = np.zeros((num_pitches, num_steps + 1), dtype='bool')
+    padded_starts[:, :num_steps] = starts.T
+    padded_stops = np.ones((num_pitches, num_steps + 1), dtype='bool')
+    padded_stops[:, :num_steps] = stops.T
+    start_positions = np.flatnonzero(padded_starts)
+    stop_positions = np.flatnonzero(padded_stops)
+    end_positions = stop_positions[np.searchsorted(stop_positions, start_positions, side='right')]
+
+    pitch_indices = start_positions // (num_steps + 1)
+    start_steps = start_positions % (num_steps + 1)
+    end_steps = end_positions - pitch_indices * (num_steps + 1)
+    order = np.lexsort((pitch_indices, start_steps))
+    return start_steps[order], end_steps[order], pitch_indices[order]
+
+class SparsePianoRoll(object):
+    '''
+    A piano roll stored as the coordinates of its nonzero entries, for long pieces where a dense
+    roll is mostly zeros. Coordinates are sorted by time step, so dense windows of the roll can be
+    produced on demand in time proportional to the window.
+    '''
+    def __init__(self, steps, pitches, channel_indices, num_steps, pitch_range, channels,
+                 dtype='float32'):
+        '''
+        Args:
+            `steps`, `pitches`, `channel_indices`: coordinate arrays of the nonzero entries,
+                sorted by (step, pitch, channel) and without duplicates.
+            `num_steps`: the number of time steps in the roll.
+            `pitch_range`: the (low, high) MIDI pitches covered by the roll.
+            `channels`: the channel names (see mud.piano_roll).
+            `dtype`: the dtype of dense arrays produced from this roll.
+        '''
+        check_channels(channels)
+        self.steps = steps
+        self.pitches = pitches
+        self.channel_indices = channel_indices
+        self.num_steps = num_steps
+        self.pitch_range = tuple(pitch_range)
+        self.channels = tuple(channels)
+        self.dtype = dtype
+
+    @classmethod
+    def from_notes(cls, num_steps, start_steps, end_steps, pitch_indices, pitch_range, channels,
+                   dtype='float32'):
+        '''
+        Build a sparse piano roll from note indices (see `note_steps`), clipped like
+        `fill_piano_roll`.
+        '''
+        check_channels(channels)
+        in_roll = (start_steps < num_steps) & (end_steps > 0)
+        has_onset = start_steps[in_roll] >= 0
+        start_steps = np.clip(start_steps[in_roll], 0, num_steps)
+        end_steps = np.clip(end_steps[in_roll], 0, num_steps)
+        pitch_indices = pitch_indices[in_roll]
+
+        steps, pitches, channel_indices = [], [], []
+        for c, channel in enumerate(channels):
+            if channel == 'onset':
+                steps.append(start_steps[has_onset])
+                pitches.append(pitch_indices[has_onset])
+            elif channel == 'sustain':
+                # Expand each note into every step it covers.
+                lengths = end_steps - start_steps
+                run_starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+                steps.append(np.repeat(start_steps, lengths)
+                             + np.arange(lengths.sum()) - run_starts)
+                pitches.append(np.repeat(pitch_indices, lengths))
+            channel_indices.append(np.full(len(steps[-1]), c, dtype='int'))
+        steps = np.concatenate(steps).astype('int64')
+        pitches = np.concatenate(pitches).astype('int64')
+        channel_indices = np.concatenate(channel_indices)
+
+        # Sort and remove duplicates (overlapping notes of the same pitch) in one step.
+        num_pitches = pitch_range[1] - pitch_range[0]
+        keys = np.unique((steps * num_pitches + pitches) * len(channels) + channel_indices)
+        channel_indices = keys % len(channels)
+        keys //= len(channels)
+        return cls(steps=(keys // num_pitches).astype('int32'),
+                   pitches=(keys % num_pitches).astype('int16'),
+                   channel_indices=channel_indices.astype('int8'),
+                   num_steps=num_steps,
+                   pitch_range=pitch_range,
+                   channels=channels,
+                   dtype=dtype)
+
+    @property
+    def shape(self):
+        return (self.num_steps, self.pitch_range[1] - self.pitch_range[0], len(self.channels))
+
+    @property
+    def nnz(self):
+        ''' The number of nonzero entries. '''
+        return len(self.steps)
+
+    def to_dense(self, start=0, stop=None):
+        '''
+        Return the time steps [start, stop) of the roll as a dense array of shape
+        (stop - start, num_pitches, num_channels).
+        '''
+        if stop is None:
+            stop = self.num_steps
+        if start < 0 or stop > self.num_steps or start > stop:
+            raise ValueError(f'invalid window {start} to {stop} for piano roll of '
+                             f'{self.num_steps} steps')
+        first, last = np.searchsorted(self.steps, (start, stop), side='left')
+        dense = np.zeros((stop - start,) + self.shape[1:], dtype=self.dtype)
+        dense[self.steps[first:last] - start,
+              self.pitches[first:last],
+              self.channel_indices[first:last]] = 1
+        return dense
+
+    def windows(self, window_steps, stride=None):
+        ''' Iterate over dense windows of `window_steps` steps, `stride` steps apart. '''
+        if stride is None:
+            stride = window_steps
+        for start in range(0, max(self.num_steps - window_steps, 0) + 1, stride):
+            yield self.to_dense(start, min(start + window_steps, self.num_steps))
+
+    def to_scipy(self, channel=0):
+        '''
+        Return one channel (given by name or index) as a (num_steps x num_pitches)
+        scipy.sparse.coo_matrix. Requires scipy.
+        '''
+        try:
+            import scipy.sparse
+        except (ImportError, ModuleNotFoundError):
+            raise ValueError('Sparse piano roll conversion requires scipy, which could not be '
+                             'imported')
+        if isinstance(channel, str):
+            channel = self.channels.index(channel)
+        selected = self.channel_indices == channel
+        return scipy.sparse.coo_matrix(
+            (np.ones(np.count_nonzero(selected), dtype=self.dtype),
+             (self.steps[selected], self.pitches[selected])),
+            shape=self.shape[:2])
@@ -4,10 +4,13 @@ A Piece is an entire piece of music and it's component events.
 
 import music21 as mu
 from .notation import Pitch, Note, Rest, Time
-from .span import Span
+from .span import Span, event_content
 from .event import Event
 from .utils import deprecated
+from . import piano_roll
+from .fingerprint import fingerprint
 from typing import Optional
+import numpy as np
 
 class Piece(object):
     def __init__(
@@ -170,6 +173,146 @@ class Piece(object):
     def bars(self):
         return self._spans
 
+    def fingerprint(self):
+        '''
+        A stable hex digest of the piece's content: its key, and the offset, length and events of
+        every span (see mud.fingerprint). The piece's name is not included.
+        '''
+        spans = [(span.offset().in_beats(), span.length().in_beats(), len(span))
+                 for span in self._spans]
+        events = [event_content(event) for span in self._spans for event in span]
+        return fingerprint(self._tonic, self._key_mode,
+                           np.array(spans, dtype='float').reshape(-1, 3),
+                           np.array(events, dtype='float').reshape(-1, 7))
+
+    def to_piano_roll(self, resolution, pitch_range=(0, 128), channels=('onset', 'sustain'),
+                      dtype='float32', align_to_bars=False):
+        '''
+        Return the piece as a piano roll array of shape (num_steps, num_pitches, num_channels),
+        filled in a single vectorized pass over all events. See Span.to_piano_roll for the
+        arguments.
+        If `align_to_bars` is True, every span starts on a new time step and takes up a whole
+        number of steps, even when its offset or length isn't a multiple of `resolution`.
+        '''
+        num_steps, steps = self._piano_roll_notes(resolution, pitch_range, align_to_bars)
+        return piano_roll.make_piano_roll(num_steps, *steps, pitch_range, channels, dtype)
+
+    def to_sparse_piano_roll(self, resolution, pitch_range=(0, 128),
+                             channels=('onset', 'sustain'), dtype='float32', align_to_bars=False):
+        '''
+        Return the piece as a mud.piano_roll.SparsePianoRoll, which only stores the coordinates
+        of nonzero entries. Takes the same arguments as `to_piano_roll`.
+        '''
+        num_steps, steps = self._piano_roll_notes(resolution, pitch_range, align_to_bars)
+        return piano_roll.SparsePianoRoll.from_notes(num_steps, *steps, pitch_range, channels,
+                                                     dtype)
+
+    def _piano_roll_notes(self, resolution, pitch_range, align_to_bars):
+        starts, ends, midi_pitches, step_offsets = self._piano_roll_events(resolution,
+                                                                           align_to_bars)
+        num_steps = self._piano_roll_num_steps(resolution, align_to_bars)
+        return num_steps, piano_roll.note_steps(starts, ends, midi_pitches, resolution,
+                                                pitch_range, step_offsets)
+
+    @classmethod
+    def from_piano_roll(cls, roll, resolution, bar_length, pitch_range=None,
+                        channels=('onset', 'sustain'), threshold=0.5):
+        '''
+        Build a Piece from a dense piano roll, e.g. one sampled from a model.
+        Notes are found with vectorized onset detection (see mud.piano_roll.find_notes) and
+        grouped into one Span per bar of `bar_length` beats. Notes that cross a bar line are split
+        into one event per bar, tied together (see Event.is_note_start and Event.is_note_end), and
+        the gaps between notes in each bar are filled with Rest events.
+
+        Args:
+            `roll`: a (steps x pitches x channels) array, or a (steps x pitches) sustain array.
+            `resolution`: the length of each time step, in beats.
+            `bar_length`: the length of each bar, in beats.
+            `pitch_range`: the (low, high) MIDI pitches covered by the roll.
+                (Default: starting from MIDI pitch 0)
+            `channels`: the channels of the roll. (Default: ('onset', 'sustain'))
+            `threshold`: entries above this value are considered set. (Default: 0.5)
+        '''
+        roll = np.asarray(roll)
+        if pitch_range is None:
+            pitch_range = (0, roll.shape[1])
+        if pitch_range[1] - pitch_range[0] != roll.shape[1]:
+            raise ValueError(f'pitch range {pitch_range} does not match piano roll of shape '
+                             f'{roll.shape}')
+        start_steps, end_steps, pitch_indices = piano_roll.find_notes(roll, channels, threshold)
+
+        num_bars = piano_roll.num_steps_in(roll.shape[0] * resolution, bar_length)
+        starts = start_steps * resolution
+        ends = end_steps * resolution
+        first_bars = np.floor(starts / bar_length + 1e-9).astype('int')
+        last_bars = np.maximum(np.ceil(ends / bar_length - 1e-9).astype('int') - 1, first_bars)
+
+        # Split every note into one part per bar it overlaps.
+        counts = last_bars - first_bars + 1
+        notes = np.repeat(np.arange(len(starts)), counts)
+        bars = first_bars[notes] + np.arange(len(notes)) - np.repeat(np.cumsum(counts) - counts,
+                                                                     counts)
+        part_starts = np.maximum(starts[notes], bars * bar_length)
+        part_ends = np.minimum(ends[notes], (bars + 1) * bar_length)
+        order = np.lexsort((pitch_indices[notes], part_starts, bars))
+        notes, bars = notes[order], bars[order]
+        part_starts, part_ends = part_starts[order], part_ends[order]
+        bar_bounds = np.searchsorted(bars, np.arange(num_bars + 1), side='left')
+        pitches = {p: Pitch.from_midi_pitch(int(p) + pitch_range[0])
+                   for p in np.unique(pitch_indices)}
+
+        spans = []
+        for bar in range(num_bars):
+            offset = bar * bar_length
+            events, covered = [], 0.0
+            for i in range(bar_bounds[bar], bar_bounds[bar + 1]):
+                start, end = part_starts[i] - offset, part_ends[i] - offset
+                if start > covered + 1e-9:
+                    events.append(Event(Rest(float(start - covered)), Time(float(covered))))
+                covered = max(covered, end)
+                event = Event(Note(pitches[pitch_indices[notes[i]]], float(end - start)),
+                              Time(float(start)))
+                event._pre_continue = bool(bars[i] > first_bars[notes[i]])
+                event._post_continue = bool(bars[i] < last_bars[notes[i]])
+                events.append(event)
+            if covered < bar_length - 1e-9:
+                events.append(Event(Rest(float(bar_length - covered)), Time(float(covered))))
+            spans.append(Span(events, offset=offset, length=bar_length))
+        return cls.from_spans(*spans)
+
+    def _piano_roll_num_steps(self, resolution, align_to_bars):
+        if align_to_bars:
+            return sum(piano_roll.num_steps_in(span.length().in_beats(), resolution)
+                       for span in self._spans)
+        end = max((span.offset().in_beats() + span.length().in_beats() for span in self._spans),
+                  default=0.0)
+        return piano_roll.num_steps_in(end, resolution)
+
+    def _piano_roll_events(self, resolution, align_to_bars):
+        '''
+        Gather the event arrays of every span (see Span.event_arrays), along with the time step
+        offset of each event's span.
+        '''
+        starts, ends, midi_pitches, step_offsets = [], [], [], []
+        span_step = 0
+        for span in self._spans:
+            span_starts, span_ends, span_midi = span.event_arrays()
+            if align_to_bars:
+                step_offsets.append(np.full(len(span_starts), span_step, dtype='int'))
+                span_step += piano_roll.num_steps_in(span.length().in_beats(), resolution)
+            else:
+                span_starts = span_starts + span.offset().in_beats()
+                span_ends = span_ends + span.offset().in_beats()
+                step_offsets.append(np.zeros(len(span_starts), dtype='int'))
+            starts.append(span_starts)
+            ends.append(span_ends)
+            midi_pitches.append(span_midi)
+        if len(self._spans) == 0:
+            return (np.zeros(0, dtype='float'), np.zeros(0, dtype='float'),
+                    np.zeros(0, dtype='int'), np.zeros(0, dtype='int'))
+        return (np.concatenate(starts), np.concatenate(ends),
+                np.concatenate(midi_pitches), np.concatenate(step_offsets))
+
     def is_monophonic(self):
         return self.as_span().is_monophonic()
     
@@ -226,4 +369,4 @@ class Piece(object):
         return self.pretty_description()
 
     def __repr__(self):
-        return self.__str__()
\ No newline at end of file
+        return self.__str__()
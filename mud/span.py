@@ -4,7 +4,10 @@ A span is a range of musical events, particularly notes and rests.
 
 from .event import Event
 from .notation import Rest, Note, Pitch, Time
-from .timeslice import TimeSlice
+from .timeslice import TimeSlice, SliceHierarchy, SliceMask
+from . import piano_roll
+from .fingerprint import fingerprint
+import numpy as np
 
 class Span(object):
     def __init__(self, events=None, offset=0, length=None, sort=True, discard_rests=False):
@@ -104,11 +107,120 @@ class Span(object):
     def get_slice(self, slice_range):
         return TimeSlice(self, slice_range)
 
-    def generate_slices(self, slice_resolution):
+    def slice_ranges(self, slice_resolution):
+        '''
+        Return the (start, end) ranges of the slices generated at a given resolution.
+        '''
+        ranges = []
+        length = self.length().in_beats()
         t = 0.0
-        while t < self.length().in_beats():
-            yield self.get_slice((t, t + slice_resolution))
+        while t < length:
+            ranges.append((t, t + slice_resolution))
             t += slice_resolution
+        return ranges
+
+    def event_arrays(self):
+        '''
+        Return the events of the span as parallel arrays `(starts, ends, midi_pitches)`.
+        Start and end times are in beats relative to the span offset, and rests have a MIDI
+        pitch of -1.
+        '''
+        starts = np.fromiter((e.time().in_beats() for e in self._events),
+                             dtype='float', count=len(self._events))
+        durations = np.fromiter((e.duration().in_beats() for e in self._events),
+                                dtype='float', count=len(self._events))
+        midi_pitches = np.fromiter((e.pitch().midi_pitch() if e.is_note() else -1
+                                    for e in self._events),
+                                   dtype='int', count=len(self._events))
+        return starts, starts + durations, midi_pitches
+
+    def slice_masks(self, slice_resolution):
+        '''
+        Compute the SliceMask of every slice generated at `slice_resolution` in one vectorized pass.
+        Returns `(low, high)`, two uint64 arrays of shape (num_slices, 3) holding the low and high
+        64-bit words of the (active, onsets, continuations) masks of each slice.
+        Use SliceMask.from_words(low[i], high[i]) for a hashable mask of slice i.
+        '''
+        ranges = self.slice_ranges(slice_resolution)
+        slice_starts = np.array([r[0] for r in ranges], dtype='float')
+        slice_ends = np.array([r[1] for r in ranges], dtype='float')
+        masks = np.zeros((len(ranges), 3, 2), dtype=np.uint64)
+
+        starts, ends, midi_pitches = self.event_arrays()
+        is_note = midi_pitches >= 0
+        starts, ends, midi_pitches = starts[is_note], ends[is_note], midi_pitches[is_note]
+        if np.any(midi_pitches >= SliceMask.num_pitches):
+            raise ValueError('span contains pitches outside of the MIDI pitch range')
+
+        # Each note overlaps the slices [first, last).
+        first = np.searchsorted(slice_ends, starts, side='right')
+        last = np.searchsorted(slice_starts, ends, side='left')
+        counts = np.clip(last - first, 0, None)
+        note_idx = np.repeat(np.arange(len(starts)), counts)
+        run_starts = np.repeat(np.cumsum(counts) - counts, counts)
+        slice_idx = np.repeat(first, counts) + np.arange(counts.sum()) - run_starts
+
+        pitches = midi_pitches[note_idx]
+        words = pitches >> 6
+        bits = np.left_shift(np.uint64(1), (pitches & 63).astype(np.uint64))
+        is_onset = starts[note_idx] >= slice_starts[slice_idx]
+        np.bitwise_or.at(masks, (slice_idx, 0, words), bits)
+        np.bitwise_or.at(masks, (slice_idx[is_onset], 1, words[is_onset]), bits[is_onset])
+        np.bitwise_or.at(masks, (slice_idx[~is_onset], 2, words[~is_onset]), bits[~is_onset])
+        return masks[:, :, 0], masks[:, :, 1]
+
+    def to_piano_roll(self, resolution, pitch_range=(0, 128), channels=('onset', 'sustain'),
+                      dtype='float32', num_steps=None):
+        '''
+        Return the span as a piano roll array of shape (num_steps, num_pitches, num_channels).
+        See mud.piano_roll for the available channels.
+
+        Args:
+            `resolution`: the length of each time step, in beats.
+            `pitch_range`: the (low, high) MIDI pitches covered; pitch `low + i` is column i.
+                Notes outside of this range are ignored. (Default: all MIDI pitches)
+            `channels`: the channels to produce, in order. (Default: ('onset', 'sustain'))
+            `dtype`: the dtype of the returned array. (Default: 'float32')
+            `num_steps`: the number of time steps in the roll. Defaults to covering the length of
+                the span, so spans that are bars produce rolls aligned to the bar boundaries.
+        '''
+        num_steps, steps = self._piano_roll_notes(resolution, pitch_range, num_steps)
+        return piano_roll.make_piano_roll(num_steps, *steps, pitch_range, channels, dtype)
+
+    def to_sparse_piano_roll(self, resolution, pitch_range=(0, 128),
+                             channels=('onset', 'sustain'), dtype='float32', num_steps=None):
+        '''
+        Return the span as a mud.piano_roll.SparsePianoRoll. Takes the same arguments as
+        `to_piano_roll`.
+        '''
+        num_steps, steps = self._piano_roll_notes(resolution, pitch_range, num_steps)
+        return piano_roll.SparsePianoRoll.from_notes(num_steps, *steps, pitch_range, channels,
+                                                     dtype)
+
+    def _piano_roll_notes(self, resolution, pitch_range, num_steps):
+        if num_steps is None:
+            num_steps = piano_roll.num_steps_in(self.length().in_beats(), resolution)
+        return num_steps, piano_roll.note_steps(*self.event_arrays(), resolution, pitch_range)
+
+    def generate_slices(self, slice_resolution):
+        '''
+        Slice the span into consecutive TimeSlices of length `slice_resolution`.
+        If `slice_resolution` is a list or tuple of several resolutions, the slices at every
+        resolution are built in a single pass over the events and returned as a SliceHierarchy
+        (see mud.timeslice.SliceHierarchy), with levels ordered from coarsest to finest.
+        '''
+        if isinstance(slice_resolution, (list, tuple)):
+            resolutions = sorted(slice_resolution, reverse=True)
+            if len(resolutions) == 0:
+                raise ValueError('must provide at least one slice resolution')
+            return SliceHierarchy(self._events,
+                                  resolutions,
+                                  [self.slice_ranges(r) for r in resolutions])
+        return self._generate_slices(slice_resolution)
+
+    def _generate_slices(self, slice_resolution):
+        for slice_range in self.slice_ranges(slice_resolution):
+            yield self.get_slice(slice_range)
 
     def discard_rests(self):
         # Save the length including rests to maintain correct length.
@@ -153,8 +265,29 @@ class Span(object):
     def __repr__(self):
         return self.__str__()
 
+    def content_key(self):
+        '''
+        The content of the span as a hashable tuple: its length and its events, with times
+        relative to the span offset. The offset itself is not included, so repeated bars have
+        the same content key wherever they occur in a piece.
+        '''
+        return (self.length().in_beats(), tuple(event_content(e) for e in self._events))
+
+    def content_hash(self):
+        ''' A stable hex digest of the span's content key (see mud.fingerprint). '''
+        return fingerprint(self.content_key())
+
     def __eq__(self, other):
-        raise NotImplementedError
+        '''
+        Spans are equal if they have the same content (see content_key), regardless of offset.
+        '''
+        if not isinstance(other, Span):
+            return False
+        return self.content_key() == other.content_key()
+
+    def __hash__(self):
+        # Spans are mutable: don't modify a span while it is used as a dict key or set member.
+        return hash(self.content_key())
 
     @classmethod
     def _overlay_two_spans(cls, span_a, span_b):
@@ -189,3 +322,16 @@ class Span(object):
         Concatentate two spans together.
         '''
         raise NotImplementedError
+
+def event_content(event):
+    '''
+    The attributes of an event that determine its formatted data, as a tuple of numbers (None for
+    a missing pitch or octave).
+    '''
+    pitch = event.pitch()
+    relative_pitch, octave = None, None
+    if pitch is not None:
+        relative_pitch = pitch.relative_pitch()
+        octave = pitch.octave()
+    return (event.time().in_beats(), event.duration().in_beats(), event.is_note(),
+            relative_pitch, octave, event.is_note_start(), event.is_note_end())
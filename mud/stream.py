@@ -0,0 +1,237 @@
+'''
+Streaming of formatted data from corpora too large to hold in memory: files are loaded and
+formatted one at a time, in a shuffled order, and mixed by a bounded shuffle buffer (see
+ShuffledStream).
+'''
+
+from __future__ import annotations
+
+from glob import iglob
+from typing import Optional, Iterable, Callable, List, Any
+import music21 as mu
+import numpy as np
+
+from .piece import Piece
+from .fmt import EventDataBuilder
+from .fmt.batching import WindowSampler
+from .fmt.piece_data import PieceData, PackedPieceData
+from .fmt.prefetch import Prefetcher
+from .fmt.storage import BitPackedMatrix, DictionaryEncodedMatrix
+
+class FileFormatter(object):
+    '''
+    Load a piece from a file and format it, as a step of a streaming format pipeline: calling
+    it with a file name returns a list with the formatted piece (a PackedPieceData, or a
+    PieceData unless `packed`), or the items `transform` makes from it (e.g. PieceWindows).
+    Pieces that fail the filters, or fail to load with `ignore_load_errors`, give an empty list.
+    To be used in worker processes, the formatter, filters and transform must be picklable
+    (e.g. module-level functions rather than lambdas).
+    '''
+    def __init__(
+            self,
+            formatter:          EventDataBuilder,
+            slice_resolution:   float,
+            filters:            Iterable[Callable[[Piece], bool]] = (),
+            discard_rests:      bool = False,
+            bit_packed:         bool = False,
+            packed:             bool = True,
+            transpose_to:       Optional[str] = None,
+            transform:          Optional[Callable[[Any], Iterable]] = None,
+            ignore_load_errors: bool = False):
+        self.formatter = formatter
+        self.slice_resolution = slice_resolution
+        self.filters = tuple(filters)
+        self.discard_rests = discard_rests
+        self.bit_packed = bit_packed
+        self.packed = packed
+        self.transpose_to = transpose_to
+        self.transform = transform
+        self.ignore_load_errors = ignore_load_errors
+
+    def __call__(self, fname: str) -> List:
+        try:
+            piece = Piece(fname, transpose_to=self.transpose_to)
+        except (mu.exceptions21.StreamException,
+                mu.musicxml.xmlToM21.MusicXMLImportException):
+            if self.ignore_load_errors:
+                return []
+            raise
+        if not all(f(piece) for f in self.filters):
+            return []
+        data_class = PackedPieceData if self.packed else PieceData
+        piece_data = data_class(piece, self.formatter, self.slice_resolution, self.discard_rests)
+        if self.bit_packed:
+            piece_data = piece_data.pack_bits()
+        if self.transform is None:
+            return [piece_data]
+        return list(self.transform(piece_data))
+
+class PieceWindows(object):
+    '''
+    A FileFormatter transform that splits a formatted piece into the `(vectors, labels, offsets)`
+    of its windows of `length` elements, `stride` elements apart (by default, not overlapping).
+    See mud.fmt.WindowSampler for the arguments.
+    The rows of each window are copied (keeping bit-packed or dictionary-encoded storage), so a
+    window doesn't keep the arrays of its whole piece alive, e.g. in a ShuffledStream's buffer.
+    '''
+    def __init__(self, length, granularity='timeslice', stride=None, align=None):
+        self.length = length
+        self.granularity = granularity
+        self.stride = length if stride is None else stride
+        self.align = align
+
+    def __call__(self, piece_data):
+        sampler = WindowSampler([piece_data], self.length, self.granularity, self.stride,
+                                self.align)
+        return [(_copy_rows(vectors), labels.copy(), offsets)
+                for vectors, labels, offsets in (sampler.window(0, start)
+                                                 for start in sampler.window_starts(0))]
+
+def _copy_rows(matrix):
+    ''' Copy an array or stored matrix, sharing only a dictionary-encoded matrix's table. '''
+    if isinstance(matrix, BitPackedMatrix):
+        return BitPackedMatrix(matrix.packed.copy(), matrix.num_columns, matrix.dtype)
+    if isinstance(matrix, DictionaryEncodedMatrix):
+        return DictionaryEncodedMatrix(matrix.table, matrix.ids.copy())
+    return matrix.copy()
+
+class ShuffledStream(object):
+    '''
+    Iterate over the items loaded from `sources` (e.g. file names, with `load` a FileFormatter) in
+    a random order, buffering at most `buffer_size` items, plus the items of the source being
+    read. Memory is only bounded per item if items don't share memory with the rest of their
+    source: formatted pieces and PieceWindows items don't, but views (e.g. from
+    WindowSampler.window) keep their whole piece alive while they are buffered.
+    Each epoch, the sources are loaded in a shuffled order and their items go through a shuffle
+    buffer: once the buffer is full, each new item replaces a uniformly chosen buffered item,
+    which is produced. Larger buffers mix items from more sources.
+    The order only depends on `seed` and the epoch (see set_epoch). state() returns the position
+    in the epoch after the last produced item, and iteration after load_state(state) resumes from
+    it exactly. To do so, load_state loads (and formats) the sources of the buffered items and
+    the one being read again, which can be up to `buffer_size` + 1 sources.
+    With `workers` > 1, sources are loaded ahead in that many processes (see
+    mud.fmt.Prefetcher), which requires a picklable `load`.
+    '''
+    def __init__(
+            self,
+            sources:     Iterable[Any],
+            load:        Callable[[Any], List],
+            buffer_size: int = 64,
+            seed:        int = 0,
+            workers:     Optional[int] = None):
+        if buffer_size < 1:
+            raise ValueError('ShuffledStream buffer_size must be at least 1')
+        self.sources = list(sources)
+        self.load = load
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.workers = workers
+        self.epoch = 0
+        self._state = None
+        self._resume_state = None
+
+    @classmethod
+    def from_patterns(
+            cls,
+            patterns:    Iterable[str],
+            load:        Callable[[str], List],
+            buffer_size: int = 64,
+            seed:        int = 0,
+            workers:     Optional[int] = None) -> ShuffledStream:
+        '''
+        Stream the files matching globbable `patterns` (sorted, so the order only depends on the
+        seed).
+        '''
+        fnames = sorted(set(fname for pattern in patterns for fname in iglob(pattern)))
+        return cls(fnames, load, buffer_size, seed, workers)
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+        self._state = None
+        self._resume_state = None
+
+    def source_order(self, epoch: Optional[int] = None) -> np.ndarray:
+        ''' The order in which the sources are loaded in an epoch (by default, the current one). '''
+        epoch = self.epoch if epoch is None else epoch
+        return np.random.default_rng((self.seed, epoch, 0)).permutation(len(self.sources))
+
+    def state(self) -> dict:
+        '''
+        The position in the current epoch after the last produced item, as a dict of:
+            - 'epoch' and 'offset': the epoch and the number of items produced in it,
+            - 'position' and 'item': the next source (its index in source_order) and item of it
+              to be read,
+            - 'buffered': the `(position, item)` of every buffered item, in buffer order,
+            - 'rng': the state of the shuffle buffer's random generator.
+        '''
+        if self._state is None:
+            return self._initial_state()
+        return dict(self._state)
+
+    def load_state(self, state: dict):
+        '''
+        Resume the next iteration from a state (see state()). The next iteration starts by loading
+        the sources of the buffered items again, up to `buffer_size` sources.
+        '''
+        self.epoch = state['epoch']
+        self._state = dict(state)
+        self._resume_state = dict(state)
+
+    def _make_rng(self):
+        return np.random.default_rng((self.seed, self.epoch, 1))
+
+    def _initial_state(self):
+        return {'epoch': self.epoch, 'offset': 0, 'position': 0, 'item': 0, 'buffered': [],
+                'rng': self._make_rng().bit_generator.state}
+
+    def _load_all(self, positions, order):
+        ''' Load the sources at the given positions, in order, possibly ahead in processes. '''
+        fnames = (self.sources[order[position]] for position in positions)
+        if self.workers is not None and self.workers > 1:
+            return Prefetcher(fnames, self.load, workers=self.workers, processes=True)
+        return (self.load(fname) for fname in fnames)
+
+    def _iterate(self, state):
+        order = self.source_order()
+        rng = self._make_rng()
+        rng.bit_generator.state = state['rng']
+        offset, start_position, start_item = state['offset'], state['position'], state['item']
+
+        # Restore the buffer by loading the sources of the buffered items again.
+        buffered = [tuple(key) for key in state['buffered']]
+        positions = sorted(set(position for position, _ in buffered))
+        loaded = dict(zip(positions, list(self._load_all(positions, order))))
+        buffer = [(position, item, loaded[position][item]) for position, item in buffered]
+        del loaded
+
+        def produce(position, item):
+            nonlocal offset
+            j = rng.integers(len(buffer))
+            buffer[j], buffer[-1] = buffer[-1], buffer[j]
+            produced = buffer.pop()[2]
+            offset += 1
+            self._state = {'epoch': self.epoch, 'offset': offset,
+                           'position': position, 'item': item,
+                           'buffered': [(p, i) for p, i, _ in buffer],
+                           'rng': rng.bit_generator.state}
+            return produced
+
+        sources = self._load_all(range(start_position, len(order)), order)
+        try:
+            for position, items in enumerate(sources, start_position):
+                first = start_item if position == start_position else 0
+                for item in range(first, len(items)):
+                    buffer.append((position, item, items[item]))
+                    if len(buffer) >= self.buffer_size:
+                        yield produce(position, item + 1)
+        finally:
+            if isinstance(sources, Prefetcher):
+                sources.close()
+        while len(buffer) > 0:
+            yield produce(len(order), 0)
+
+    def __iter__(self):
+        state = self._resume_state if self._resume_state is not None else self._initial_state()
+        self._resume_state = None
+        self._state = state
+        return self._iterate(state)
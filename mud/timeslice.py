@@ -5,6 +5,8 @@ TimeSlice API provides a utility to get the information about all playing notes
 from .notation import Time
 from .event import Event
 
+from bisect import bisect_left, bisect_right
+import numpy as np
 from pprint import pprint
 
 class SlicedEvent(Event):
@@ -47,6 +49,70 @@ class SlicedEvent(Event):
                     and Event(self) == Event(other))
         return False
 
+class SliceMask(object):
+    '''
+    A compact, hashable summary of the notes in a TimeSlice, as three 128-bit masks over MIDI
+    pitches (bit `p` set means MIDI pitch `p`):
+        - `active`: every note sounding in the slice,
+        - `onsets`: notes that start within the slice,
+        - `continuations`: notes continuing from before the slice.
+    Rests are not represented.
+    '''
+    num_pitches = 128
+
+    def __init__(self, active=0, onsets=0, continuations=0):
+        self.active = int(active)
+        self.onsets = int(onsets)
+        self.continuations = int(continuations)
+
+    @classmethod
+    def from_words(cls, low, high):
+        '''
+        Build a SliceMask from the (active, onsets, continuations) low and high 64-bit words, as
+        produced for each slice by Span.slice_masks.
+        '''
+        return cls(*(int(l) | (int(h) << 64) for l, h in zip(low, high)))
+
+    @classmethod
+    def _pitch_bit(cls, pitch):
+        midi = pitch.midi_pitch()
+        if midi < 0 or midi >= cls.num_pitches:
+            raise ValueError(f'pitch {pitch} is outside of the MIDI pitch range')
+        return 1 << midi
+
+    def pitches(self):
+        ''' The MIDI pitches active in the slice, lowest first. '''
+        return [p for p in range(self.num_pitches) if (self.active >> p) & 1]
+
+    def pitch_classes(self):
+        '''
+        A 12-bit mask of the relative pitches (C=bit 0 ... B=bit 11) active in the slice, for
+        octave-independent chord identification.
+        '''
+        classes = 0
+        active = self.active
+        while active:
+            classes |= active & 0xfff
+            active >>= 12
+        return classes
+
+    def as_tuple(self):
+        return (self.active, self.onsets, self.continuations)
+
+    def __eq__(self, other):
+        if type(other) is not self.__class__:
+            return False
+        return self.as_tuple() == other.as_tuple()
+
+    def __hash__(self):
+        return hash(self.as_tuple())
+
+    def __str__(self):
+        return 'SliceMask[active={:#x}, onsets={:#x}, continuations={:#x}]'.format(*self.as_tuple())
+
+    def __repr__(self):
+        return self.__str__()
+
 class TimeSlice(object):
     def __init__(self, span_events, slice_range):
         # The slice stores the unchanged events that overlap with the slice
@@ -60,6 +126,19 @@ class TimeSlice(object):
             if event.in_span_range(slice_range):
                 self._events.append(event)
 
+    @classmethod
+    def from_events(cls, events, slice_range):
+        '''
+        Build a TimeSlice from events that are already known to overlap with the slice range,
+        skipping the overlap test against every event in the span.
+        '''
+        if len(slice_range) != 2:
+            raise ValueError('slice range must have 2 elements')
+        ts = cls.__new__(cls)
+        ts._slice_range = slice_range
+        ts._events = list(events)
+        return ts
+
     def sliced_events(self):
         '''
         Return the events contained within the slice, sliced to fit and marked
@@ -77,6 +156,22 @@ class TimeSlice(object):
     def slice_range(self):
         return self._slice_range
 
+    def mask(self):
+        '''
+        Return a SliceMask summarising the pitches sounding, starting and continuing in this slice.
+        '''
+        active = onsets = continuations = 0
+        for event in self.sliced_events():
+            if not event.is_note():
+                continue
+            bit = SliceMask._pitch_bit(event.pitch())
+            active |= bit
+            if event.is_note_start():
+                onsets |= bit
+            else:
+                continuations |= bit
+        return SliceMask(active, onsets, continuations)
+
     def start(self):
         return self._slice_range[0]
 
@@ -101,3 +196,93 @@ class TimeSlice(object):
             if event_start > self.start() or event_end < self.end():
                 return False
         return True
+
+class SliceHierarchy(object):
+    '''
+    The slices of a span at several resolutions, nested so that every slice at a coarse
+    resolution is exactly covered by a contiguous range of slices at the next finer resolution.
+    Levels are ordered from coarsest (level 0) to finest.
+    Built by Span.generate_slices when given several resolutions.
+    '''
+    def __init__(self, span_events, resolutions, slice_ranges):
+        '''
+        Args:
+            `span_events`: the events of the span.
+            `resolutions`: the slice resolution of each level, coarsest first. Each resolution
+                must be an integer multiple of the next.
+            `slice_ranges`: a list with one entry per level (coarsest first) containing the
+                (start, end) ranges of the slices at that level.
+        '''
+        if len(resolutions) != len(slice_ranges):
+            raise ValueError('must provide slice ranges for every resolution')
+        self._resolutions = tuple(resolutions)
+        self._ratios = []
+        for coarse, fine in zip(resolutions[:-1], resolutions[1:]):
+            ratio = int(round(coarse / fine))
+            if ratio < 1 or abs(ratio * fine - coarse) > 1e-9:
+                raise ValueError(f'slice resolution {coarse} is not a multiple of {fine}')
+            self._ratios.append(ratio)
+        level_events = [[[] for _ in ranges] for ranges in slice_ranges]
+        level_starts = [[r[0] for r in ranges] for ranges in slice_ranges]
+        level_ends = [[r[1] for r in ranges] for ranges in slice_ranges]
+
+        # Single pass over the events: each event is placed directly in the slices it overlaps
+        # at every level, found by binary search rather than testing every slice.
+        for event in span_events:
+            event_start = event.time().in_beats()
+            event_end = event_start + event.duration().in_beats()
+            for level, ranges in enumerate(slice_ranges):
+                first = bisect_right(level_ends[level], event_start)
+                last = bisect_left(level_starts[level], event_end)
+                for i in range(first, last):
+                    if event.in_span_range(ranges[i]):
+                        level_events[level][i].append(event)
+
+        self._slices = [[TimeSlice.from_events(events, r) for events, r in zip(slices, ranges)]
+                        for slices, ranges in zip(level_events, slice_ranges)]
+
+    def num_levels(self):
+        return len(self._slices)
+
+    def resolutions(self):
+        return self._resolutions
+
+    def slices(self, level):
+        ''' The TimeSlices at a given level (0 is the coarsest). '''
+        return self._slices[level]
+
+    def children(self, level, index):
+        '''
+        Return the (start, end) index range of the slices at `level + 1` that make up slice
+        `index` at `level`.
+        '''
+        if level < 0 or level >= len(self._slices) - 1:
+            raise ValueError(f'level {level} has no finer level')
+        ratio = self._ratios[level]
+        num_fine = len(self._slices[level + 1])
+        return (min(index * ratio, num_fine), min((index + 1) * ratio, num_fine))
+
+    def parent(self, level, index):
+        ''' Return the index of the slice at `level - 1` that contains slice `index` at `level`. '''
+        if level <= 0 or level >= len(self._slices):
+            raise ValueError(f'level {level} has no coarser level')
+        return index // self._ratios[level - 1]
+
+    def __getitem__(self, level):
+        return self._slices[level]
+
+    def __iter__(self):
+        return self._slices.__iter__()
+
+    def __len__(self):
+        return len(self._slices)
+
+def unique_slice_masks(low, high):
+    '''
+    Deduplicate slice masks as produced by Span.slice_masks.
+    Returns `(unique_indices, inverse)`: the index of the first slice with each distinct mask, and
+    for every slice the position of its mask among the unique ones.
+    '''
+    words = np.ascontiguousarray(np.concatenate((low, high), axis=1))
+    _, unique_indices, inverse = np.unique(words, axis=0, return_index=True, return_inverse=True)
+    return unique_indices, inverse.reshape(-1)
@@ -0,0 +1,15 @@
+''' Pieces and a formatter shared by the batching and dataset tests. '''
+import mud
+import mud.fmt.feature as feature
+import mud.fmt.label as label
+
+formatter = mud.fmt.EventDataBuilder(
+    features=(feature.IsNote(), feature.NoteRelativePitch()),
+    labels  =(label.RelativePitchLabels(),))
+
+def make_piece(num_bars, pitch='C4'):
+    return mud.Piece.from_spans(*[
+        mud.Span([(mud.Note(pitch, 2), mud.Time(0)),
+                  (mud.Note('E4',  1), mud.Time(0)),
+                  (mud.Rest(       2), mud.Time(2))], offset=4 * i)
+        for i in range(num_bars)])
@@ -1,6 +1,7 @@
 import unittest
 import mud
 import os
+import numpy as np
 
 class TestCorpus(unittest.TestCase):
     def test(self):
@@ -54,4 +55,107 @@ class TestDataCorpus(unittest.TestCase):
         
         # First piece
         self.assertEqual(len(data_corpus.data[0].bars), 27)
-        self.assertEqual(len(data_corpus.data[1].bars), 1)
\ No newline at end of file
+        self.assertEqual(len(data_corpus.data[1].bars), 1)
+        packed_corpus = corpus.format_data(formatter, resolution, bit_packed=True)
+        for piece_data, packed_piece_data in zip(data_corpus, packed_corpus):
+            self.assertTrue(packed_piece_data.is_bit_packed())
+            self.assertTrue(np.array_equal(piece_data.vector_matrix(),
+                                           packed_piece_data.vector_matrix()))
+
+        packed_corpus = corpus.format_data(formatter, resolution, packed=True, bit_packed=True)
+        for piece_data, packed_piece_data in zip(data_corpus, packed_corpus):
+            self.assertTrue(isinstance(packed_piece_data, mud.fmt.PackedPieceData))
+            self.assertTrue(np.array_equal(piece_data.vector_matrix(),
+                                           packed_piece_data.vector_matrix()))
+
+    def test_cache(self):
+        from mud.fmt import label, feature
+        import shutil
+        cache_dir = 'test/test-temp/format-cache'
+        if os.path.exists(cache_dir):
+            shutil.rmtree(cache_dir)
+        make_formatter = lambda: mud.fmt.EventDataBuilder(
+            features=(feature.IsNote(), feature.NoteRelativePitch()),
+            labels  =(label.RelativePitchLabels(),))
+        corpus = mud.Corpus(patterns=('test/test-files/piece.musicxml',))
+        data_corpus = corpus.format_data(make_formatter(), 0.5, cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        cache_file = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+        modified = os.path.getmtime(cache_file)
+
+        # Equal corpora and formatters hit the cache.
+        same_corpus = mud.Corpus(patterns=('test/test-files/piece.musicxml',))
+        self.assertEqual(same_corpus.fingerprint(), corpus.fingerprint())
+        cached = same_corpus.format_data(make_formatter(), 0.5, cache_dir=cache_dir)
+        self.assertEqual(os.listdir(cache_dir), [os.path.basename(cache_file)])
+        self.assertEqual(os.path.getmtime(cache_file), modified)
+        for piece_data, cached_piece_data in zip(data_corpus, cached):
+            self.assertTrue(np.array_equal(piece_data.vector_matrix(),
+                                           cached_piece_data.vector_matrix()))
+
+        # Any change to the arguments is a new entry.
+        corpus.format_data(make_formatter(), 0.25, cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+        corpus.pieces[0].bars()[0]._events.pop()
+        corpus.format_data(make_formatter(), 0.5, cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 3)
+        shutil.rmtree(cache_dir)
+
+    def test_workers(self):
+        from mud.fmt import label, feature
+        corpus = mud.Corpus(patterns=('test/test-files/canon_in_d.mxl',
+                                      'test/test-files/piece.musicxml'))
+        formatter = mud.fmt.EventDataBuilder(
+            features=(feature.IsNote(), feature.NoteRelativePitch()),
+            labels  =(label.RelativePitchLabels(),))
+        expected = corpus.format_data(formatter, 0.5)
+        for packed in (False, True):
+            data_corpus = corpus.format_data(formatter, 0.5, packed=packed, workers=2)
+            self.assertEqual(len(data_corpus), len(expected))
+            for piece_data, expected_piece_data in zip(data_corpus, expected):
+                self.assertEqual(isinstance(piece_data, mud.fmt.PackedPieceData), packed)
+                for bar, expected_bar in zip(piece_data, expected_piece_data):
+                    for ts, expected_ts in zip(bar, expected_bar):
+                        self.assertEqual(list(ts), expected_ts.events)
+
+    def test_bar_dictionary(self):
+        from mud.fmt import label, feature
+        corpus = mud.Corpus(patterns=('test/test-files/canon_in_d.mxl',
+                                      'test/test-files/canon_in_d.mxl'))
+        formatter = mud.fmt.EventDataBuilder(
+            features=(feature.IsNote(), feature.NoteRelativePitch()),
+            labels  =(label.RelativePitchLabels(),))
+        expected = corpus.format_data(formatter, 0.5)
+        data_corpus = corpus.format_data(formatter, 0.5, bar_dictionary=True)
+
+        num_unique = len(set(corpus.pieces[0].bars()))
+        self.assertEqual(len(data_corpus.bar_dictionary), num_unique)
+        self.assertEqual(data_corpus.bar_ids[0].tolist(), data_corpus.bar_ids[1].tolist())
+        for bar, shared_bar in zip(data_corpus.data[0], data_corpus.data[1]):
+            self.assertIs(bar, shared_bar)
+        for piece_data, expected_piece_data in zip(data_corpus, expected):
+            for bar, expected_bar in zip(piece_data, expected_piece_data):
+                self.assertEqual(bar.timeslices, expected_bar.timeslices)
+        with self.assertRaises(ValueError):
+            corpus.format_data(formatter, 0.5, bar_dictionary=True, packed=True)
+
+    def test_dictionary_encoded(self):
+        from mud.fmt import label, feature
+        corpus = mud.Corpus(patterns=('test/test-files/canon_in_d.mxl',
+                                      'test/test-files/piece.musicxml'))
+        formatter = mud.fmt.EventDataBuilder(
+            features=(feature.IsNote(), feature.NoteRelativePitch()),
+            labels  =(label.RelativePitchLabels(),))
+        expected = corpus.format_data(formatter, 0.5)
+        for options in (dict(), dict(bit_packed=True), dict(packed=True)):
+            data_corpus = corpus.format_data(formatter, 0.5, dictionary_encoded=True, **options)
+            self.assertTrue(all(piece_data.is_dictionary_encoded() for piece_data in data_corpus))
+            storages = [piece_data.vectors if isinstance(piece_data, mud.fmt.PackedPieceData)
+                        else piece_data._storage for piece_data in data_corpus]
+            self.assertIs(storages[0].table, storages[1].table)
+            for piece_data, expected_piece_data in zip(data_corpus, expected):
+                self.assertEqual(piece_data.vector_matrix().tolist(),
+                                 expected_piece_data.vector_matrix().tolist())
+        self.assertEqual(len(storages[0].table),
+                         len(np.unique(np.concatenate([d.vector_matrix() for d in expected]),
+                                       axis=0)))
@@ -0,0 +1,123 @@
+import unittest
+import mud
+import mud.fmt.label as label
+import numpy as np
+from fmt_helpers import formatter, make_piece
+
+
+class TestBucketBatchSampler(unittest.TestCase):
+    def setUp(self):
+        self.data = [mud.fmt.PackedPieceData(make_piece(n), formatter, 1.0)
+                     for n in (1, 5, 2, 6, 1, 5, 2)]
+
+    def test(self):
+        sampler = mud.fmt.BucketBatchSampler(self.data, batch_size=2, seed=3)
+        batches = list(sampler)
+        self.assertEqual(len(batches), len(sampler))
+        self.assertEqual(sorted(i for batch in batches for i in batch.indices), list(range(7)))
+        for batch in batches:
+            self.assertEqual(batch.vectors.shape[:2], batch.mask.shape)
+            self.assertEqual(batch.labels.shape[:2], batch.mask.shape)
+            for row, i in enumerate(batch.indices):
+                piece_data = self.data[i]
+                self.assertEqual(batch.lengths[row], piece_data.num_events())
+                self.assertEqual(batch.mask[row].sum(), piece_data.num_events())
+                self.assertTrue(np.array_equal(batch.vectors[row][batch.mask[row]],
+                                               piece_data.vectors))
+                self.assertTrue(np.all(batch.labels[row][~batch.mask[row]] == label.NO_LABEL))
+
+        # Sorting by length within the bucket pairs up pieces of equal length.
+        stats = sampler.padding_stats()
+        self.assertEqual(stats['events'], sum(d.num_events() for d in self.data))
+        self.assertGreater(stats['efficiency'], 0.9)
+        self.assertAlmostEqual(stats['efficiency'],
+                               sum(b.mask.sum() for b in batches) / sum(b.mask.size for b in batches))
+
+    def test_seed(self):
+        first = mud.fmt.BucketBatchSampler(self.data, batch_size=2, seed=3)
+        second = mud.fmt.BucketBatchSampler(self.data, batch_size=2, seed=3)
+        as_lists = lambda batches: [batch.tolist() for batch in batches]
+        self.assertEqual(as_lists(first.batches()), as_lists(second.batches()))
+        second.set_epoch(1)
+        self.assertEqual(as_lists(first.batches(epoch=1)), as_lists(second.batches()))
+        unshuffled = mud.fmt.BucketBatchSampler(self.data, batch_size=2, shuffle=False,
+                                                batches_per_bucket=1)
+        self.assertEqual(as_lists(unshuffled.batches()), [[0, 1], [2, 3], [4, 5], [6]])
+
+    def test_nested(self):
+        piece_data = mud.fmt.PieceData(make_piece(2), formatter, 1.0)
+        packed = self.data[2]
+        for granularity, length in (('timeslice', 8), ('bar', 2)):
+            sizes = np.diff(mud.fmt.batching.element_offsets(packed, granularity))
+            sampler = mud.fmt.BucketBatchSampler([piece_data, packed], batch_size=2,
+                                                 granularity=granularity, shuffle=False)
+            batch, = list(sampler)
+            self.assertEqual(batch.vectors.shape,
+                             (2, length, sizes.max(), packed.vectors.shape[1]))
+            self.assertEqual(batch.mask.shape, (2, length, sizes.max()))
+            self.assertEqual(batch.lengths.tolist(), [length, length])
+            self.assertEqual(batch.mask[1].sum(axis=-1).tolist(), sizes.tolist())
+            self.assertTrue(np.array_equal(batch.vectors[0], batch.vectors[1]))
+            self.assertTrue(np.array_equal(batch.vectors[1][batch.mask[1]], packed.vectors))
+            self.assertAlmostEqual(sampler.padding_stats()['efficiency'], batch.efficiency())
+        with self.assertRaises(ValueError):
+            mud.fmt.BucketBatchSampler(self.data, batch_size=2, granularity='beat')
+
+class TestWindowSampler(unittest.TestCase):
+    def setUp(self):
+        self.data = [mud.fmt.PackedPieceData(make_piece(n), formatter, 1.0) for n in (1, 3, 6)]
+
+    def test_windows(self):
+        # Pieces have 4 timeslices per bar.
+        sampler = mud.fmt.WindowSampler(self.data, 8, stride=2)
+        self.assertEqual(sampler.window_starts(0).tolist(), [0])
+        self.assertEqual(sampler.window_starts(1).tolist(), [0, 2, 4])
+        self.assertEqual(sampler.num_windows(2), 9)
+        aligned = mud.fmt.WindowSampler(self.data, 8, align='bar')
+        self.assertEqual(aligned.window_starts(2).tolist(), [0, 4, 8, 12, 16])
+        events = mud.fmt.WindowSampler(self.data, 5, granularity='event', align='bar')
+        self.assertEqual(events.window_starts(1).tolist(), [0, 5, 10])
+        pieces, starts = aligned.windows()
+        self.assertEqual(pieces.tolist(), [0, 1, 1, 2, 2, 2, 2, 2])
+        self.assertEqual(starts.tolist(), [0, 0, 4, 0, 4, 8, 12, 16])
+        with self.assertRaises(ValueError):
+            mud.fmt.WindowSampler(self.data, 2, granularity='bar', align='timeslice')
+
+    def test_window(self):
+        sampler = mud.fmt.WindowSampler(self.data, 8)
+        vectors, labels, offsets = sampler.window(2, 5)
+        packed = self.data[2]
+        first, last = packed.slice_offsets[5], packed.slice_offsets[13]
+        self.assertTrue(np.shares_memory(vectors, packed.vectors))
+        self.assertTrue(np.array_equal(vectors, packed.vectors[first:last]))
+        self.assertEqual(offsets.tolist(), (packed.slice_offsets[5:14] - first).tolist())
+
+        batch = sampler.batch([2, 0], [5, 0])
+        self.assertEqual(batch.lengths.tolist(), [8, 4])
+        self.assertEqual(batch.indices.tolist(), [2, 0])
+        self.assertEqual(batch.starts.tolist(), [5, 0])
+        self.assertTrue(np.array_equal(batch.vectors[0][batch.mask[0]], vectors))
+
+        bit_packed = mud.fmt.WindowSampler([d.pack_bits() for d in self.data], 8)
+        self.assertTrue(np.array_equal(bit_packed.batch([2, 0], [5, 0]).vectors, batch.vectors))
+
+    def test_sample(self):
+        sampler = mud.fmt.WindowSampler(self.data, 8, seed=0)
+        pieces, starts = sampler.sample(1000, np.random.default_rng(0))
+        counts = np.bincount(pieces, minlength=3)
+        self.assertEqual(counts[0] + counts[1] + counts[2], 1000)
+        self.assertGreater(counts[2], counts[1])
+        for piece, start in zip(pieces, starts):
+            self.assertIn(start, sampler.window_starts(piece))
+        unweighted = mud.fmt.WindowSampler(self.data, 8, weight_by_length=False)
+        counts = np.bincount(unweighted.sample(3000, np.random.default_rng(0))[0])
+        self.assertTrue(np.all(np.abs(counts - 1000) < 150))
+
+        batches = list(sampler.batches(4))
+        self.assertEqual(sampler.num_windows(), 1 + 5 + 17)
+        self.assertEqual(len(batches), 6)
+        self.assertEqual(len(list(sampler.batches(4, num_batches=2))), 2)
+        self.assertTrue(all(batch.vectors.shape[:2] == (4, 8) for batch in batches))
+        again = [(batch.indices.tolist(), batch.starts.tolist()) for batch in sampler.batches(4)]
+        self.assertEqual([(batch.indices.tolist(), batch.starts.tolist()) for batch in batches],
+                         again)
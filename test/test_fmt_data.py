@@ -1,4 +1,5 @@
 import unittest
+import numpy as np
 import mud
 import mud.fmt.feature as feature
 import mud.fmt.label as label
@@ -64,3 +65,413 @@ class TestFmtData(unittest.TestCase):
         l = formatter.make_labels(event_rest)
         self.assertEqual(len(l), 1)
         self.assertEqual(l[0], rest_label)
+
+def make_test_events():
+    span = mud.Span([
+        (mud.Note('C4', 1), mud.Time(0)),
+        (mud.Note('G5', 1), mud.Time(0)),
+        (mud.Rest(      1), mud.Time(1)),
+        (mud.Note('C4', 2), mud.Time(2)),
+        (mud.Note('A4', 2), mud.Time(2)),
+        (mud.Note('B7', 0.5), mud.Time(3.5)),
+    ])
+    events = list(span)
+    for ts in span.generate_slices(0.5):
+        events.extend(ts.sliced_events())
+    return events
+
+class TestFmtDataBatch(unittest.TestCase):
+    def test_make_matrix(self):
+        pitch_labels = label.PitchLabels(octave_range=(3, 7), include_rest=True)
+        formatter = mud.fmt.EventDataBuilder(
+            features=(
+                feature.IsNote(),
+                feature.IsRest(),
+                feature.NotePitch(pitch_labels),
+                feature.NoteRelativePitch(),
+                feature.NoteOctave((4, 6), saturate=True),
+                feature.NoteOctaveContinuous(),
+                feature.ContinuingPreviousEvent(),
+                feature.ContinuesNextEvent(),
+                feature.SpanPosition(resolution=0.5, span_length=4.0),
+                feature.NoteLength(resolution=0.5, max_length=1.5),
+                feature.BooleanFlag('flag'),
+            ),
+            labels=(
+                pitch_labels,
+                label.RelativePitchLabels(),
+                label.OctaveLabels((4, 6)),
+                label.OctaveLabels((4, 6), saturate=True),
+                label.IsNote(),
+                label.IsRest(),
+                label.ContinuingPreviousEventLabel(),
+                label.ContinuesNextEventLabel(),
+                label.SpanPosition(resolution=0.5, span_length=4.0),
+                label.NoteLength(resolution=0.5, max_length=1.5),
+                label.BooleanFlag('flag'),
+            ))
+        events = make_test_events()
+        flags = [i % 2 == 0 for i in range(len(events))]
+
+        matrix = formatter.make_matrix(events, flag=flags)
+        self.assertEqual(matrix.shape, (len(events), formatter.dim()))
+        label_matrix = formatter.make_label_matrix(events, flag=flags)
+        self.assertEqual(label_matrix.shape, (len(events), 11))
+        for i, event in enumerate(events):
+            self.assertEqual(matrix[i].tolist(),
+                             formatter.make_vector(event, flag=flags[i]).tolist())
+            self.assertEqual(formatter.labels_to_tuple(label_matrix[i]),
+                             formatter.make_labels(event, flag=flags[i]))
+
+        # Rests have no octave label unless saturating.
+        rest = events.index(mud.Event(mud.Rest(1), mud.Time(1)))
+        self.assertEqual(label_matrix[rest, 2], label.NO_LABEL)
+
+    def test_missing_octave(self):
+        # Both paths reject a pitch without an octave rather than leaving it unlabelled.
+        event = mud.Event(mud.Note('C', 1), 0)
+        for labeller in (label.OctaveLabels((4, 6)), label.OctaveLabels((4, 6), saturate=True),
+                         label.PitchLabels(octave_range=(4, 6))):
+            formatter = mud.fmt.EventDataBuilder(features=(), labels=(labeller,))
+            with self.assertRaises(ValueError):
+                formatter.make_labels(event)
+            with self.assertRaises(ValueError):
+                formatter.make_label_matrix([mud.Event(mud.Note('C4', 1), 0), event])
+
+    def test_empty(self):
+        formatter = mud.fmt.EventDataBuilder(
+            features=(feature.IsNote(), feature.NoteRelativePitch()),
+            labels=(label.RelativePitchLabels(),))
+        self.assertEqual(formatter.make_matrix([]).shape, (0, 13))
+        self.assertEqual(formatter.make_label_matrix([]).shape, (0, 1))
+
+class TestFmtDataCustomFeature(unittest.TestCase):
+    def test(self):
+        # User-defined features that ignore `out` still work.
+        class Constant(feature.EventFeature):
+            def dim(self):
+                return 2
+            def make_subvector(self, event, **kwargs):
+                return np.asarray([2.0, 3.0])
+
+        formatter = mud.fmt.EventDataBuilder(
+            features=(feature.IsNote(), Constant(), feature.IsRest()),
+            labels=(label.IsNote(),))
+        self.assertEqual([(c.start, c.stop) for c in formatter.feature_columns()],
+                         [(0, 1), (1, 3), (3, 4)])
+        events = make_test_events()
+        self.assertEqual(formatter.make_vector(events[0]).tolist(), [1.0, 2.0, 3.0, 0.0])
+        matrix = formatter.make_matrix(events)
+        for i, event in enumerate(events):
+            self.assertEqual(matrix[i].tolist(), formatter.make_vector(event).tolist())
+
+class TestFmtDataCompile(unittest.TestCase):
+    def test(self):
+        pitch_labels = label.PitchLabels(octave_range=(3, 7))
+        features = (
+            feature.IsNote(),
+            feature.IsRest(),
+            feature.NotePitch(pitch_labels),
+            feature.NoteRelativePitch(),
+            feature.NoteOctave((4, 6), saturate=True),
+            feature.NoteOctaveContinuous(),
+            feature.ContinuesNextEvent(),
+            feature.SpanPosition(resolution=0.5, span_length=4.0),
+            feature.NoteLength(resolution=0.5, max_length=1.5),
+            feature.BooleanFlag('flag'),
+        )
+        formatter = mud.fmt.EventDataBuilder(features=features, labels=())
+        compiled = mud.fmt.EventDataBuilder(features=features, labels=()).compile()
+        self.assertFalse(formatter.is_compiled())
+        self.assertTrue(compiled.is_compiled())
+
+        events = make_test_events()
+        self.assertEqual(compiled.make_matrix(events, flag=True).tolist(),
+                         formatter.make_matrix(events, flag=True).tolist())
+        for event in events:
+            self.assertEqual(compiled.make_vector(event, flag=True).tolist(),
+                             formatter.make_vector(event, flag=True).tolist())
+
+    def test_invalid_keys(self):
+        formatter = mud.fmt.EventDataBuilder(
+            features=(feature.NotePitch(label.PitchLabels(octave_range=(4, 5))),
+                      feature.NoteOctave((4, 5))),
+            labels=()).compile()
+        in_range = mud.Event(mud.Note('C4', 1), 0)
+        self.assertEqual(formatter.make_matrix([in_range]).shape, (1, 26))
+        for event in (mud.Event(mud.Note('C6', 1), 0), mud.Event(mud.Note('B3', 1), 0)):
+            with self.assertRaises(ValueError):
+                formatter.make_vector(event)
+            with self.assertRaises(ValueError):
+                formatter.make_matrix([in_range, event])
+
+    def test_out_of_midi_range(self):
+        # C10 (MIDI 132) has a label with these octaves, but no table key.
+        f = feature.NotePitch(label.PitchLabels(octave_range=(9, 10)))
+        formatter = mud.fmt.EventDataBuilder(features=(f,), labels=()).compile()
+        event = mud.Event(mud.Note('C10', 1), 0)
+        self.assertEqual(f.table_key(event), f._out_of_range_key)
+        with self.assertRaises(ValueError):
+            formatter.make_vector(event)
+        with self.assertRaises(ValueError):
+            formatter.make_matrix([mud.Event(mud.Note('G9', 1), 0), event])
+
+class TestFmtDataIndexMode(unittest.TestCase):
+    def test(self):
+        pitch_labels = label.PitchLabels(octave_range=(3, 7))
+        formatter = mud.fmt.EventDataBuilder(
+            features=(
+                feature.IsNote(),
+                feature.NotePitch(pitch_labels),
+                feature.NoteOctaveContinuous(),
+                feature.NoteRelativePitch(),
+                feature.NoteLength(resolution=0.5, max_length=1.5),
+                feature.BooleanFlag('flag'),
+            ),
+            labels=())
+        self.assertEqual(formatter.vocab_sizes(), (2, 61, 13, 3))
+        self.assertEqual(formatter.dense_dim(), 2)
+        self.assertEqual(formatter.index_dtype(), np.uint8)
+
+        events = make_test_events()
+        indices, dense = formatter.make_index_matrix(events, flag=True)
+        self.assertEqual(indices.shape, (len(events), 4))
+        self.assertEqual(indices.dtype, np.uint8)
+        self.assertEqual(dense.shape, (len(events), 2))
+
+        # Decoding the indices to one-hot matches the usual output.
+        onehot = formatter.make_matrix(events, flag=True)
+        columns = formatter.feature_columns()
+        for i, event in enumerate(events):
+            self.assertEqual(indices[i, 0], onehot[i, 0])
+            for column, f in ((1, 1), (2, 3), (3, 4)):
+                expected = onehot[i, columns[f]]
+                if expected.any():
+                    self.assertEqual(indices[i, column], expected.argmax())
+                else:
+                    self.assertEqual(indices[i, column], formatter.vocab_sizes()[column] - 1)
+            self.assertEqual(dense[i].tolist(), [onehot[i, columns[2]][0], 1.0])
+
+            single_indices, single_dense = formatter.make_index_vector(event, flag=True)
+            self.assertEqual(single_indices.tolist(), indices[i].tolist())
+            self.assertEqual(single_dense.tolist(), dense[i].tolist())
+            single_indices, _ = formatter.make_index_vector(event, library='numpy', flag=True)
+            self.assertEqual(single_indices.tolist(), indices[i].tolist())
+
+    def test_dtype(self):
+        features = (feature.IsNote(), feature.NoteOctaveContinuous(), feature.BooleanFlag('flag'))
+        events = make_test_events()
+        expected = mud.fmt.EventDataBuilder(features=features, labels=()).make_index_matrix(
+            events, flag=True)[1]
+        self.assertEqual(expected.dtype, np.float64)
+        formatter = mud.fmt.EventDataBuilder(features=features, labels=(), dtype='float32')
+        _, dense = formatter.make_index_matrix(events, flag=True)
+        self.assertEqual(dense.dtype, np.float32)
+        self.assertTrue(np.allclose(dense, expected))
+        self.assertEqual(formatter.make_index_vector(events[0], flag=True)[1].dtype, np.float32)
+
+class TestFmtDataDtype(unittest.TestCase):
+    def test(self):
+        features = (feature.IsNote(),
+                    feature.NoteRelativePitch(),
+                    feature.NoteLength(resolution=0.5, max_length=2.0))
+        events = make_test_events()
+        expected = mud.fmt.EventDataBuilder(features=features, labels=()).make_matrix(events)
+        for dtype in ('float32', 'float16', 'uint8', 'bool'):
+            formatter = mud.fmt.EventDataBuilder(features=features, labels=(), dtype=dtype)
+            self.assertEqual(formatter.dtype(), np.dtype(dtype))
+            for f in (formatter, mud.fmt.EventDataBuilder(features=features, labels=(),
+                                                          dtype=dtype).compile()):
+                matrix = f.make_matrix(events)
+                self.assertEqual(matrix.dtype, np.dtype(dtype))
+                self.assertEqual(matrix.astype('float64').tolist(), expected.tolist())
+                vector = f.make_vector(events[0])
+                self.assertEqual(vector.dtype, np.dtype(dtype))
+                self.assertEqual(vector.astype('float64').tolist(), expected[0].tolist())
+
+    def test_default(self):
+        features = (feature.IsNote(),)
+        self.assertEqual(mud.fmt.EventDataBuilder(features=features, labels=()).dtype(),
+                         np.float64)
+        torch_formatter = mud.fmt.EventDataBuilder(features=features, labels=(), library='torch')
+        self.assertEqual(torch_formatter.dtype(), np.float32)
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+class TestFmtDataOutputLibrary(unittest.TestCase):
+    features = (feature.IsNote(), feature.NoteRelativePitch())
+
+    def test_numpy(self):
+        formatter = mud.fmt.EventDataBuilder(features=self.features, labels=())
+        matrix = np.zeros((3, 13), dtype='float32')
+        self.assertIs(formatter.to_output_library(matrix), matrix)
+
+    @unittest.skipIf(torch is not None, 'torch is installed')
+    def test_torch_missing(self):
+        formatter = mud.fmt.EventDataBuilder(features=self.features, labels=(), library='torch')
+        with self.assertRaises(ValueError):
+            formatter.make_matrix(make_test_events())
+
+    @unittest.skipIf(torch is None, 'torch is not installed')
+    def test_torch(self):
+        formatter = mud.fmt.EventDataBuilder(features=self.features, labels=(), library='torch',
+                                             dtype='float32')
+        events = make_test_events()
+        matrix = formatter.make_matrix(events)
+        self.assertEqual(matrix.dtype, torch.float32)
+        self.assertEqual(matrix.numpy().tolist(),
+                         formatter.make_matrix(events, library='numpy').tolist())
+
+        # Conversion shares memory with contiguous arrays.
+        array = np.zeros((2, 13), dtype='uint8')
+        tensor = formatter.to_output_library(array)
+        array[0, 0] = 1
+        self.assertEqual(tensor[0, 0].item(), 1)
+        self.assertEqual(tensor.dtype, torch.uint8)
+
+        indices, dense = formatter.make_index_matrix(events)
+        self.assertEqual(indices.dtype, torch.uint8)
+
+    @unittest.skipIf(torch is None, 'torch is not installed')
+    def test_torch_default_dtype(self):
+        formatter = mud.fmt.EventDataBuilder(features=self.features, labels=(), library='torch')
+        events = make_test_events()
+        self.assertEqual(formatter.make_matrix(events).dtype, torch.float32)
+        self.assertEqual(formatter.make_vector(events[0]).dtype, torch.float32)
+
+class TestFmtDataLabelArrays(unittest.TestCase):
+    def test(self):
+        formatter = mud.fmt.EventDataBuilder(
+            features=(),
+            labels=(label.PitchLabels(octave_range=(3, 7)),
+                    label.RelativePitchLabels(include_rest=True),
+                    label.NoteLength(resolution=0.5, max_length=2.0)))
+        events = make_test_events()
+        columns = formatter.make_label_arrays(events)
+        matrix = formatter.make_label_matrix(events)
+        self.assertEqual(len(columns), 3)
+        for i, column in enumerate(columns):
+            self.assertEqual(column.shape, (len(events),))
+            self.assertEqual(column.tolist(), matrix[:, i].tolist())
+        for event, row in zip(events, matrix):
+            self.assertEqual(formatter.labels_to_tuple(row), formatter.make_labels(event))
+
+class TestFmtDataDecode(unittest.TestCase):
+    def setUp(self):
+        self.piece = mud.Piece()
+        self.piece.build_from_spans(
+            mud.Span([(mud.Note('C4', 1.5), mud.Time(0)),
+                      (mud.Note('E4', 1), mud.Time(0)),
+                      (mud.Rest(0.5), mud.Time(1.5)),
+                      (mud.Note('C4', 1), mud.Time(2)),
+                      (mud.Note('C4', 1), mud.Time(3))]),
+            mud.Span([(mud.Note('G4', 4), mud.Time(0))], offset=4))
+
+    def decode(self, formatter, outputs=None, **kwargs):
+        packed = mud.fmt.PackedPieceData(self.piece, formatter, slice_resolution=0.5)
+        slice_indices = np.repeat(np.arange(packed.num_timeslices()), np.diff(packed.slice_offsets))
+        if outputs is None:
+            outputs = packed.labels
+        return formatter.decode_piece(outputs, slice_indices, slice_resolution=0.5, bar_length=4,
+                                      num_slices=packed.num_timeslices(), **kwargs)
+
+    def assertSamePiece(self, decoded):
+        self.assertEqual(decoded.num_spans(), 2)
+        self.assertTrue(np.array_equal(decoded.to_piano_roll(0.5), self.piece.to_piano_roll(0.5)))
+
+    def test(self):
+        labels = (label.PitchLabels(octave_range=(3, 5)),
+                  label.ContinuingPreviousEventLabel(),
+                  label.ContinuesNextEventLabel())
+        formatter = mud.fmt.EventDataBuilder(features=(), labels=labels)
+        self.assertSamePiece(self.decode(formatter))
+
+        # Either continuation label alone is enough to merge tied slices.
+        for l in labels[1:]:
+            formatter = mud.fmt.EventDataBuilder(features=(), labels=(labels[0], l))
+            self.assertSamePiece(self.decode(formatter))
+
+        formatter = mud.fmt.EventDataBuilder(
+            features=(),
+            labels=(label.RelativePitchLabels(include_rest=True),
+                    label.OctaveLabels(octave_range=(3, 5)),
+                    label.ContinuingPreviousEventLabel()))
+        self.assertSamePiece(self.decode(formatter))
+
+    def test_missing_octave(self):
+        formatter = mud.fmt.EventDataBuilder(
+            features=(),
+            labels=(label.RelativePitchLabels(), label.OctaveLabels(octave_range=(-1, 2))))
+        self.assertEqual(formatter._decode_midi_pitches(
+            (np.array([0, 0]), np.array([0, label.NO_LABEL]))).tolist(), [0, -1])
+
+    def test_logits(self):
+        formatter = mud.fmt.EventDataBuilder(
+            features=(),
+            labels=(label.PitchLabels(octave_range=(3, 5), include_rest=True),
+                    label.ContinuesNextEventLabel()))
+        packed = mud.fmt.PackedPieceData(self.piece, formatter, slice_resolution=0.5)
+        logits = [np.eye(l.num_labels)[packed.labels[:, i]] * 20.0
+                  for i, l in enumerate((label.PitchLabels(octave_range=(3, 5), include_rest=True),
+                                         label.ContinuesNextEventLabel()))]
+        labels = formatter.labels_from_outputs(logits)
+        self.assertEqual(np.stack(labels, axis=1).tolist(), packed.labels.tolist())
+        sampled = formatter.labels_from_outputs(logits, sample=True, rng=np.random.default_rng(0))
+        self.assertEqual(np.stack(sampled, axis=1).tolist(), packed.labels.tolist())
+        self.assertSamePiece(self.decode(formatter, logits, sample=True,
+                                         rng=np.random.default_rng(0)))
+
+        self.assertEqual(formatter.label_values('Pitch', labels[0][:2]).tolist(), [60, 64])
+        self.assertEqual(formatter.label_value('Pitch', labels[0][0]), mud.Pitch('C4'))
+        with self.assertRaises(ValueError):
+            formatter.labels_from_outputs(logits[:1])
+        with self.assertRaises(ValueError):
+            formatter.labels_from_outputs([logits[0][:, :3], logits[1]])
+
+class TestFmtDataFingerprint(unittest.TestCase):
+    def test(self):
+        def make_formatter(resolution=0.5, dtype='float64'):
+            return mud.fmt.EventDataBuilder(
+                features=(feature.NotePitch(label.PitchLabels(octave_range=(3, 7))),
+                          feature.NoteLength(resolution=resolution, max_length=2.0)),
+                labels=(label.PitchLabels(octave_range=(3, 7)),),
+                dtype=dtype)
+        formatter = make_formatter()
+        fingerprint = formatter.fingerprint()
+        self.assertEqual(fingerprint, make_formatter().fingerprint())
+
+        # Compiling and decoding build caches without changing the fingerprint.
+        formatter.compile()
+        formatter.make_label_matrix(make_test_events())
+        formatter.label_values('Pitch', [0, 1])
+        self.assertEqual(formatter.fingerprint(), fingerprint)
+
+        self.assertNotEqual(make_formatter(resolution=0.25).fingerprint(), fingerprint)
+        self.assertNotEqual(make_formatter(dtype='float32').fingerprint(), fingerprint)
+
+    def test_callables(self):
+        from mud.fingerprint import fingerprint
+        def make_scale(factor):
+            return lambda x: x * factor
+        self.assertEqual(fingerprint(make_scale(2)), fingerprint(make_scale(2)))
+        self.assertNotEqual(fingerprint(make_scale(2)), fingerprint(make_scale(3)))
+        self.assertNotEqual(fingerprint(lambda x: x + 1), fingerprint(lambda x: x - 1))
+        def power(x, exponent=2):
+            return x ** exponent
+        def other_power(x, exponent=3):
+            return x ** exponent
+        other_power.__qualname__ = power.__qualname__
+        self.assertNotEqual(fingerprint(power), fingerprint(other_power))
+
+        def factorial(n):
+            return 1 if n <= 1 else n * factorial(n - 1)
+        self.assertEqual(fingerprint(factorial), fingerprint(factorial))
+
+        make_length = lambda resolution: feature.NoteLength(resolution=resolution, max_length=2.0)
+        self.assertNotEqual(fingerprint(make_length(0.5).make_subvector),
+                            fingerprint(make_length(0.25).make_subvector))
+        self.assertEqual(fingerprint(make_length(0.5).make_subvector),
+                         fingerprint(make_length(0.5).make_subvector))
@@ -0,0 +1,101 @@
+import unittest
+import os
+import pickle
+import shutil
+import mud
+import mud.fmt.label as label
+import numpy as np
+from fmt_helpers import formatter, make_piece
+
+try:
+    import torch
+except (ImportError, ModuleNotFoundError):
+    torch = None
+
+
+class TestCorpusArrays(unittest.TestCase):
+    def setUp(self):
+        self.data = [mud.fmt.PackedPieceData(make_piece(n, pitch), formatter, 1.0)
+                     for n, pitch in ((2, 'C4'), (1, 'D4'), (3, 'G4'))]
+
+    def assertSamePieces(self, arrays):
+        self.assertEqual(len(arrays), len(self.data))
+        for piece, expected in zip(arrays, self.data):
+            self.assertTrue(np.array_equal(piece.vector_matrix(), expected.vectors))
+            self.assertTrue(np.array_equal(piece.labels, expected.labels))
+            self.assertEqual(piece.slice_offsets.tolist(), expected.slice_offsets.tolist())
+            self.assertEqual(piece.bar_offsets.tolist(), expected.bar_offsets.tolist())
+
+    def test(self):
+        arrays = mud.fmt.CorpusArrays.from_data(self.data)
+        self.assertSamePieces(arrays)
+        self.assertTrue(np.shares_memory(arrays.piece(1).vectors, arrays.data.vectors))
+        self.assertTrue(np.array_equal(arrays[-1].vectors, self.data[-1].vectors))
+        self.assertTrue(mud.fmt.CorpusArrays.from_data(
+            [piece_data.pack_bits() for piece_data in self.data]).data.is_bit_packed())
+        with self.assertRaises(IndexError):
+            arrays.piece(3)
+
+    def test_empty_piece(self):
+        rests = mud.Piece.from_spans(mud.Span([(mud.Rest(4), mud.Time(0))]))
+        data = [mud.fmt.PieceData(rests, formatter, 1.0, discard_rests=True),
+                mud.fmt.PieceData(make_piece(2), formatter, 1.0)]
+        arrays = mud.fmt.CorpusArrays.from_data(data)
+        self.assertEqual(arrays.piece(0).num_events(), 0)
+        self.assertEqual(arrays.piece(0).num_timeslices(), 4)
+        self.assertTrue(np.array_equal(arrays.piece(1).vector_matrix(), data[1].vector_matrix()))
+        dataset = mud.fmt.PieceDataset(data)
+        self.assertEqual(len(dataset[0][1]), 0)
+
+    def test_save(self):
+        path = 'test/test-temp/corpus-arrays'
+        encoded = mud.fmt.DictionaryEncodedMatrix.encode_many(
+            [piece_data.vectors for piece_data in self.data])
+        for data in (self.data,
+                     [piece_data.pack_bits() for piece_data in self.data],
+                     [piece_data.with_vector_storage(matrix)
+                      for piece_data, matrix in zip(self.data, encoded)]):
+            mud.fmt.CorpusArrays.from_data(data).save(path)
+            loaded = mud.fmt.CorpusArrays.load(path)
+            self.assertSamePieces(loaded)
+            self.assertSamePieces(mud.fmt.CorpusArrays.load(path, mmap=False))
+            # Memory-mapped arrays are pickled by path.
+            self.assertLess(len(pickle.dumps(loaded)), 200)
+            self.assertSamePieces(pickle.loads(pickle.dumps(loaded)))
+        shutil.rmtree(path)
+
+class TestPieceDataset(unittest.TestCase):
+    def setUp(self):
+        self.data = [mud.fmt.PieceData(make_piece(n), formatter, 1.0) for n in (2, 1, 3, 2, 1)]
+
+    def test(self):
+        dataset = mud.fmt.PieceDataset(self.data, granularity='bar')
+        self.assertEqual(len(dataset), 5)
+        index, vectors, labels, offsets = dataset[2]
+        self.assertEqual(index, 2)
+        self.assertTrue(np.array_equal(vectors, self.data[2].vector_matrix()))
+        self.assertEqual(len(offsets), 4)
+        self.assertEqual(offsets[-1], len(labels))
+
+    def test_iterable(self):
+        dataset = mud.fmt.IterablePieceDataset(self.data, shuffle=True, seed=1)
+        shards = [dataset.shard(i, 2) for i in range(2)]
+        self.assertEqual(sorted(np.concatenate(shards).tolist()), list(range(5)))
+        self.assertEqual([item[0] for item in dataset], dataset.shard().tolist())
+        dataset.set_epoch(1)
+        self.assertEqual(sorted(item[0] for item in dataset), list(range(5)))
+
+    @unittest.skipIf(torch is None, 'torch is not installed')
+    def test_data_loader(self):
+        for dataset in (mud.fmt.PieceDataset(self.data),
+                        mud.fmt.IterablePieceDataset(self.data)):
+            loader = torch.utils.data.DataLoader(dataset, batch_size=2,
+                                                 collate_fn=dataset.collate)
+            batches = list(loader)
+            self.assertEqual(len(batches), 3)
+            for batch in batches:
+                self.assertTrue(isinstance(batch.vectors, torch.Tensor))
+                self.assertEqual(batch.mask.dtype, torch.bool)
+                for row, index in enumerate(batch.indices.tolist()):
+                    self.assertTrue(np.array_equal(batch.vectors[row][batch.mask[row]].numpy(),
+                                                   self.data[index].vector_matrix()))
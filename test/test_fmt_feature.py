@@ -195,3 +195,30 @@ class TestBooleanFlag(unittest.TestCase):
         self.assertAlmostEqual(v[0], 1.0)
 
 
+class TestOutputBuffers(unittest.TestCase):
+    def test_subvector(self):
+        pitch_labels = label.PitchLabels(octave_range=(4, 7))
+        features = (feature.IsNote(), feature.IsRest(), feature.NotePitch(pitch_labels),
+                    feature.NoteRelativePitch(), feature.NoteOctave((6, 7)),
+                    feature.NoteOctaveContinuous(), feature.ContinuingPreviousEvent(),
+                    feature.ContinuesNextEvent(), feature.SpanPosition(0.5, 4.0),
+                    feature.NoteLength(0.5, 4.0), feature.BooleanFlag('flag'))
+        for f in features:
+            for event in (note, rest):
+                expected = f.make_subvector(event, flag=True)
+                # Fill the buffer with garbage to check it is fully overwritten.
+                buffer = np.full(f.dim() + 2, 5.0)
+                out = buffer[1:-1]
+                result = f.make_subvector(event, out=out, flag=True)
+                self.assertIs(result, out)
+                self.assertEqual(out.tolist(), expected.tolist())
+                self.assertEqual(buffer[0], 5.0)
+                self.assertEqual(buffer[-1], 5.0)
+
+    def test_binvec(self):
+        out = np.ones(4)
+        self.assertIs(mud.fmt.binvec(4, 2, out=out), out)
+        self.assertEqual(out.tolist(), [0.0, 0.0, 1.0, 0.0])
+        self.assertEqual(mud.fmt.binvec(3, (1,)).tolist(), [0.0, 1.0, 0.0])
+        self.assertEqual(mud.fmt.binmat(3, [2, -1, 0]).tolist(),
+                         [[0.0, 0.0, 1.0], [0.0, 0.0, 0.0], [1.0, 0.0, 0.0]])
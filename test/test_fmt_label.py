@@ -1,14 +1,46 @@
 import unittest
 import mud
 import mud.fmt.label as label
+from mud.fmt.event_arrays import EventArrays
+
+def make_pitch_events():
+    return [mud.Event(mud.Note(pitch, 1.0), 0.0) for pitch in ('C4', 'C#5', 'B3', 'G6')] \
+        + [mud.Event(mud.Rest(1.0), 1.0)]
+
+def per_event_labels(l, events):
+    labels = (l.get_event_label(event) for event in events)
+    return [label.NO_LABEL if x is None else x for x in labels]
 
 class TestPitchLabels(unittest.TestCase):
     def test(self):
-        pass
+        events = make_pitch_events()
+        for include_rest in (False, True):
+            l = label.PitchLabels(octave_range=(3, 6), include_rest=include_rest)
+            labels = l.get_event_labels(EventArrays(events))
+            self.assertEqual(labels.tolist(), per_event_labels(l, events))
+            self.assertEqual(labels[-1], l.num_labels - 1 if include_rest else label.NO_LABEL)
+
+    def test_invalid(self):
+        l = label.PitchLabels(octave_range=(3, 5))
+        with self.assertRaises(ValueError):
+            l.get_event_labels(EventArrays(make_pitch_events()))
+        l = label.PitchLabels(octave_range=(3, 6), rpitches=('C', 'D'))
+        with self.assertRaises(ValueError):
+            l.get_event_labels(EventArrays(make_pitch_events()))
 
 class TestRelativePitchLabels(unittest.TestCase):
     def test(self):
-        pass
+        events = make_pitch_events()
+        for include_rest in (False, True):
+            l = label.RelativePitchLabels(include_rest=include_rest)
+            labels = l.get_event_labels(EventArrays(events))
+            self.assertEqual(labels.tolist(), per_event_labels(l, events))
+            self.assertEqual(labels[:4].tolist(), [0, 1, 11, 7])
+
+        l = label.RelativePitchLabels(rpitches=('C', 'Db', 'B', 'G', 'E'))
+        self.assertEqual(l.get_event_labels(EventArrays(events)).tolist(), [0, 1, 2, 3, -1])
+        with self.assertRaises(ValueError):
+            label.RelativePitchLabels(rpitches=('C',)).get_event_labels(EventArrays(events))
 
 class TestContinuingPreviousEventLabel(unittest.TestCase):
     def test(self):
@@ -3,6 +3,7 @@ import mud
 import mud.fmt.feature as feature
 import mud.fmt.label as label
 import numpy as np
+from mud.fmt.data import OutputLibrary
 
 formatter = mud.fmt.EventDataBuilder(
     features=(feature.IsNote(),
@@ -97,3 +98,257 @@ class TestPieceData(unittest.TestCase):
         self.assertEqual(len(piece_data.bars), 1)
         self.assertTrue(isinstance(piece_data.bars[0], mud.fmt.BarData))
         self.assertTrue(len(piece_data.bars[0].timeslices), 16)
+
+rle_formatter = mud.fmt.EventDataBuilder(
+    features=(feature.NoteRelativePitch(),
+              feature.ContinuingPreviousEvent(),
+              feature.ContinuesNextEvent()),
+    labels  =(label.RelativePitchLabels(),)
+)
+
+class TestRunLengthBarData(unittest.TestCase):
+    def test(self):
+        span = mud.Span([
+            (mud.Note('C4', 3), mud.Time(0)),
+            (mud.Note('A4', 1), mud.Time(3)),
+        ])
+        bar_data = mud.fmt.BarData(span, rle_formatter, slice_resolution=0.25)
+        rle = bar_data.run_length_encode()
+
+        # C4: start, 10 identical middle slices, end. A4: start, 2 identical middle slices, end.
+        self.assertEqual(len(bar_data), 16)
+        self.assertEqual(len(rle), 16)
+        self.assertEqual(rle.counts, [1, 10, 1, 1, 2, 1])
+        self.assertEqual(len(rle.timeslices), 6)
+
+        for i, ts in enumerate(bar_data):
+            self.assertEqual(rle[i], ts)
+        self.assertEqual(rle[-1], bar_data.timeslices[-1])
+        self.assertEqual(list(rle), bar_data.timeslices)
+        self.assertEqual(rle.expand().timeslices, bar_data.timeslices)
+
+    def test_piece_data(self):
+        p = mud.Piece()
+        p.build_from_spans(mud.Span([(mud.Note('C4', 4), mud.Time(0))]),
+                           mud.Span([(mud.Note('G4', 4), mud.Time(0))], offset=4))
+        piece_data = mud.fmt.PieceData(p, rle_formatter, slice_resolution=0.5)
+        rle = piece_data.run_length_encode()
+
+        self.assertTrue(all(isinstance(bar, mud.fmt.RunLengthBarData) for bar in rle))
+        self.assertEqual([len(bar.timeslices) for bar in rle], [3, 3])
+        for bar, rle_bar in zip(piece_data, rle):
+            self.assertEqual(list(bar), list(rle_bar))
+        for bar, expanded_bar in zip(piece_data, rle.expand()):
+            self.assertEqual(bar.timeslices, expanded_bar.timeslices)
+
+class TestMultiResolutionPieceData(unittest.TestCase):
+    def test(self):
+        p = mud.Piece()
+        p.build_from_spans(mud.Span([
+            (mud.Note('C4', 1), mud.Time(0)),
+            (mud.Note('G5', 1), mud.Time(0)),
+            (mud.Rest(      1), mud.Time(1)),
+            (mud.Note('C4', 2), mud.Time(2)),
+            (mud.Note('A4', 2), mud.Time(2)),
+        ]))
+        data = mud.fmt.MultiResolutionPieceData(p, formatter, (0.25, 1.0, 0.5))
+        self.assertEqual(data.resolutions, (1.0, 0.5, 0.25))
+        self.assertEqual([len(level.bars[0]) for level in data], [4, 8, 16])
+
+        for resolution in data.resolutions:
+            expected = mud.fmt.PieceData(p, formatter, slice_resolution=resolution)
+            self.assertEqual(data.level(resolution).bars[0].timeslices,
+                             expected.bars[0].timeslices)
+
+        self.assertEqual(data.children(0, 0, 2), (4, 6))
+        self.assertEqual(data.children(1, 0, 7), (14, 16))
+        self.assertEqual(data.parent(2, 0, 9), 4)
+        # Both lookups use the same addressing, so they invert each other.
+        for level in range(len(data) - 1):
+            for index in range(len(data.levels[level].bars[0])):
+                start, end = data.children(level, 0, index)
+                for child in range(start, end):
+                    self.assertEqual(data.parent(level + 1, 0, child), index)
+
+class TestBitPackedPieceData(unittest.TestCase):
+    def test(self):
+        p = mud.Piece()
+        p.build_from_spans(mud.Span([(mud.Note('C4', 3), mud.Time(0)),
+                                     (mud.Rest(      1), mud.Time(3))]),
+                           mud.Span([(mud.Note('G4', 4), mud.Time(0))], offset=4))
+        piece_data = mud.fmt.PieceData(p, rle_formatter, slice_resolution=0.5)
+        packed = piece_data.pack_bits()
+
+        self.assertTrue(packed.is_bit_packed())
+        self.assertFalse(piece_data.is_bit_packed())
+        self.assertEqual(packed.vector_matrix().tolist(), piece_data.vector_matrix().tolist())
+        for bar, packed_bar in zip(piece_data, packed):
+            self.assertEqual(bar.timeslices, packed_bar.timeslices)
+            for ts in packed_bar:
+                for event in ts:
+                    self.assertTrue(isinstance(event, mud.fmt.PackedEventData))
+                    self.assertEqual(event.vec.dtype, np.float64)
+
+        rle = packed.run_length_encode()
+        self.assertTrue(rle.is_bit_packed())
+        self.assertEqual(len(rle.vector_matrix()), sum(len(bar.timeslices) for bar in rle))
+        for bar, rle_bar in zip(piece_data, rle):
+            self.assertEqual(list(bar), list(rle_bar))
+
+    def test_non_binary(self):
+        p = mud.Piece()
+        p.build_from_spans(mud.Span([(mud.Note('C4', 4), mud.Time(0))]))
+        continuous_formatter = mud.fmt.EventDataBuilder(
+            features=(feature.NoteOctaveContinuous(),), labels=())
+        piece_data = mud.fmt.PieceData(p, continuous_formatter, slice_resolution=1.0)
+        with self.assertRaises(ValueError):
+            piece_data.pack_bits()
+
+class TestDictionaryEncodedPieceData(unittest.TestCase):
+    def test(self):
+        p = mud.Piece()
+        p.build_from_spans(mud.Span([(mud.Note('C4', 3), mud.Time(0)),
+                                     (mud.Rest(      1), mud.Time(3))]),
+                           mud.Span([(mud.Note('C4', 4), mud.Time(0))], offset=4))
+        piece_data = mud.fmt.PieceData(p, rle_formatter, slice_resolution=0.5)
+        encoded = piece_data.dictionary_encode()
+
+        self.assertTrue(encoded.is_dictionary_encoded())
+        self.assertFalse(piece_data.is_dictionary_encoded())
+        self.assertEqual(len(encoded._storage.table),
+                         len(np.unique(piece_data.vector_matrix(), axis=0)))
+        self.assertEqual(encoded.vector_matrix().tolist(), piece_data.vector_matrix().tolist())
+        for bar, encoded_bar in zip(piece_data, encoded):
+            self.assertEqual(bar.timeslices, encoded_bar.timeslices)
+
+        packed = mud.fmt.PackedPieceData.from_piece_data(piece_data).dictionary_encode()
+        self.assertTrue(packed.is_dictionary_encoded())
+        self.assertEqual(packed.vector_matrix().tolist(), piece_data.vector_matrix().tolist())
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+class TestStoredPieceDataLibrary(unittest.TestCase):
+    def setUp(self):
+        self.piece = mud.Piece()
+        self.piece.build_from_spans(mud.Span([(mud.Note('C4', 3), mud.Time(0)),
+                                              (mud.Rest(      1), mud.Time(3))]),
+                                    mud.Span([(mud.Note('C4', 4), mud.Time(0))], offset=4))
+
+    def stored(self, piece_data):
+        return (piece_data.pack_bits(), piece_data.dictionary_encode(),
+                piece_data.run_length_encode().pack_bits(), piece_data.pack_bits().expand())
+
+    def test_numpy(self):
+        piece_data = mud.fmt.PieceData(self.piece, rle_formatter, slice_resolution=0.5)
+        for stored in self.stored(piece_data):
+            self.assertIs(stored.output_library(), OutputLibrary.NUMPY)
+            for bar in stored:
+                for ts in bar:
+                    for event in ts:
+                        self.assertIsInstance(event.vec, np.ndarray)
+
+    @unittest.skipIf(torch is None, 'torch is not installed')
+    def test_torch(self):
+        torch_formatter = mud.fmt.EventDataBuilder(
+            features=(feature.NoteRelativePitch(),
+                      feature.ContinuingPreviousEvent(),
+                      feature.ContinuesNextEvent()),
+            labels=(label.RelativePitchLabels(),),
+            library='torch')
+        piece_data = mud.fmt.PieceData(self.piece, torch_formatter, slice_resolution=0.5)
+        self.assertIs(piece_data.output_library(), OutputLibrary.TORCH)
+        for stored in self.stored(piece_data):
+            self.assertIs(stored.output_library(), OutputLibrary.TORCH)
+            for bar, stored_bar in zip(piece_data, stored):
+                for ts, stored_ts in zip(bar, stored_bar):
+                    for event, stored_event in zip(ts, stored_ts):
+                        self.assertIsInstance(stored_event.vec, torch.Tensor)
+                        self.assertEqual(stored_event.vec.dtype, event.vec.dtype)
+                        self.assertTrue(torch.equal(stored_event.vec, event.vec))
+
+class TestPackedPieceData(unittest.TestCase):
+    def setUp(self):
+        self.piece = mud.Piece()
+        self.piece.build_from_spans(
+            mud.Span([(mud.Note('C4', 1), mud.Time(0)),
+                      (mud.Note('G5', 1), mud.Time(0)),
+                      (mud.Rest(      1), mud.Time(1)),
+                      (mud.Note('C4', 2), mud.Time(2)),
+                      (mud.Note('A4', 2), mud.Time(2))]),
+            mud.Span([(mud.Note('E4', 4), mud.Time(0))], offset=4))
+
+    def assertSameData(self, piece_data, packed):
+        self.assertEqual(len(packed), len(piece_data.bars))
+        for bar, packed_bar in zip(piece_data, packed):
+            self.assertEqual(len(packed_bar), len(bar))
+            for ts, packed_ts in zip(bar, packed_bar):
+                self.assertEqual(list(packed_ts), ts.events)
+
+    def test(self):
+        for discard_rests in (False, True):
+            piece_data = mud.fmt.PieceData(self.piece, formatter, 0.5, discard_rests)
+            packed = mud.fmt.PackedPieceData(self.piece, formatter, 0.5, discard_rests)
+            self.assertSameData(piece_data, packed)
+            self.assertSameData(piece_data, piece_data.pack())
+            self.assertSameData(piece_data, packed.pack_bits())
+
+        packed = mud.fmt.PackedPieceData(self.piece, formatter, 0.5)
+        self.assertEqual(packed.num_bars(), 2)
+        self.assertEqual(packed.num_timeslices(), 16)
+        self.assertEqual(packed.bar_offsets.tolist(), [0, 8, 16])
+        self.assertEqual(packed.num_events(), packed.slice_offsets[-1])
+        self.assertEqual(packed.vectors.shape, (packed.num_events(), formatter.dim()))
+
+        # Bars and timeslices are views into the piece's arrays.
+        bar = packed.bar(1)
+        self.assertTrue(np.shares_memory(bar.vectors, packed.vectors))
+        self.assertEqual(bar.slice_offsets.tolist(), list(range(9)))
+        self.assertEqual(packed.timeslice(8).labels.tolist(), bar[0].labels.tolist())
+        self.assertEqual(packed[-1][-1].labels.tolist(), packed.timeslice(-1).labels.tolist())
+        with self.assertRaises(IndexError):
+            packed.bar(2)
+        with self.assertRaises(IndexError):
+            packed.timeslice(16)
+
+class TestParallelPieceData(unittest.TestCase):
+    def setUp(self):
+        self.piece = mud.Piece()
+        self.piece.build_from_spans(*[
+            mud.Span([(mud.Note(pitch, 2), mud.Time(0)),
+                      (mud.Rest(      1), mud.Time(2)),
+                      (mud.Note('C4', 1), mud.Time(3))], offset=4 * i)
+            for i, pitch in enumerate(('D4', 'E4', 'F4', 'G4', 'A4'))])
+
+    def test_split_bar_ranges(self):
+        split = mud.fmt.piece_data.split_bar_ranges
+        self.assertEqual(split(np.ones(6), 3), [(0, 2), (2, 4), (4, 6)])
+        self.assertEqual(split(np.array([1, 1, 10, 1]), 2), [(0, 3), (3, 4)])
+        self.assertEqual(split(np.ones(2), 4), [(0, 1), (1, 2)])
+        self.assertEqual(split(np.zeros(0), 2), [(0, 0)])
+        sizes = mud.fmt.piece_data.estimate_bar_sizes(self.piece, slice_resolution=0.5)
+        self.assertEqual(sizes.tolist(), [1 + 4 + 2 + 2] * 5)
+
+    def test(self):
+        expected = mud.fmt.PackedPieceData(self.piece, formatter, 0.5, discard_rests=True)
+        packed = mud.fmt.PackedPieceData(self.piece, formatter, 0.5, discard_rests=True,
+                                         workers=2)
+        for name in ('vectors', 'labels', 'slice_offsets', 'bar_offsets'):
+            self.assertEqual(getattr(packed, name).tolist(), getattr(expected, name).tolist())
+
+        piece_data = mud.fmt.PieceData(self.piece, formatter, 0.5, workers=3)
+        expected = mud.fmt.PieceData(self.piece, formatter, 0.5)
+        for bar, expected_bar in zip(piece_data, expected):
+            self.assertEqual(bar.timeslices, expected_bar.timeslices)
+
+    def test_concatenate(self):
+        pieces = mud.fmt.piece_data.bar_range_pieces(self.piece, [(0, 2), (2, 5)])
+        parts = [mud.fmt.PackedPieceData(p, formatter, 0.5) for p in pieces]
+        expected = mud.fmt.PackedPieceData(self.piece, formatter, 0.5)
+        for concatenated in (mud.fmt.PackedPieceData.concatenate(parts),
+                             mud.fmt.PackedPieceData.concatenate(p.pack_bits() for p in parts)):
+            self.assertEqual(concatenated.vector_matrix().tolist(), expected.vectors.tolist())
+            self.assertEqual(concatenated.slice_offsets.tolist(), expected.slice_offsets.tolist())
+            self.assertEqual(concatenated.bar_offsets.tolist(), expected.bar_offsets.tolist())
@@ -0,0 +1,65 @@
+import unittest
+import threading
+import mud
+import numpy as np
+
+def square(x):
+    return x * x
+
+def fail_on_three(x):
+    if x == 3:
+        raise ValueError('three')
+    return x
+
+class TestPrefetcher(unittest.TestCase):
+    def test(self):
+        self.assertEqual(list(mud.fmt.Prefetcher(range(10))), list(range(10)))
+        for processes in (False, True):
+            prefetcher = mud.fmt.Prefetcher(range(20), square, workers=3, processes=processes)
+            self.assertEqual(list(prefetcher), [x * x for x in range(20)])
+
+    def test_bounded(self):
+        produced = []
+        def source():
+            for i in range(100):
+                produced.append(i)
+                yield i
+        iterator = iter(mud.fmt.Prefetcher(source(), buffer_size=3))
+        self.assertEqual(next(iterator), 0)
+        # One item consumed, three buffered and at most one waiting to be buffered.
+        self.assertLessEqual(len(produced), 5)
+        iterator.close()
+
+    def test_exceptions(self):
+        def source():
+            yield 1
+            raise KeyError('source')
+        iterator = iter(mud.fmt.Prefetcher(source()))
+        self.assertEqual(next(iterator), 1)
+        with self.assertRaises(KeyError):
+            next(iterator)
+        for processes in (False, True):
+            prefetcher = mud.fmt.Prefetcher(range(10), fail_on_three, processes=processes)
+            with self.assertRaises(ValueError):
+                list(prefetcher)
+
+    def test_close(self):
+        threads = threading.active_count()
+        with mud.fmt.Prefetcher(iter(range(1000)), square, workers=2) as prefetcher:
+            for i, value in enumerate(prefetcher):
+                if i == 5:
+                    break
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_batches(self):
+        formatter = mud.fmt.EventDataBuilder(features=(mud.fmt.feature.IsNote(),), labels=())
+        data = [mud.fmt.PackedPieceData(mud.Piece.from_spans(
+                    *[mud.Span([(mud.Note('C4', 4), mud.Time(0))], offset=4 * i)
+                      for i in range(n)]), formatter, 1.0)
+                for n in (1, 2, 3, 4)]
+        sampler = mud.fmt.BucketBatchSampler(data, batch_size=2, seed=0)
+        expected = list(sampler)
+        prefetched = list(mud.fmt.Prefetcher(sampler.batches(), sampler.batch, workers=2))
+        self.assertEqual(len(prefetched), len(expected))
+        for batch, expected_batch in zip(prefetched, expected):
+            self.assertTrue(np.array_equal(batch.vectors, expected_batch.vectors))
@@ -0,0 +1,61 @@
+import unittest
+import numpy as np
+from mud.fmt import BitPackedMatrix, DictionaryEncodedMatrix
+
+class TestBitPackedMatrix(unittest.TestCase):
+    def test(self):
+        rng = np.random.RandomState(0)
+        matrix = (rng.rand(7, 19) > 0.7).astype('float32')
+        packed = BitPackedMatrix.from_dense(matrix)
+
+        self.assertEqual(packed.shape, (7, 19))
+        self.assertEqual(len(packed), 7)
+        self.assertEqual(packed.nbytes, 7 * 3)
+        self.assertEqual(packed.to_dense().dtype, np.float32)
+        self.assertTrue(np.array_equal(packed.to_dense(), matrix))
+        self.assertTrue(np.array_equal(packed[2], matrix[2]))
+        self.assertTrue(np.array_equal(packed[1:4], matrix[1:4]))
+        self.assertTrue(np.array_equal(packed[[6, 0]], matrix[[6, 0]]))
+        self.assertEqual(BitPackedMatrix.from_dense(matrix, dtype='bool')[0].dtype, np.bool_)
+
+    def test_non_binary(self):
+        with self.assertRaises(ValueError):
+            BitPackedMatrix.from_dense(np.array([[0.0, 0.5]]))
+        with self.assertRaises(ValueError):
+            BitPackedMatrix.from_dense(np.zeros(4))
+
+class TestDictionaryEncodedMatrix(unittest.TestCase):
+    def test(self):
+        rng = np.random.RandomState(0)
+        rows = (rng.rand(5, 11) > 0.5).astype('float32')
+        first, second = rows[rng.randint(5, size=20)], rows[rng.randint(5, size=8)]
+        encoded_first, encoded_second = DictionaryEncodedMatrix.encode_many([first, second])
+
+        self.assertIs(encoded_first.table, encoded_second.table)
+        self.assertLessEqual(len(encoded_first.table), 5)
+        self.assertEqual(encoded_first.ids.dtype, np.uint16)
+        self.assertEqual(encoded_first.shape, (20, 11))
+        self.assertEqual(len(encoded_second), 8)
+        self.assertEqual(encoded_first.nbytes, 20 * 2)
+        self.assertEqual(encoded_first.dtype, np.float32)
+        self.assertTrue(np.array_equal(encoded_first.to_dense(), first))
+        self.assertTrue(np.array_equal(encoded_second.to_dense(), second))
+        self.assertTrue(np.array_equal(encoded_first[3], first[3]))
+        self.assertTrue(np.array_equal(encoded_first[[7, 2]], first[[7, 2]]))
+
+    def test_id_dtype(self):
+        self.assertEqual(DictionaryEncodedMatrix.id_dtype(65536), np.uint16)
+        self.assertEqual(DictionaryEncodedMatrix.id_dtype(65537), np.uint32)
+
+    def test_bit_packed_table(self):
+        matrix = np.array([[0, 1, 1], [1, 0, 0], [0, 1, 1]], dtype='float64')
+        encoded = DictionaryEncodedMatrix.from_dense(matrix)
+        encoded = DictionaryEncodedMatrix(BitPackedMatrix.from_dense(encoded.table), encoded.ids)
+        self.assertTrue(np.array_equal(encoded.to_dense(), matrix))
+
+    def test_empty(self):
+        encoded, empty = DictionaryEncodedMatrix.encode_many([np.ones((2, 3)), np.zeros((0, 0))])
+        self.assertEqual(empty.shape, (0, 3))
+        self.assertEqual(empty.to_dense().shape, (0, 3))
+        with self.assertRaises(ValueError):
+            DictionaryEncodedMatrix.from_dense(np.zeros(4))
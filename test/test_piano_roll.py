@@ -0,0 +1,187 @@
+import unittest
+import mud
+import numpy as np
+
+def make_span(offset=0):
+    return mud.Span([
+        (mud.Note('C4', 1), mud.Time(0)),
+        (mud.Note('G5', 1), mud.Time(0)),
+        (mud.Rest(      1), mud.Time(1)),
+        (mud.Note('C4', 2), mud.Time(2)),
+        (mud.Note('A4', 2), mud.Time(2)),
+    ], offset=offset)
+
+def piano_roll_by_slicing(span, resolution, pitch_range):
+    # Reference implementation, built by iterating over slices.
+    roll = np.zeros((len(list(span.generate_slices(resolution))),
+                     pitch_range[1] - pitch_range[0], 2))
+    for i, ts in enumerate(span.generate_slices(resolution)):
+        for event in ts.sliced_events():
+            if event.is_note():
+                p = event.pitch().midi_pitch() - pitch_range[0]
+                roll[i, p, 0] = float(event.is_note_start())
+                roll[i, p, 1] = 1.0
+    return roll
+
+class TestSpanPianoRoll(unittest.TestCase):
+    def test(self):
+        span = make_span()
+        roll = span.to_piano_roll(0.5, pitch_range=(48, 96))
+        self.assertEqual(roll.shape, (8, 48, 2))
+        self.assertEqual(roll.dtype, np.float32)
+        self.assertTrue(np.array_equal(roll, piano_roll_by_slicing(span, 0.5, (48, 96))))
+
+        self.assertEqual(roll[0, 60 - 48, 0], 1.0)
+        self.assertEqual(roll[1, 60 - 48, 0], 0.0)
+        self.assertEqual(roll[1, 60 - 48, 1], 1.0)
+        self.assertEqual(roll[2].sum(), 0.0)
+
+    def test_options(self):
+        span = make_span()
+        roll = span.to_piano_roll(1.0, pitch_range=(60, 72), channels=('sustain',),
+                                  dtype='uint8', num_steps=6)
+        self.assertEqual(roll.shape, (6, 12, 1))
+        self.assertEqual(roll.dtype, np.uint8)
+        # G5 is out of range.
+        self.assertEqual(roll[:, :, 0].sum(axis=1).tolist(), [1, 0, 2, 2, 0, 0])
+        with self.assertRaises(ValueError):
+            span.to_piano_roll(1.0, channels=('velocity',))
+
+class TestPiecePianoRoll(unittest.TestCase):
+    def test(self):
+        piece = mud.Piece.from_spans(make_span(0), make_span(4))
+        roll = piece.to_piano_roll(0.5)
+        self.assertEqual(roll.shape, (16, 128, 2))
+        self.assertTrue(np.array_equal(roll,
+                                       piano_roll_by_slicing(piece.as_span(), 0.5, (0, 128))))
+
+    def test_align_to_bars(self):
+        # A half beat pickup bar followed by a full bar.
+        pickup = mud.Span([(mud.Note('C4', 0.5), mud.Time(0))])
+        bar = mud.Span([(mud.Note('D4', 1), mud.Time(0))], length=4, offset=0.5)
+        piece = mud.Piece.from_spans(pickup, bar)
+
+        roll = piece.to_piano_roll(1.0, pitch_range=(60, 64))
+        self.assertEqual(roll.shape, (5, 4, 2))
+        self.assertEqual(np.nonzero(roll[:, 2, 0])[0].tolist(), [0])
+
+        roll = piece.to_piano_roll(1.0, pitch_range=(60, 64), align_to_bars=True)
+        self.assertEqual(roll.shape, (5, 4, 2))
+        self.assertEqual(np.nonzero(roll[:, 0, 1])[0].tolist(), [0])
+        self.assertEqual(np.nonzero(roll[:, 2, 0])[0].tolist(), [1])
+        self.assertEqual(np.nonzero(roll[:, 2, 1])[0].tolist(), [1])
+
+class TestSparsePianoRoll(unittest.TestCase):
+    def test(self):
+        piece = mud.Piece.from_spans(make_span(0), make_span(4))
+        dense = piece.to_piano_roll(0.25, pitch_range=(48, 96))
+        sparse = piece.to_sparse_piano_roll(0.25, pitch_range=(48, 96))
+        self.assertEqual(sparse.shape, dense.shape)
+        self.assertEqual(sparse.nnz, np.count_nonzero(dense))
+        self.assertTrue(np.array_equal(sparse.to_dense(), dense))
+        self.assertTrue(np.array_equal(sparse.to_dense(5, 21), dense[5:21]))
+
+        windows = list(sparse.windows(8, stride=4))
+        self.assertEqual(len(windows), 7)
+        for i, window in enumerate(windows):
+            self.assertTrue(np.array_equal(window, dense[4 * i:4 * i + 8]))
+
+        with self.assertRaises(ValueError):
+            sparse.to_dense(10, 40)
+
+    def test_overlapping_notes(self):
+        span = mud.Span([
+            (mud.Note('C4', 2), mud.Time(0)),
+            (mud.Note('C4', 2), mud.Time(1)),
+        ])
+        dense = span.to_piano_roll(1.0)
+        sparse = span.to_sparse_piano_roll(1.0)
+        self.assertEqual(sparse.nnz, 5)
+        self.assertTrue(np.array_equal(sparse.to_dense(), dense))
+
+    def test_note_before_window(self):
+        # A note held over from before step 0 sustains without a new onset.
+        notes = (np.array([-2, 1]), np.array([3, 2]), np.array([0, 1]))
+        dense = mud.piano_roll.make_piano_roll(4, *notes, (60, 62), ('onset', 'sustain'),
+                                               'float32')
+        self.assertEqual(dense[:, 0, 0].tolist(), [0, 0, 0, 0])
+        self.assertEqual(dense[:, 0, 1].tolist(), [1, 1, 1, 0])
+        self.assertEqual(dense[:, 1, 0].tolist(), [0, 1, 0, 0])
+        sparse = mud.piano_roll.SparsePianoRoll.from_notes(4, *notes, (60, 62),
+                                                           ('onset', 'sustain'))
+        self.assertTrue(np.array_equal(sparse.to_dense(), dense))
+
+    def test_scipy(self):
+        sparse = make_span().to_sparse_piano_roll(0.5)
+        try:
+            import scipy.sparse
+        except ImportError:
+            with self.assertRaises(ValueError):
+                sparse.to_scipy('sustain')
+            return
+        matrix = sparse.to_scipy('sustain')
+        self.assertEqual(matrix.shape, (8, 128))
+        self.assertTrue(np.array_equal(matrix.toarray(), sparse.to_dense()[:, :, 1]))
+
+class TestPieceFromPianoRoll(unittest.TestCase):
+    def test_round_trip(self):
+        # Rests between notes are rebuilt from the gaps in the roll.
+        piece = mud.Piece.from_spans(make_span(0), make_span(4))
+        roll = piece.to_piano_roll(0.25, pitch_range=(36, 96))
+        decoded = mud.Piece.from_piano_roll(roll, 0.25, bar_length=4, pitch_range=(36, 96))
+
+        self.assertEqual(decoded.num_spans(), 2)
+        for bar, decoded_bar in zip(piece.bars(), decoded.bars()):
+            self.assertEqual(bar.offset(), decoded_bar.offset())
+            self.assertEqual(bar.length(), decoded_bar.length())
+            self.assertEqual(list(bar), list(decoded_bar))
+        self.assertTrue(np.array_equal(decoded.to_piano_roll(0.25, pitch_range=(36, 96)), roll))
+
+    def test_repeated_notes(self):
+        roll = np.zeros((8, 128, 2))
+        roll[0:4, 60, 1] = 1.0
+        roll[0, 60, 0] = roll[2, 60, 0] = 1.0
+        roll[5:8, 64, 1] = 0.9
+        roll[5, 64, 0] = 0.8
+        decoded = mud.Piece.from_piano_roll(roll, 0.5, bar_length=2)
+        self.assertEqual(decoded.num_spans(), 2)
+        self.assertEqual(list(decoded.bars()[0]), [
+            mud.Event(mud.Note('C4', 1.0), 0.0),
+            mud.Event(mud.Note('C4', 1.0), 1.0),
+        ])
+        self.assertEqual(list(decoded.bars()[1]), [
+            mud.Event(mud.Rest(0.5), 0.0),
+            mud.Event(mud.Note('E4', 1.5), 0.5),
+        ])
+
+    def test_sustain_only(self):
+        roll = np.zeros((4, 12))
+        roll[1:3, 7] = 1.0
+        decoded = mud.Piece.from_piano_roll(roll, 1.0, bar_length=4, pitch_range=(60, 72))
+        self.assertEqual(list(decoded.bars()[0]), [mud.Event(mud.Rest(1.0), 0.0),
+                                                   mud.Event(mud.Note('G4', 2.0), 1.0),
+                                                   mud.Event(mud.Rest(1.0), 3.0)])
+
+    def test_bar_lines(self):
+        # A note crossing two bar lines is split into tied events, one per bar.
+        roll = np.zeros((12, 12))
+        roll[3:8, 0] = 1.0
+        roll[4:6, 4] = 1.0
+        decoded = mud.Piece.from_piano_roll(roll, 1.0, bar_length=2, pitch_range=(60, 72))
+        self.assertEqual(decoded.num_spans(), 6)
+        self.assertEqual([list(bar) for bar in decoded.bars()[1:5]], [
+            [mud.Event(mud.Rest(1.0), 0.0), mud.Event(mud.Note('C4', 1.0), 1.0)],
+            [mud.Event(mud.Note('C4', 2.0), 0.0), mud.Event(mud.Note('E4', 2.0), 0.0)],
+            [mud.Event(mud.Note('C4', 2.0), 0.0)],
+            [mud.Event(mud.Rest(2.0), 0.0)],
+        ])
+        bars = [list(bar) for bar in decoded.bars()]
+        c4 = (bars[1][1], bars[2][0], bars[3][0])
+        self.assertEqual([(e.is_note_start(), e.is_note_end()) for e in c4],
+                         [(True, False), (False, False), (False, True)])
+        self.assertTrue(bars[2][1].is_note_start() and bars[2][1].is_note_end())
+        for bar in decoded.bars():
+            self.assertLessEqual(bar.calculate_span_length(), 2.0)
+        self.assertTrue(np.array_equal(
+            decoded.to_piano_roll(1.0, pitch_range=(60, 72), channels=('sustain',))[:, :, 0],
+            roll))
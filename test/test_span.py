@@ -114,6 +114,34 @@ class TestSpan(unittest.TestCase):
         self.assertAlmostEqual(len(ts), 8)
         self.assertAlmostEqual(float(len(ts)), span.length().in_beats() / 0.5)
 
+    def test_multi_resolution_slices(self):
+        span = mud.Span([
+            (mud.Note('C4', 1), mud.Time(0)),
+            (mud.Note('G5', 1), mud.Time(0)),
+            (mud.Rest(      1), mud.Time(1)),
+            (mud.Note('C4', 2), mud.Time(2)),
+            (mud.Note('A4', 2), mud.Time(2)),
+        ])
+        hierarchy = span.generate_slices((0.5, 2.0, 1.0))
+        self.assertEqual(hierarchy.resolutions(), (2.0, 1.0, 0.5))
+        self.assertEqual([len(level) for level in hierarchy], [2, 4, 8])
+
+        # Each level matches slicing at that resolution on its own.
+        for level, resolution in enumerate(hierarchy.resolutions()):
+            for ts, expected in zip(hierarchy[level], span.generate_slices(resolution)):
+                self.assertEqual(ts.slice_range(), expected.slice_range())
+                self.assertEqual(ts.raw_events(), expected.raw_events())
+                self.assertEqual(list(ts.sliced_events()), list(expected.sliced_events()))
+
+        self.assertEqual(hierarchy.children(0, 1), (2, 4))
+        self.assertEqual(hierarchy.children(1, 3), (6, 8))
+        self.assertEqual(hierarchy.parent(2, 5), 2)
+        self.assertEqual(hierarchy.parent(1, 1), 0)
+        with self.assertRaises(ValueError):
+            hierarchy.children(2, 0)
+        with self.assertRaises(ValueError):
+            span.generate_slices((1.0, 0.75))
+
     def test_is_monophonic(self):
         span1 = mud.Span([
                 (mud.Note('C4', 1), mud.Time(0)),
@@ -129,3 +157,23 @@ class TestSpan(unittest.TestCase):
             ], length=4, offset=4)
         self.assertTrue(not span2.is_monophonic())
 
+
+class TestSpanEquality(unittest.TestCase):
+    def test(self):
+        make_events = lambda: [(mud.Note('C4', 1), mud.Time(0)),
+                               (mud.Rest(      1), mud.Time(1)),
+                               (mud.Note('A4', 2), mud.Time(2))]
+        span = mud.Span(make_events())
+        repeated = mud.Span(make_events(), offset=8)
+        self.assertEqual(span, repeated)
+        self.assertEqual(hash(span), hash(repeated))
+        self.assertEqual(span.content_hash(), repeated.content_hash())
+        self.assertEqual(len({span, repeated}), 1)
+
+        different_pitch = mud.Span(make_events()[:2] + [(mud.Note('A5', 2), mud.Time(2))])
+        different_time = mud.Span(make_events()[:2] + [(mud.Note('A4', 1), mud.Time(3))])
+        padded = mud.Span(make_events(), length=8)
+        for other in (different_pitch, different_time, padded):
+            self.assertNotEqual(span, other)
+            self.assertNotEqual(span.content_hash(), other.content_hash())
+        self.assertNotEqual(span, make_events())
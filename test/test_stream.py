@@ -0,0 +1,91 @@
+import unittest
+import mud
+import mud.fmt.feature as feature
+import mud.fmt.label as label
+import numpy as np
+
+def load(source):
+    ''' Source i has i % 4 items. '''
+    return [(source, item) for item in range(source % 4)]
+
+class TestShuffledStream(unittest.TestCase):
+    def test(self):
+        stream = mud.ShuffledStream(range(30), load, buffer_size=5, seed=2)
+        items = list(stream)
+        expected = [item for source in range(30) for item in load(source)]
+        self.assertEqual(sorted(items), sorted(expected))
+        self.assertNotEqual(items, expected)
+        self.assertEqual(list(stream), items)
+        self.assertEqual(stream.state()['offset'], len(items))
+
+        stream.set_epoch(1)
+        self.assertNotEqual(list(stream), items)
+        self.assertNotEqual(list(mud.ShuffledStream(range(30), load, buffer_size=5, seed=3)), items)
+
+    def test_buffer(self):
+        loaded = []
+        def tracking_load(source):
+            loaded.append(source)
+            return load(source)
+        stream = mud.ShuffledStream(range(30), tracking_load, buffer_size=5, seed=0)
+        iterator = iter(stream)
+        next(iterator)
+        self.assertEqual(len(stream.state()['buffered']), 4)
+        # Only the sources needed to fill the buffer are loaded.
+        self.assertLessEqual(sum(source % 4 for source in loaded), 5 + 2)
+
+    def test_resume(self):
+        stream = mud.ShuffledStream(range(30), load, buffer_size=6, seed=1)
+        items = list(stream)
+        for offset in (0, 1, 7, 20, len(items) - 2, len(items)):
+            stream = mud.ShuffledStream(range(30), load, buffer_size=6, seed=1)
+            iterator = iter(stream)
+            for _ in range(offset):
+                next(iterator)
+            state = stream.state()
+            self.assertEqual(state['offset'], offset)
+
+            resumed = mud.ShuffledStream(range(30), load, buffer_size=6, seed=1)
+            resumed.load_state(state)
+            self.assertEqual(list(resumed), items[offset:])
+
+    def test_workers(self):
+        stream = mud.ShuffledStream(range(12), load, buffer_size=3, seed=0)
+        parallel = mud.ShuffledStream(range(12), load, buffer_size=3, seed=0, workers=2)
+        self.assertEqual(list(parallel), list(stream))
+
+    def test_files(self):
+        formatter = mud.fmt.EventDataBuilder(
+            features=(feature.IsNote(), feature.NoteRelativePitch()),
+            labels  =(label.RelativePitchLabels(),))
+        load_file = mud.FileFormatter(formatter, 0.5, transform=mud.PieceWindows(16))
+        stream = mud.ShuffledStream.from_patterns(('test/test-files/*.mxl',
+                                                   'test/test-files/*.musicxml'),
+                                                  load_file, buffer_size=4, seed=0)
+        self.assertEqual(len(stream.sources), 2)
+        windows = list(stream)
+        piece = mud.fmt.PackedPieceData(mud.Piece('test/test-files/piece.musicxml'), formatter, 0.5)
+        canon = mud.fmt.PackedPieceData(mud.Piece('test/test-files/canon_in_d.mxl'), formatter, 0.5)
+        self.assertEqual(len(windows), (piece.num_timeslices() // 16 or 1)
+                                       + (canon.num_timeslices() // 16 or 1))
+        # Pieces shorter than a window give one shorter window.
+        self.assertEqual(max(len(offsets) for _, _, offsets in windows), 17)
+        for vectors, labels, offsets in windows:
+            self.assertLessEqual(len(offsets), 17)
+            self.assertEqual(len(vectors), offsets[-1])
+            self.assertIsNone(vectors.base)
+            self.assertIsNone(labels.base)
+
+class TestPieceWindows(unittest.TestCase):
+    def test(self):
+        formatter = mud.fmt.EventDataBuilder(features=(feature.IsNote(),), labels=())
+        piece = mud.Piece.from_spans(*[mud.Span([(mud.Note('C4', 4), mud.Time(0))], offset=4 * i)
+                                       for i in range(4)])
+        packed = mud.fmt.PackedPieceData(piece, formatter, 1.0).pack_bits()
+        windows = mud.PieceWindows(4, stride=2)(packed)
+        self.assertEqual(len(windows), 7)
+        for start, (vectors, labels, offsets) in zip(range(0, 16, 2), windows):
+            self.assertTrue(isinstance(vectors, mud.fmt.BitPackedMatrix))
+            self.assertFalse(np.shares_memory(vectors.packed, packed.vectors.packed))
+            self.assertTrue(np.array_equal(vectors.to_dense(),
+                                           packed.vector_matrix()[start:start + 4]))
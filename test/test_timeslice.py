@@ -1,4 +1,5 @@
 import unittest
+import numpy as np
 import mud
 
 class TestTimeSlice(unittest.TestCase):
@@ -65,3 +66,52 @@ class TestTimeSlice(unittest.TestCase):
         self.assertEqual(sliced_events[1].duration(), mud.Time(0.5))
         se1 = mud.SlicedEvent((2.5, 3.0), mud.Event(mud.Note('A4', 2), mud.Time(2)))
         self.assertEqual(sliced_events[1], se1)
+
+class TestSliceMask(unittest.TestCase):
+    def test_mask(self):
+        span = mud.Span([
+            mud.Event(mud.Note('C4', 1), mud.Time(0)),
+            mud.Event(mud.Note('G5', 1), mud.Time(0)),
+            mud.Event(mud.Rest(      1), mud.Time(1)),
+            mud.Event(mud.Note('C4', 2), mud.Time(2)),
+            mud.Event(mud.Note('A4', 2), mud.Time(2)),
+        ])
+        mask = mud.TimeSlice(span, (0.0, 0.5)).mask()
+        self.assertEqual(mask.pitches(), [60, 79])
+        self.assertEqual(mask.onsets, mask.active)
+        self.assertEqual(mask.continuations, 0)
+        self.assertEqual(mask.pitch_classes(), (1 << 0) | (1 << 7))
+
+        mask = mud.TimeSlice(span, (2.5, 3.0)).mask()
+        self.assertEqual(mask.pitches(), [60, 69])
+        self.assertEqual(mask.onsets, 0)
+        self.assertEqual(mask.continuations, mask.active)
+
+        self.assertEqual(mud.TimeSlice(span, (1.0, 1.5)).mask(), mud.SliceMask())
+        self.assertEqual(mud.TimeSlice(span, (2.5, 3.0)).mask(),
+                         mud.TimeSlice(span, (3.0, 3.5)).mask())
+        self.assertEqual(len({mud.TimeSlice(span, (t, t + 0.5)).mask()
+                              for t in (2.5, 3.0, 3.5)}), 1)
+
+    def test_span_slice_masks(self):
+        span = mud.Span([
+            mud.Event(mud.Note('C4', 1), mud.Time(0)),
+            mud.Event(mud.Note('G5', 1), mud.Time(0)),
+            mud.Event(mud.Rest(      1), mud.Time(1)),
+            mud.Event(mud.Note('C4', 2), mud.Time(2)),
+            mud.Event(mud.Note('A4', 2), mud.Time(2)),
+            mud.Event(mud.Note('C8', 0.5), mud.Time(3)),
+        ])
+        low, high = span.slice_masks(0.5)
+        self.assertEqual(low.shape, (8, 3))
+        self.assertEqual(high.shape, (8, 3))
+        self.assertEqual(low.dtype, np.uint64)
+        for i, ts in enumerate(span.generate_slices(0.5)):
+            self.assertEqual(mud.SliceMask.from_words(low[i], high[i]), ts.mask())
+
+        unique_indices, inverse = mud.timeslice.unique_slice_masks(low, high)
+        self.assertEqual(len(unique_indices), 6)
+        self.assertNotEqual(inverse[0], inverse[1])
+        self.assertEqual(inverse[2], inverse[3])
+        self.assertEqual(inverse[5], inverse[7])
+        self.assertNotEqual(inverse[5], inverse[6])